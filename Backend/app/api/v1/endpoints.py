@@ -1,85 +1,146 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from uuid import uuid4
-from datetime import datetime
-from typing import Optional, Literal
-import os, sys, platform, importlib, traceback, logging
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, Response, FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Literal
+import os, sys, time, platform, functools, importlib.metadata, traceback, logging
 
 from app.api.v1.schemas import (
-    AnalyzeResponse, ObjectInfo,
-    DebugVersion, DebugConfig,
+    AnalyzeResponse, ObjectInfo, BatchItemResult, JobStatus, JobResult,
+    DebugVersion, DebugConfig, DebugModels, ModelStatus, DebugExecutor,
+    DebugScheduler, DebugRouting, DebugCache, DebugStorage,
     HistoryList, HistoryItem, BulkDeleteResult,
+    SimilarMatch, SimilarQuery, SimilarResponse,
+)
+from app.services.model_registry import model_registry
+from app.services.onnx_engine import onnx_registry
+from app.services.executor import analysis_executor, QueueFullError, CancelToken, AnalysisCancelled
+from app.services.inference import inference_scheduler, engine_router
+from app.services.pipeline import analyze_upload, cache_result, replay_cached, ImageDecodeError
+from app.services.result_cache import result_cache
+from app.services.render import variant, get_rendered, render_cache, detections_path, FORMATS
+from app.services.batch import analyze_batch
+from app.services.similarity import get_index, describe_upload, METRICS
+from app.services.retention import sweeper
+from app.services.video import (
+    analyze_video, open_video, try_acquire_slot, release_slot, VideoDecodeError, VIDEO_EXTS,
+)
+from app.services.jobs import get_job_backend
+from app.utils.storage import (
+    save_to_disk, stream_to_disk, ingest_upload, content_name, reserve_name, release_pending, touch, UploadRejected,
+)
+from app.utils.encoding import dumps_json, dumps_msgpack, msgpack, MSGPACK_MEDIA_TYPE
+from app.utils.thumbnails import (
+    ensure_thumbnail, thumb_etag, thumb_format, thumb_urls, annotated_thumb_url, MEDIA_TYPES,
 )
-from app.services.inference import run_inference
-from app.services.analytics import compute_statistics
-from app.utils.storage import save_to_disk
-from app.utils.visualize import draw_bboxes
 from app.utils.history import (
-    append_history, list_history, get_history_by_id,
+    list_history_page, get_history_by_id, StaleCursor,
     delete_history_item, clear_history,
 )
+from app.core.metrics import DETECTIONS, ANALYSES_CANCELLED
+from app.core.timing import stage, add_stages
 from app.core.config import settings
 
 router = APIRouter()
 logging.getLogger("uvicorn").info(f"[endpoints] LOADED FROM: {__file__}")
 
 
-@router.post("/analyze", response_model=AnalyzeResponse, summary="Analyze an uploaded image")
+@router.post("/analyze", response_model=AnalyzeResponse, summary="Analyze an uploaded image",
+             responses={200: {"content": {MSGPACK_MEDIA_TYPE: {}}}})
 async def analyze_image(
+    request: Request,
     file: UploadFile = File(...),
     conf: float = Query(0.25, ge=0.0, le=1.0, description="Minimum confidence"),
     max_dets: int = Query(100, ge=1, le=3000, description="Max detections"),
-    detector: Optional[Literal["auto", "yolo", "contour"]] = Query(
-        None, description="Detection engine override (auto|yolo|contour)"
+    detector: Optional[Literal["auto", "yolo", "contour", "onnx"]] = Query(
+        None, description="Detection engine override (auto|yolo|contour|onnx)"
+    ),
+    format: Literal["json", "columnar", "msgpack"] = Query(
+        "json", description="json: AnalyzeResponse; columnar: one array per field (JSON); msgpack: columnar as msgpack"
+    ),
+    budget_ms: Optional[float] = Query(
+        None, gt=0, le=600000, description="Latency target; detector=auto answers with contour when YOLO would miss it"
+    ),
+    timeout_ms: Optional[float] = Query(
+        None, gt=0, le=600000, description="Give up with 504 after this long; the work stops at its next stage"
     ),
 ) -> AnalyzeResponse:
+    # the clock starts when the request arrived, so upload and queueing count against the budget
+    token = CancelToken(getattr(request.state, "received_at", None), timeout_ms or settings.ANALYZE_TIMEOUT_MS or None)
+    budget_ms = budget_ms or settings.ANALYZE_BUDGET_MS or None
     try:
         if not file.content_type or not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="Invalid file type")
+        if format == "msgpack" and msgpack is None:
+            raise HTTPException(status_code=406, detail="msgpack encoding is not available on this server")
 
-        filename = f"{uuid4().hex}_{file.filename}"
-        save_path = os.path.join(settings.UPLOAD_DIR, filename)
-        save_to_disk(file, save_path)
-
-        detections = run_inference(
-            save_path, conf=conf, max_dets=max_dets, detector_override=detector
-        )
+        try:
+            with stage("upload"):
+                upload = await ingest_upload(file)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-        objects: list[ObjectInfo] = []
-        for det in detections:
-            stats = compute_statistics(save_path, det)
-            objects.append(ObjectInfo(
-                label=det.label,
-                confidence=det.confidence,
-                area=stats["area"],
-                histogram=stats["histogram"],
-                bbox=det.bbox,
-            ))
-
-        ann_name = f"annotated_{filename}"
-        ann_path = os.path.join(settings.UPLOAD_DIR, "annotated", ann_name)
-        draw_bboxes(save_path, detections, ann_path)
-
-        hist_id = uuid4().hex
-        entry = {
-            "id": hist_id,
-            "filename": filename,
-            "original_url": f"/static/{filename}",
-            "annotated_url": f"/static/annotated/{ann_name}",
-            "uploaded_at": datetime.utcnow().isoformat() + "Z",
-            "objects_count": len(objects),
-            "labels": sorted(list({o.label for o in objects})),
-            "detector": (detector or settings.DETECTOR or "auto"),
-        }
+        cache_key = result_cache.key(upload.sha256, detector, conf, max_dets)
+        cached = result_cache.get(cache_key)
         try:
-            append_history(entry)
-        except Exception as e:
-            print(f"[history] skip: {e}")
+            if cached is not None:
+                upload.discard()
+                result = await run_in_threadpool(replay_cached, cached, detector)
+            else:
+                filename = reserve_name(file.filename)
+                upload.commit(os.path.join(settings.UPLOAD_DIR, filename))
+                t0 = time.perf_counter()
+                result = await analysis_executor.run_cancellable(
+                    token, request.is_disconnected,
+                    analyze_upload, None, file.filename,
+                    conf=conf, max_dets=max_dets, detector=detector,
+                    sha256=upload.sha256, filename=filename, budget_ms=budget_ms, token=token,
+                )
+                worker = result.pop("timings", {})
+                # whatever the worker didn't spend analyzing was spent waiting for a slot
+                worker["queue"] = max(0.0, (time.perf_counter() - t0) * 1000.0 - worker.get("analyze", 0.0))
+                add_stages(worker)
+                cache_result(cache_key, result)
+            DETECTIONS.labels(result["route"]["engine"] or "auto").inc(len(result["detections"]))
+        except QueueFullError:
+            upload.discard()
+            raise HTTPException(
+                status_code=settings.ANALYZE_REJECT_STATUS,
+                detail="Analysis queue is full, retry later",
+                headers={"Retry-After": str(settings.ANALYZE_RETRY_AFTER)},
+            )
+        except AnalysisCancelled as e:
+            # stopped before its commit point: nothing but the upload was written
+            upload.discard()
+            reason = token.reason or str(e) or "cancelled"
+            ANALYSES_CANCELLED.labels(reason).inc()
+            if reason == "timeout":
+                raise HTTPException(status_code=504, detail="Analysis timed out")
+            raise HTTPException(status_code=499, detail="Client closed request")
+        except ImageDecodeError:
+            raise HTTPException(status_code=400, detail="Could not decode image")
+
+        if format != "json":
+            payload = {
+                "message": "analysis_complete",
+                "annotated_url": result["annotated_url"],
+                "history_id": result["history_id"],
+                "engine": result["route"]["engine"],
+                "engine_reason": result["route"]["reason"],
+                **result["detections"].to_columnar(),
+            }
+            with stage("encode"):
+                if format == "msgpack":
+                    return Response(content=dumps_msgpack(payload), media_type=MSGPACK_MEDIA_TYPE)
+                return Response(content=dumps_json(payload), media_type="application/json")
 
         return AnalyzeResponse(
             message="analysis_complete",
-            objects=objects,
-            annotated_url=f"/static/annotated/{ann_name}",
-            history_id=hist_id,
+            objects=[ObjectInfo(**o) for o in result["detections"].to_objects()],
+            annotated_url=result["annotated_url"],
+            history_id=result["history_id"],
+            engine=result["route"]["engine"],
+            engine_reason=result["route"]["reason"],
         )
 
     except HTTPException:
@@ -89,32 +150,182 @@ async def analyze_image(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# debug
-def _safe_version(mod_name: str) -> str | None:
-    try:
-        m = importlib.import_module(mod_name)
-        return getattr(m, "__version__", "unknown")
-    except Exception:
-        return None
+@router.post("/analyze/batch", summary="Analyze many images (or a zip), streaming NDJSON results")
+async def analyze_image_batch(
+    files: List[UploadFile] = File(..., description="Images and/or zip archives"),
+    conf: float = Query(0.25, ge=0.0, le=1.0, description="Minimum confidence"),
+    max_dets: int = Query(100, ge=1, le=3000, description="Max detections"),
+    detector: Optional[Literal["auto", "yolo", "contour", "onnx"]] = Query(
+        None, description="Detection engine override (auto|yolo|contour|onnx)"
+    ),
+) -> StreamingResponse:
+    async def lines():
+        async for item in analyze_batch(files, conf=conf, max_dets=max_dets, detector=detector):
+            yield BatchItemResult(**item).json() + "\n"
 
-@router.get("/debug/version", response_model=DebugVersion, summary="Runtime & package versions")
-async def debug_version() -> DebugVersion:
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/analyze/video", summary="Analyze sampled video frames, streaming NDJSON results")
+async def analyze_video_file(
+    file: UploadFile = File(...),
+    conf: float = Query(0.25, ge=0.0, le=1.0, description="Minimum confidence"),
+    max_dets: int = Query(100, ge=1, le=3000, description="Max detections per frame"),
+    detector: Optional[Literal["auto", "yolo", "contour", "onnx"]] = Query(
+        None, description="Detection engine override (auto|yolo|contour|onnx)"
+    ),
+    every: Optional[int] = Query(None, ge=1, description="Analyze every Nth frame"),
+    fps: Optional[float] = Query(None, gt=0.0, le=240.0, description="Analyze this many frames per second"),
+    scene: Optional[float] = Query(
+        None, ge=0.0, le=1.0,
+        description="Keep only frames differing from the last kept one by this much (0-1, default VIDEO_SCENE_THRESHOLD)",
+    ),
+) -> StreamingResponse:
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if not ((file.content_type or "").startswith("video/") or ext in VIDEO_EXTS):
+        raise HTTPException(status_code=400, detail="Invalid file type")
+    if not try_acquire_slot():
+        raise HTTPException(
+            status_code=settings.ANALYZE_REJECT_STATUS,
+            detail="Too many video analyses running, retry later",
+            headers={"Retry-After": str(settings.ANALYZE_RETRY_AFTER)},
+        )
+    streaming = False
+    filename = ""
     try:
-        import cv2
-        opencv_ver = getattr(cv2, "__version__", "unknown")
-    except Exception:
-        opencv_ver = None
+        filename = reserve_name(file.filename or "video")
+        path = os.path.join(settings.UPLOAD_DIR, filename)
+        try:
+            await stream_to_disk(file, path, settings.VIDEO_MAX_BYTES)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        try:
+            cap, info = await run_in_threadpool(open_video, path)
+        except VideoDecodeError:
+            os.remove(path)
+            raise HTTPException(status_code=400, detail="Could not decode video")
+        if settings.MAX_IMAGE_PIXELS and info.width * info.height > settings.MAX_IMAGE_PIXELS:
+            cap.release()
+            os.remove(path)
+            raise HTTPException(status_code=413, detail=f"Frames too large: {info.width}x{info.height}")
+        if scene is None and settings.VIDEO_SCENE_THRESHOLD > 0:
+            scene = settings.VIDEO_SCENE_THRESHOLD
+        if scene is None and not (every or fps):
+            fps = settings.VIDEO_SAMPLE_FPS
+        state = {"started": False, "released": False}
+
+        def cleanup() -> None:
+            # from the generator's finally or, if the body was never iterated (client gone before
+            # the first chunk), from the response's background task; whichever runs first
+            if state["released"]:
+                return
+            state["released"] = True
+            if not state["started"]:
+                cap.release()  # once started, analyze_video's reader owns the capture and the file
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                release_pending([filename])
+            release_slot()
+
+        async def lines():
+            state["started"] = True
+            try:
+                async for item in analyze_video(
+                    path, filename, cap, info, conf=conf, max_dets=max_dets, detector=detector,
+                    every=every, fps=fps, scene_threshold=scene,
+                ):
+                    yield dumps_json(item) + b"\n"
+            finally:
+                cleanup()
+
+        streaming = True
+        return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(cleanup))
+    finally:
+        if not streaming:
+            release_pending([filename])
+            release_slot()
+
+
+@router.post("/jobs", response_model=JobStatus, status_code=202, summary="Queue images for background analysis")
+async def submit_job(
+    files: List[UploadFile] = File(...),
+    conf: float = Query(0.25, ge=0.0, le=1.0, description="Minimum confidence"),
+    max_dets: int = Query(100, ge=1, le=3000, description="Max detections"),
+    detector: Optional[Literal["auto", "yolo", "contour", "onnx"]] = Query(
+        None, description="Detection engine override (auto|yolo|contour|onnx)"
+    ),
+    priority: int = Query(5, ge=0, le=9, description="0 = lowest, 9 = most urgent"),
+    chunk_size: Optional[int] = Query(None, ge=1, le=256, description="Images per worker task"),
+) -> JobStatus:
+    items, rejected = [], []
+    for i, f in enumerate(files):
+        base = {"index": i, "filename": f.filename, "objects": [], "message": "analysis_failed"}
+        if not f.content_type or not f.content_type.startswith("image/"):
+            rejected.append({**base, "error": "Invalid file type"})
+            continue
+        try:
+            upload = await ingest_upload(f)
+        except UploadRejected as e:
+            rejected.append({**base, "error": e.detail})
+            continue
+        filename = reserve_name(f.filename)
+        upload.commit(os.path.join(settings.UPLOAD_DIR, filename))
+        items.append({"index": i, "filename": filename, "original_name": f.filename, "sha256": upload.sha256})
+
+    backend = get_job_backend()
+    params = {"conf": conf, "max_dets": max_dets, "detector": detector}
+    job_id = await run_in_threadpool(
+        backend.submit, items, rejected, params, priority, chunk_size or settings.JOBS_CHUNK_SIZE
+    )
+    return JobStatus(**backend.status(job_id))
+
+@router.get("/jobs/{job_id}", response_model=JobStatus, summary="Job progress")
+def job_status(job_id: str) -> JobStatus:
+    status = get_job_backend().status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return JobStatus(**status)
+
+@router.get("/jobs/{job_id}/result", response_model=JobResult, summary="Per-image results (partial while running)")
+def job_result(job_id: str) -> JobResult:
+    result = get_job_backend().result(job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return JobResult(**result)
+
+
+# debug
+OPENCV_DISTS = ("opencv-python", "opencv-python-headless", "opencv-contrib-python", "opencv-contrib-python-headless")
+
+def _safe_version(mod_name: str, *dists: str) -> str | None:
+    # package metadata, not an import: importing torch/ultralytics just for this takes seconds
+    for dist in dists or (mod_name,):
+        try:
+            return importlib.metadata.version(dist)
+        except importlib.metadata.PackageNotFoundError:
+            continue
+    m = sys.modules.get(mod_name)
+    return getattr(m, "__version__", "unknown") if m is not None else None
+
+@functools.lru_cache(maxsize=1)
+def _versions() -> DebugVersion:
     return DebugVersion(
         python=sys.version.split()[0],
         fastapi=_safe_version("fastapi"),
         uvicorn=_safe_version("uvicorn"),
         numpy=_safe_version("numpy"),
-        opencv=opencv_ver,
+        opencv=_safe_version("cv2", *OPENCV_DISTS),
         torch=_safe_version("torch"),
         ultralytics=_safe_version("ultralytics"),
         platform=platform.platform(),
     )
 
+@router.get("/debug/version", response_model=DebugVersion, summary="Runtime & package versions (cached)")
+async def debug_version() -> DebugVersion:
+    return _versions()
+
 @router.get("/debug/config", response_model=DebugConfig, summary="Safe configuration snapshot")
 async def debug_config() -> DebugConfig:
     return DebugConfig(
@@ -124,37 +335,204 @@ async def debug_config() -> DebugConfig:
         cors_origins=[o for o in settings.CORS_ORIGINS],
     )
 
+@router.get("/debug/models", response_model=DebugModels, summary="Resident models & warmup state")
+async def debug_models() -> DebugModels:
+    return DebugModels(
+        capacity=model_registry.capacity,
+        models=[ModelStatus(**m) for m in model_registry.status()]
+        + [ModelStatus(engine="onnx", **m) for m in onnx_registry.status()],
+    )
+
+@router.get("/debug/executor", response_model=DebugExecutor, summary="Analysis pool queue depth & utilization")
+async def debug_executor() -> DebugExecutor:
+    return DebugExecutor(**analysis_executor.stats())
+
+@router.get("/debug/cache", response_model=DebugCache, summary="Duplicate-upload result cache counters")
+async def debug_cache() -> DebugCache:
+    return DebugCache(**result_cache.stats(), render=render_cache.stats())
+
+@router.get("/debug/storage", response_model=DebugStorage, summary="Disk usage and background sweeper counters")
+async def debug_storage() -> DebugStorage:
+    return DebugStorage(**sweeper.stats())
+
+@router.get("/debug/scheduler", response_model=DebugScheduler, summary="Inference micro-batching histograms")
+async def debug_scheduler() -> DebugScheduler:
+    return DebugScheduler(**inference_scheduler.stats())
+
+@router.get("/debug/routing", response_model=DebugRouting, summary="detector=auto latency estimates and decisions")
+async def debug_routing() -> DebugRouting:
+    return DebugRouting(**engine_router.stats())
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    return inm.strip() == "*" or f'"{etag}"' in [t.strip().removeprefix("W/") for t in inm.split(",")]
+
+def _history_item(entry: dict) -> HistoryItem:
+    return HistoryItem(**{**entry, **thumb_urls(entry.get("filename")),
+                          "annotated_thumb_url": annotated_thumb_url(entry.get("annotated_url"))})
+
+
+@router.get("/annotated/{result_id}", summary="Annotated image, rendered on first request and cached",
+            responses={200: {"content": {m: {} for m in FORMATS.values()}}, 304: {}})
+def annotated_image(
+    result_id: str,
+    request: Request,
+    conf: Optional[float] = Query(None, ge=0.0, le=1.0, description="Hide boxes below this confidence"),
+    labels: Optional[str] = Query(None, description="Comma-separated labels to keep"),
+    max_width: Optional[int] = Query(None, ge=16, le=8192, description="Downscale to this width"),
+    format: Optional[Literal["jpg", "png", "webp"]] = Query(None, description="Defaults to the upload's type"),
+) -> Response:
+    label_list = [s.strip() for s in labels.split(",") if s.strip()] if labels else None
+    found = variant(result_id, conf=conf, labels=label_list, max_width=max_width, fmt=format)
+    if found is None:
+        raise HTTPException(status_code=404, detail="annotated image not found")
+    etag, path, fmt, sidecar = found
+    headers = {"ETag": f'"{etag}"', "Cache-Control": f"public, max-age={settings.RENDER_MAX_AGE}"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    data = get_rendered(sidecar, path, conf=conf, labels=label_list, max_width=max_width, fmt=fmt)
+    if data is None:
+        raise HTTPException(status_code=404, detail="original image not found")
+    touch(os.path.join(settings.UPLOAD_DIR, sidecar["filename"]))
+    return Response(content=data, media_type=FORMATS[fmt], headers=headers)
+
+
+@router.get("/thumbs/{size}/{filename:path}", summary="Small / medium thumbnail of a stored upload",
+            responses={200: {"content": {m: {} for m in MEDIA_TYPES.values()}}, 304: {}})
+def thumbnail(size: Literal["small", "medium"], filename: str, request: Request) -> Response:
+    etag = thumb_etag(filename, size)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": f"public, max-age={settings.THUMB_MAX_AGE}, immutable"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    path = ensure_thumbnail(filename, size)
+    if path is None:
+        raise HTTPException(status_code=404, detail="image not found")
+    touch(os.path.join(settings.UPLOAD_DIR, filename))
+    return FileResponse(path, media_type=MEDIA_TYPES[thumb_format()], headers=headers)
+
+
+def _annotated_url(result_id: str) -> Optional[str]:
+    # the URL /analyze and history gave out for this result: eager static copy or lazy render
+    entry = get_history_by_id(result_id)
+    if entry:
+        return entry.get("annotated_url")
+    # first entry deleted, files kept for a cached replay of it: only a lazy result still renders
+    return f"/api/v1/annotated/{result_id}" if os.path.exists(detections_path(result_id)) else None
+
+def _matches(found: List[dict]) -> List[SimilarMatch]:
+    urls = {rid: _annotated_url(rid) for rid in {m["result_id"] for m in found}}
+    return [SimilarMatch(**m, annotated_url=urls[m["result_id"]]) for m in found]
+
+def _label_filter(label: Optional[str]) -> Optional[List[str]]:
+    return [s.strip() for s in label.split(",") if s.strip()] if label else None
+
+
+@router.get("/search/similar", response_model=SimilarResponse, summary="Objects with the most similar histograms")
+def search_similar(
+    history_id: str = Query(..., description="History entry holding the query object"),
+    object: int = Query(0, ge=0, description="Index of the object in that entry's results"),
+    k: int = Query(10, ge=1, le=1000),
+    label: Optional[str] = Query(None, description="Comma-separated labels to search among"),
+    metric: Literal["l2", "cosine", "intersection"] = Query("l2"),
+) -> SimilarResponse:
+    entry = get_history_by_id(history_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="history item not found")
+    index = get_index()
+    query = index.get(entry.get("result_id") or entry["id"], object)
+    if query is None:
+        raise HTTPException(status_code=404, detail="object not indexed")
+    found = index.search(query["vector"], k=k, labels=_label_filter(label), metric=metric, exclude_row=query["row"])
+    return SimilarResponse(
+        metric=metric, indexed=index.stats()["live"],
+        queries=[SimilarQuery(object=object, label=query["label"], bbox=query["bbox"], matches=_matches(found))],
+    )
+
+
+@router.post("/search/similar", response_model=SimilarResponse, summary="Search with the objects found in an upload")
+async def search_similar_upload(
+    file: UploadFile = File(...),
+    object: Optional[int] = Query(None, ge=0, description="Only this detected object (default: the first `max_queries`)"),
+    max_queries: int = Query(5, ge=1, le=100),
+    k: int = Query(10, ge=1, le=1000),
+    label: Optional[str] = Query(None, description="Comma-separated labels to search among"),
+    metric: Literal["l2", "cosine", "intersection"] = Query("l2"),
+    conf: float = Query(0.25, ge=0.0, le=1.0),
+    detector: Optional[Literal["auto", "yolo", "contour", "onnx"]] = Query(None),
+) -> SimilarResponse:
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid file type")
+    try:
+        upload = await ingest_upload(file)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        dets = await analysis_executor.run(describe_upload, upload.tmp_path, conf, 100, detector)
+    except QueueFullError:
+        raise HTTPException(
+            status_code=settings.ANALYZE_REJECT_STATUS,
+            detail="Analysis queue is full, retry later",
+            headers={"Retry-After": str(settings.ANALYZE_RETRY_AFTER)},
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    finally:
+        upload.discard()  # query images are not stored
+    objects = [object] if object is not None else list(range(min(max_queries, len(dets))))
+    if any(i >= len(dets) for i in objects):
+        raise HTTPException(status_code=404, detail="object not found in upload")
+    index = get_index()
+    labels = _label_filter(label)
+    queries = []
+    for i in objects:
+        if dets.valid is not None and not dets.valid[i]:
+            continue
+        found = await run_in_threadpool(index.search, dets.histograms[i], k, labels, metric)
+        queries.append(SimilarQuery(object=i, label=dets.labels[i], bbox=dets.boxes[i].tolist(), matches=_matches(found)))
+    return SimilarResponse(metric=metric, indexed=index.stats()["live"], queries=queries)
+
 
 @router.get("/history", response_model=HistoryList, summary="List recent uploads")
-async def history_list(limit: int = Query(20, ge=1, le=200)) -> HistoryList:
-    items = list_history(limit=limit)
-    return HistoryList(items=[HistoryItem(**it) for it in items])
+def history_list(
+    limit: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    label: Optional[str] = Query(None, description="Only uploads containing this label"),
+) -> HistoryList:
+    try:
+        items, next_cursor = list_history_page(limit=limit, cursor=cursor, label=label)
+    except StaleCursor as e:
+        raise HTTPException(status_code=400, detail=f"Stale cursor: {e}")
+    return HistoryList(items=[_history_item(it) for it in items], next_cursor=next_cursor)
 
 @router.get("/history/{hid}", response_model=HistoryItem, summary="Get a single upload by id")
-async def history_detail(hid: str) -> HistoryItem:
+def history_detail(hid: str) -> HistoryItem:
     item = get_history_by_id(hid)
     if not item:
         raise HTTPException(status_code=404, detail="history item not found")
-    return HistoryItem(**item)
+    return _history_item(item)
 
 @router.delete("/history/{hid}", response_model=HistoryItem, summary="Delete one history item & its files")
-async def history_delete_one(hid: str) -> HistoryItem:
+def history_delete_one(hid: str) -> HistoryItem:
     item = delete_history_item(hid)
     if not item:
         raise HTTPException(status_code=404, detail="history item not found")
     return HistoryItem(**item)
 
-@router.delete("/history", response_model=BulkDeleteResult, summary="Clear all history & files")
-async def history_clear_all() -> BulkDeleteResult:
+@router.delete("/history", response_model=BulkDeleteResult, status_code=202,
+               summary="Clear all history; files are removed in the background")
+def history_clear_all() -> BulkDeleteResult:
     n = clear_history()
-    return BulkDeleteResult(deleted=n)
+    return BulkDeleteResult(deleted=n, files_pending=True)
 
 
 # smoke analyze
 @router.post("/analyze_smoke")
 async def analyze_smoke(file: UploadFile = File(...)):
     try:
-        filename = f"smoke_{uuid4().hex}_{file.filename}"
+        filename = content_name(file.filename, prefix="smoke_")  # never in history: swept as an orphan
         path = os.path.join(settings.UPLOAD_DIR, filename)
         save_to_disk(file, path)
         return {"ok": True, "original_url": f"/static/{filename}"}
@@ -166,7 +544,7 @@ async def analyze_smoke(file: UploadFile = File(...)):
 async def analyze_min(file: UploadFile = File(...)):
     try:
         from app.models.detection import _detect_contour
-        filename = f"min_{uuid4().hex}_{file.filename}"
+        filename = content_name(file.filename, prefix="min_")
         path = os.path.join(settings.UPLOAD_DIR, filename)
         save_to_disk(file, path)
         dets = _detect_contour(path)
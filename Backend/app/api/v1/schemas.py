@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 import logging
 
@@ -16,6 +16,26 @@ class AnalyzeResponse(BaseModel):
     objects: List[ObjectInfo]
     annotated_url: Optional[str] = None
     history_id: Optional[str] = None
+    engine: Optional[str] = None  # detector that produced `objects`
+    engine_reason: Optional[str] = None  # why: requested, default, within_budget, over_budget, yolo_cold, ...
+
+class BatchItemResult(AnalyzeResponse):
+    index: int
+    filename: str
+    error: Optional[str] = None
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    priority: int
+    total: int
+    completed: int
+    failed: int
+    created_at: str
+    finished_at: Optional[str] = None
+
+class JobResult(JobStatus):
+    items: List[BatchItemResult]
 
 class DebugVersion(BaseModel):
     python: str
@@ -33,17 +53,137 @@ class DebugConfig(BaseModel):
     upload_dir: str
     cors_origins: List[str]
 
+class ModelStatus(BaseModel):
+    engine: str = "yolo"
+    weights: str
+    device: str
+    loaded: bool
+    warm: bool
+    load_seconds: Optional[float] = None
+    warm_seconds: Optional[float] = None
+    last_used: Optional[float] = None
+    error: Optional[str] = None
+
+class DebugModels(BaseModel):
+    capacity: int
+    models: List[ModelStatus]
+
+class DebugExecutor(BaseModel):
+    kind: str
+    workers: int
+    queue_size: int
+    running: int
+    queued: int
+    utilization: float
+    completed: int
+    rejected: int
+
+class HistogramSnapshot(BaseModel):
+    buckets: List[float]
+    counts: List[int]
+    count: int
+    sum: float
+
+class DebugScheduler(BaseModel):
+    max_batch: int
+    max_wait_ms: float
+    pending: int
+    batch_size: HistogramSnapshot
+    wait_ms: HistogramSnapshot
+    predict_ms: HistogramSnapshot
+
+class EngineLatency(BaseModel):
+    estimate_ms: float
+    samples: int
+
+class RouteCount(BaseModel):
+    engine: str
+    reason: str
+    count: int
+
+class DebugRouting(BaseModel):
+    latency: Dict[str, EngineLatency]
+    yolo_estimate_ms: float
+    yolo_cooldown: bool
+    decisions: List[RouteCount]
+
+class RenderCacheStats(BaseModel):
+    memory_entries: int
+    memory_bytes: int
+    disk_entries: Optional[int] = None
+    disk_bytes: Optional[int] = None
+    hits: int
+    disk_hits: int
+    misses: int
+
+class DebugCache(BaseModel):
+    entries: int
+    max_entries: int
+    ttl_seconds: float
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    render: Optional[RenderCacheStats] = None
+
+class SweepResult(BaseModel):
+    expired: int = 0
+    evicted: int = 0
+    orphans: int = 0
+    freed_bytes: int = 0
+    usage_bytes: int = 0
+    took_ms: float = 0.0
+    at: Optional[float] = None
+
+class DebugStorage(BaseModel):
+    running: bool
+    interval_seconds: float
+    ttl_hours: float
+    quota_bytes: int
+    usage_bytes: Optional[int] = None
+    runs: int
+    removed_entries: int
+    removed_files: int
+    freed_bytes: int
+    last: Optional[SweepResult] = None
+
+class SimilarMatch(BaseModel):
+    result_id: str
+    object: int
+    label: str
+    bbox: List[int]
+    distance: float
+    annotated_url: Optional[str] = None
+
+class SimilarQuery(BaseModel):
+    object: int
+    label: str
+    bbox: List[int]
+    matches: List[SimilarMatch]
+
+class SimilarResponse(BaseModel):
+    metric: str
+    indexed: int
+    queries: List[SimilarQuery]
+
 class HistoryItem(BaseModel):
     id: str
     filename: str
     original_url: Optional[str] = None
     annotated_url: Optional[str] = None
+    thumb_small_url: Optional[str] = None
+    thumb_medium_url: Optional[str] = None
+    annotated_thumb_url: Optional[str] = None  # small annotated render for galleries
     uploaded_at: str
     objects_count: int
     labels: List[str]
+    engine: Optional[str] = None
+    engine_reason: Optional[str] = None
 
 class HistoryList(BaseModel):
     items: List[HistoryItem]
+    next_cursor: Optional[str] = None
 
 class BulkDeleteResult(BaseModel):
     deleted: int
+    files_pending: bool = False  # files are still being removed in the background
@@ -10,11 +10,136 @@ class Settings(BaseSettings):
 
     DETECTOR: str = "auto"
     MODEL_WEIGHTS: str = "yolov8n.pt"
+    MODEL_DEVICE: str = ""
+    MODEL_CACHE_SIZE: int = 2
+    MODEL_WARMUP: bool = True
+    MODEL_WARMUP_IMGSZ: int = 640
+    INFER_BATCH_SIZE: int = 8  # 1 disables micro-batching
+    INFER_BATCH_WAIT_MS: float = 4.0
+
+    # detector=onnx: MODEL_WEIGHTS exported once to ONNX and run on onnxruntime (CPU)
+    ONNX_CACHE_DIR: str = ""  # default: .onnx_cache next to the weights
+    ONNX_IMGSZ: int = 640
+    ONNX_QUANTIZE: bool = False  # dynamic int8 weights
+    ONNX_INTRA_THREADS: int = 0  # 0 = onnxruntime default
+    ONNX_INTER_THREADS: int = 0
+    ONNX_NMS_IOU: float = 0.45
+
+    CONTOUR_MAX_SIDE: int = 1024  # contour engine works on a copy this large (0 = full size)
+    CONTOUR_MIN_AREA: int = 100  # px at full resolution
+    CONTOUR_MIN_SCORE: float = 0.0
+    CONTOUR_MERGE: str = "nms"  # nms | union | none
+    CONTOUR_NMS_IOU: float = 0.3
+    CONTOUR_MERGE_OVERLAP: float = 0.5  # union: share of the smaller box that must overlap
+    CONTOUR_MAX_CANDIDATES: int = 2000
+    CONTOUR_MAX_BOXES: int = 300  # 0 = only max_dets caps the output
+
+    TILE_MODE: str = "auto"  # auto (images >= TILE_MIN_PIXELS) | on | off
+    TILE_MIN_PIXELS: int = 40_000_000
+    TILE_SIZE: int = 1024
+    TILE_OVERLAP: int = 128  # should exceed the largest object you expect to be cut
+    TILE_WORKERS: int = 4
+    TILE_NMS_IOU: float = 0.5
+
+    STORAGE_SHARD_DEPTH: int = 2  # uploads under files/ab/cd/; 0 = flat UPLOAD_DIR (old layout)
+    STORAGE_TTL_HOURS: float = 0.0  # entries older than this are removed; 0 = keep forever
+    STORAGE_QUOTA_BYTES: int = 0  # total upload size; least recently used entries go first; 0 = no limit
+    STORAGE_QUOTA_LOW: float = 0.9  # evict down to this share of the quota
+    STORAGE_SWEEP_INTERVAL: float = 600.0  # seconds between background sweeps; 0 = off
+    STORAGE_SWEEP_BATCH: int = 500  # history entries deleted per batch
+    STORAGE_ORPHAN_GRACE: float = 3600.0  # unreferenced files younger than this are left alone
+    STORAGE_PENDING_MAX_AGE: float = 86400.0  # uploads still waiting for their history entry are kept this long
+
+    MAX_UPLOAD_BYTES: int = 100 * 1024 * 1024
+    MAX_IMAGE_PIXELS: int = 250_000_000  # decompression-bomb guard, checked from the header
+
+    ANALYZE_EXECUTOR: str = "thread"  # thread | process
+    ANALYZE_WORKERS: int = 2
+    ANALYZE_QUEUE_SIZE: int = 8
+    ANALYZE_REJECT_STATUS: int = 503
+    ANALYZE_RETRY_AFTER: int = 2
+    ANALYZE_BUDGET_MS: float = 0.0  # default /analyze latency budget for detector=auto; 0 = none
+    ANALYZE_TIMEOUT_MS: float = 0.0  # default /analyze timeout (504); 0 = none
+    CANCEL_POLL_MS: float = 50.0  # how often a waiting request checks for a client disconnect
+
+    # detector=auto with a budget: per-engine latency estimates (EWMA, priors until measured)
+    ROUTE_EWMA_ALPHA: float = 0.2
+    ROUTE_YOLO_PRIOR_MS: float = 250.0
+    ROUTE_CONTOUR_PRIOR_MS: float = 30.0
+    ROUTE_FAILURE_COOLDOWN: float = 30.0  # seconds auto skips YOLO after it failed
+
+    HISTORY_BACKEND: str = "jsonl"  # jsonl | sqlite
+    HISTORY_DB_PATH: str = ""  # default: <UPLOAD_DIR>/history.db
+    HISTORY_AUTO_IMPORT: bool = True  # seed an empty sqlite db from history.jsonl
+    HISTORY_COMPACT_RATIO: float = 0.3  # jsonl: compact once this share of lines is dead
+    HISTORY_COMPACT_MIN_DEAD: int = 1000
+
+    RESULT_CACHE_SIZE: int = 1024  # 0 disables the duplicate-upload cache
+    RESULT_CACHE_TTL: float = 3600.0
+
+    # annotated images are rendered on first request; True writes them during /analyze as before
+    EAGER_ANNOTATE: bool = False
+    RENDER_CACHE_MEM_BYTES: int = 64 * 1024 * 1024
+    RENDER_CACHE_DISK_BYTES: int = 1024 * 1024 * 1024
+    RENDER_MAX_AGE: int = 86400
+    RENDER_JPEG_QUALITY: int = 90
+
+    THUMB_SMALL: int = 160  # longest side, px
+    THUMB_MEDIUM: int = 480
+    THUMB_FORMAT: str = "webp"  # webp | jpg
+    THUMB_QUALITY: int = 80
+    THUMBS_AT_INGEST: bool = False  # False: generated on first request
+    THUMB_MAX_AGE: int = 31536000  # stored filenames are unique, so thumbnails never change
+
+    BATCH_MAX_IN_FLIGHT: int = 4
+    BATCH_HISTORY_FLUSH: int = 32
+    BATCH_RETRY_DELAY_MS: int = 20
+
+    VIDEO_MAX_BYTES: int = 1024 * 1024 * 1024
+    VIDEO_MAX_FRAMES: int = 3000  # sampled frames per video
+    VIDEO_SAMPLE_FPS: float = 2.0  # default sampling rate
+    VIDEO_SCENE_THRESHOLD: float = 0.0  # default `scene` for /analyze/video: mean abs difference (0-1) of a new scene; 0 = off
+    VIDEO_QUEUE_SIZE: int = 16  # decoded frames buffered ahead of inference
+    VIDEO_WORKERS: int = 8  # frames in inference at once; YOLO coalesces them into batches
+    VIDEO_MAX_ACTIVE: int = 2  # concurrent video analyses, more get ANALYZE_REJECT_STATUS
+
+    SIMILARITY_INDEX: bool = True  # store object histograms for /search/similar
+    SIMILARITY_DIR: str = ""  # default: <UPLOAD_DIR>/index
+    SIMILARITY_CHUNK_ROWS: int = 262144  # rows scored per step; bounds scratch memory
+
+    # python -m app.serve: the parent loads and warms the model once, workers are forked from it
+    SERVE_HOST: str = "0.0.0.0"
+    SERVE_PORT: int = 8000
+    SERVE_WORKERS: int = 1
+    SERVE_PRELOAD: bool = True  # False: every worker loads its own copy (needed for CUDA)
+    SERVE_TORCH_THREADS: int = 0  # intra-op threads per worker; 0 = cpu count / workers
+    SERVE_GRACEFUL_TIMEOUT: float = 30.0  # seconds workers get to finish on shutdown
+
+    SERVER_TIMING: bool = True  # per-stage Server-Timing header on every response
+    PROFILE_REQUESTS: bool = False  # sample requests sent with an X-Profile header
+    PROFILE_INTERVAL_MS: float = 5.0
+    PROFILE_KEEP: int = 50  # newest profiles kept under UPLOAD_DIR/profiles; 0 = no limit
+
+    # empty BROKER_URL -> jobs run on an in-process queue
+    BROKER_URL: str = ""
+    RESULT_BACKEND_URL: str = ""
+    REDIS_URL: str = ""  # legacy name, used for both when set
+    JOBS_LOCAL_WORKERS: int = 1
+    JOBS_CHUNK_SIZE: int = 8
+    JOBS_KEEP_SECONDS: float = 3600.0
 
     class Config:
         env_file = ".env"
         case_sensitive = False
 
+    @property
+    def broker_url(self) -> str:
+        return self.BROKER_URL or self.REDIS_URL
+
+    @property
+    def result_backend_url(self) -> str:
+        return self.RESULT_BACKEND_URL or self.REDIS_URL or self.BROKER_URL
+
     @validator("CORS_ORIGINS", pre=True)
     def parse_cors(cls, v: Union[str, List[str]]) -> List[str]:
         if isinstance(v, list):
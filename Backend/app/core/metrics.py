@@ -0,0 +1,191 @@
+import bisect, threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "counts": list(self._counts),
+                "count": self._count,
+                "sum": self._sum,
+            }
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge(Counter):
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = float(value)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+
+LabelValues = Tuple[str, ...]
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    """A named counter, gauge or histogram, optionally split by labels.
+
+    Children are created on first use of `labels(...)`; an unlabelled metric has one child
+    and forwards inc/set/observe to it. `fn` makes it computed at scrape time instead: it
+    returns a number, or a {label values: number} dict for labelled metrics.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_MS_BUCKETS,
+        fn: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.fn = fn
+        self._children: Dict[LabelValues, Any] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames and fn is None:
+            self._children[()] = self._new()  # exported as 0 before the first event
+
+    def _new(self) -> Any:
+        if self.kind == "histogram":
+            return Histogram(self.buckets)
+        return Gauge() if self.kind == "gauge" else Counter()
+
+    def labels(self, *values: Any) -> Any:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new())
+        return child
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _values(self) -> Dict[LabelValues, Any]:
+        if self.fn is None:
+            with self._lock:
+                return dict(self._children)
+        try:
+            got = self.fn()
+        except Exception as e:
+            print(f"[metrics] {self.name}: {e}")
+            return {}
+        return got if isinstance(got, dict) else {(): got}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._values().items()):
+            key = tuple(str(v) for v in (key if isinstance(key, tuple) else (key,)))
+            if self.kind != "histogram":
+                value = child.value() if isinstance(child, Counter) else child
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {_fmt(value)}")
+                continue
+            snap = child.snapshot()
+            acc = 0
+            for le, n in zip(list(snap["buckets"]) + [float("inf")], snap["counts"]):
+                acc += n
+                le_label = 'le="%s"' % _fmt(le)
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le_label)} {acc}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {_fmt(snap['sum'])}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {snap['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "") -> None:
+        self.prefix = prefix
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, kind: str, name: str, help: str, **kwargs: Any) -> Metric:
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(kind, name, help, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable[[], Any]] = None) -> Metric:
+        return self._add("counter", name, help, labelnames=labelnames, fn=fn)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable[[], Any]] = None) -> Metric:
+        return self._add("gauge", name, help, labelnames=labelnames, fn=fn)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_MS_BUCKETS) -> Metric:
+        return self._add("histogram", name, help, labelnames=labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics = MetricsRegistry(prefix="imageanalyzer_")
+
+REQUESTS = metrics.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_MS = metrics.histogram("http_request_duration_ms", "Time to response headers, ms", ("route",))
+STAGE_MS = metrics.histogram("stage_duration_ms", "Analysis stage latency, ms", ("stage",))
+DETECTIONS = metrics.counter("detections_total", "Objects returned by /analyze", ("detector",))
+FALLBACKS = metrics.counter("contour_fallbacks_total", "YOLO failures answered by the contour detector")
+ANALYSES_CANCELLED = metrics.counter("analyses_cancelled_total", "Analyses stopped early", ("reason",))
@@ -0,0 +1,74 @@
+import os, sys, threading, time
+from collections import Counter
+from typing import Optional
+
+from app.core.config import settings
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread at a fixed interval into folded-stack counts.
+
+    Work for one request runs on executor threads, so all threads are sampled: profile
+    under low load, or other requests show up too. The output is the `stack;frames count`
+    format that flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval_ms: float = 5.0, max_depth: int = 64) -> None:
+        self.interval = max(0.5, float(interval_ms)) / 1000.0
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def save(self, profile_id: str) -> str:
+        path = os.path.join(settings.UPLOAD_DIR, "profiles", f"{profile_id}.folded")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        _prune(os.path.dirname(path), settings.PROFILE_KEEP)
+        return path
+
+
+def _prune(directory: str, keep: int) -> None:
+    # profiles aren't history entries, so the storage sweeper leaves them alone: cap them here
+    if keep <= 0:
+        return
+    try:
+        files = [e for e in os.scandir(directory) if e.name.endswith(".folded")]
+        files.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for e in files[keep:]:
+        try:
+            os.remove(e.path)
+        except OSError:
+            pass
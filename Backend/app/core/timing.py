@@ -0,0 +1,121 @@
+import functools, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+from uuid import uuid4
+
+from app.core.metrics import REQUESTS, REQUEST_MS, STAGE_MS
+from app.core.config import settings
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# stage name -> ms for the request (or worker call) being timed, None outside of one
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+def observe_stages(timings: Optional[Dict[str, float]]) -> None:
+    for name, ms in (timings or {}).items():
+        STAGE_MS.labels(name).observe(ms)
+
+
+def add_stages(timings: Optional[Dict[str, float]]) -> None:
+    """Merge timings measured elsewhere (e.g. an executor worker) into the current request."""
+    current = _timings.get()
+    if current is None:
+        observe_stages(timings)
+        return
+    for name, ms in (timings or {}).items():
+        current[name] = current.get(name, 0.0) + ms
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stages({name: (time.perf_counter() - start) * 1000.0})
+
+
+def timed(name: str) -> Callable[[F], F]:
+    def wrap(fn: F) -> F:
+        @functools.wraps(fn)
+        def inner(*args: Any, **kwargs: Any) -> Any:
+            with stage(name):
+                return fn(*args, **kwargs)
+        return inner  # type: ignore[return-value]
+    return wrap
+
+
+@contextmanager
+def collect_stages() -> Iterator[Dict[str, float]]:
+    # contextvars don't follow work into executor threads or processes, so workers
+    # collect their own stages and hand them back for add_stages()
+    timings: Dict[str, float] = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def server_timing(timings: Dict[str, float], total_ms: Optional[float] = None) -> str:
+    parts = [f"{name};dur={ms:.1f}" for name, ms in timings.items()]
+    if total_ms is not None:
+        parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def _route(scope: Dict[str, Any]) -> str:
+    # the endpoint's name keeps label cardinality bounded (no ids from the path)
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        return getattr(endpoint, "__name__", "endpoint")
+    return "static" if scope.get("path", "").startswith("/static/") else "unmatched"
+
+
+class TimingMiddleware:
+    """Per-request stage collector: request counters, latency, `Server-Timing` and opt-in profiles."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profiler = None
+        profile_id = None
+        if settings.PROFILE_REQUESTS and any(k == b"x-profile" for k, _ in scope.get("headers", [])):
+            from app.core.profiling import SamplingProfiler
+            profile_id = uuid4().hex
+            profiler = SamplingProfiler(settings.PROFILE_INTERVAL_MS)
+            profiler.start()
+
+        status = 500
+        start = time.perf_counter()
+        scope.setdefault("state", {})["received_at"] = time.time()  # request.state.received_at
+
+        async def send_timed(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = (time.perf_counter() - start) * 1000.0
+                REQUEST_MS.labels(_route(scope)).observe(total)
+                headers = list(message.get("headers", []))
+                if settings.SERVER_TIMING:
+                    headers.append((b"server-timing", server_timing(timings, total).encode()))
+                if profile_id:
+                    headers.append((b"x-profile", f"/static/profiles/{profile_id}.folded".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        with collect_stages() as timings:
+            try:
+                await self.app(scope, receive, send_timed)
+            finally:
+                REQUESTS.labels(scope.get("method", ""), _route(scope), status).inc()
+                observe_stages(timings)
+                if profiler is not None:
+                    profiler.stop()
+                    profiler.save(profile_id)
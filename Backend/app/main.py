@@ -2,9 +2,21 @@ import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, JSONResponse
+from starlette.concurrency import run_in_threadpool
 
 from app.core.config import settings
+from app.core.metrics import metrics, PROMETHEUS_CONTENT_TYPE
+from app.core.timing import TimingMiddleware
 from app.api.v1.endpoints import router as api_router
+from app.services.model_registry import model_registry, warmup_in_background, readiness
+from app.services.executor import analysis_executor
+from app.services.inference import inference_scheduler
+from app.services.onnx_engine import onnx_registry
+from app.services.result_cache import result_cache
+from app.services.render import render_cache
+from app.services.retention import sweeper
+from app.utils.history import warm_history_index
 
 app = FastAPI(title="ImageAnalyzer API", description="API for uploading and analyzing images")
 
@@ -14,14 +26,65 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile"],
 )
+app.add_middleware(TimingMiddleware)
 
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 
 app.mount("/static", StaticFiles(directory=settings.UPLOAD_DIR), name="static")
 
+@app.on_event("startup")
+def warmup_model():
+    # off the startup path: /health answers while the model loads, /ready once it is warm.
+    # Under app.serve the parent already warmed it and this is a no-op.
+    warmup_in_background()
+
+@app.on_event("startup")
+async def build_history_index():
+    await run_in_threadpool(warm_history_index)
+
+@app.on_event("startup")
+def start_storage_sweeper():
+    sweeper.start()
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    analysis_executor.shutdown(wait=False)
+    sweeper.stop()
+
+def _resident_models():
+    out = {}
+    for engine, registry in (("yolo", model_registry), ("onnx", onnx_registry)):
+        out[(engine,)] = sum(1 for m in registry.status() if m["loaded"])
+    return out
+
+metrics.gauge("analysis_queue_depth", "Analyses waiting for a worker", fn=lambda: analysis_executor.stats()["queued"])
+metrics.gauge("analysis_running", "Analyses running", fn=lambda: analysis_executor.stats()["running"])
+metrics.counter("analysis_rejected_total", "Analyses refused with a full queue",
+                fn=lambda: analysis_executor.stats()["rejected"])
+metrics.gauge("inference_pending", "Images waiting for the YOLO batcher", fn=lambda: inference_scheduler.stats()["pending"])
+metrics.gauge("resident_models", "Loaded models", ("engine",), fn=_resident_models)
+metrics.counter("result_cache_hits_total", "Duplicate uploads served from the result cache",
+                fn=lambda: result_cache.stats()["hits"])
+metrics.counter("result_cache_misses_total", "Result cache misses", fn=lambda: result_cache.stats()["misses"])
+metrics.gauge("render_cache_bytes", "Rendered images held in memory", fn=lambda: render_cache.stats()["memory_bytes"])
+metrics.gauge("storage_usage_bytes", "UPLOAD_DIR size at the last sweep", fn=lambda: sweeper.usage_bytes or 0)
+metrics.counter("storage_removed_entries_total", "History entries expired or evicted by the sweeper",
+                fn=lambda: sweeper.removed_entries)
+metrics.counter("storage_removed_files_total", "Orphaned files removed by the sweeper", fn=lambda: sweeper.removed_files)
+
+@app.get("/metrics", tags=["Health"], summary="Prometheus metrics (this worker process)")
+def prometheus_metrics() -> Response:
+    return Response(content=metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.get("/health", tags=["Health"], summary="Health Check", description="Basit bir sağlık kontrolü endpoint'i.")
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/ready", tags=["Health"], summary="Readiness: 503 until the default model is warm")
+def ready_check() -> JSONResponse:
+    status = readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 app.include_router(api_router, prefix="/api/v1")
@@ -1,27 +1,203 @@
-from typing import List
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import numpy as np
 from pydantic import BaseModel
 
+HIST_BINS = 16
+
 class Detection(BaseModel):
     label: str
     confidence: float
     bbox: List[int]
 
-def _detect_contour(image_path: str) -> List[Detection]:
-    import cv2, numpy as np
-    img = cv2.imread(image_path)
-    if img is None:
-        return []
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+class DetectionBatch:
+    """Detections as parallel arrays; row i is labelled `names[class_ids[i]]`.
+
+    This is what the engines, tiling, stats and the cache pass around. Pydantic
+    `Detection` objects are only built at the edges that need them.
+    """
+
+    __slots__ = ("boxes", "scores", "class_ids", "names", "areas", "histograms", "valid")
+
+    def __init__(
+        self,
+        boxes: Any,
+        scores: Any,
+        class_ids: Any,
+        names: Sequence[str],
+        areas: Optional[np.ndarray] = None,
+        histograms: Optional[np.ndarray] = None,
+        valid: Optional[np.ndarray] = None,
+    ) -> None:
+        self.boxes = np.asarray(boxes).reshape(-1, 4).astype(np.int32)
+        self.scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        self.class_ids = np.asarray(class_ids).reshape(-1).astype(np.int32)
+        self.names = list(names)
+        self.areas = areas
+        self.histograms = histograms
+        self.valid = valid
+
+    @classmethod
+    def empty(cls) -> "DetectionBatch":
+        return cls(np.zeros((0, 4), np.int32), [], [], [])
+
+    @classmethod
+    def from_detections(cls, dets: Iterable[Any]) -> "DetectionBatch":
+        dets = list(dets)
+        names: Dict[str, int] = {}
+        ids = [names.setdefault(d.label, len(names)) for d in dets]
+        return cls([d.bbox for d in dets], [d.confidence for d in dets], ids, list(names))
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "DetectionBatch":
+        return cls.from_detections(Detection(**r) for r in records)
+
+    @classmethod
+    def concat(cls, batches: Sequence["DetectionBatch"]) -> "DetectionBatch":
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.empty()
+        names: Dict[str, int] = {}
+        ids = []
+        for b in batches:
+            remap = np.array([names.setdefault(n, len(names)) for n in b.names], dtype=np.int32)
+            ids.append(remap[b.class_ids])
+        return cls(np.concatenate([b.boxes for b in batches]), np.concatenate([b.scores for b in batches]),
+                   np.concatenate(ids), list(names))
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def take(self, idx: Any) -> "DetectionBatch":
+        pick = lambda a: None if a is None else a[idx]
+        return DetectionBatch(self.boxes[idx], self.scores[idx], self.class_ids[idx], self.names,
+                              pick(self.areas), pick(self.histograms), pick(self.valid))
+
+    def shift(self, dx: int, dy: int) -> "DetectionBatch":
+        return DetectionBatch(self.boxes + np.array([dx, dy, dx, dy], dtype=np.int32),
+                              self.scores, self.class_ids, self.names)
+
+    @property
+    def labels(self) -> List[str]:
+        return [self.names[i] for i in self.class_ids.tolist()]
+
+    def label_set(self) -> List[str]:
+        return sorted({self.names[i] for i in np.unique(self.class_ids).tolist()})
+
+    def with_stats(self, stats: Dict[str, np.ndarray]) -> "DetectionBatch":
+        self.areas, self.histograms, self.valid = stats["areas"], stats["histograms"], stats["valid"]
+        return self
+
+    def to_detections(self) -> List[Detection]:
+        return [
+            Detection(label=lb, confidence=c, bbox=b)
+            for lb, c, b in zip(self.labels, self.scores.tolist(), self.boxes.tolist())
+        ]
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        return [
+            {"label": lb, "confidence": c, "bbox": b}
+            for lb, c, b in zip(self.labels, self.scores.tolist(), self.boxes.tolist())
+        ]
+
+    def _stats_lists(self):
+        n = len(self)
+        valid = self.valid.tolist() if self.valid is not None else [False] * n
+        areas = self.areas.tolist() if self.areas is not None else [0] * n
+        hists = self.histograms.tolist() if self.histograms is not None else [[] for _ in range(n)]
+        return valid, areas, hists
+
+    def to_objects(self) -> List[Dict[str, Any]]:
+        """Rows in the `ObjectInfo` shape; boxes without stats get area 0 and an empty histogram."""
+        valid, areas, hists = self._stats_lists()
+        return [
+            {"label": lb, "confidence": c, "area": int(a) if ok else 0, "histogram": h if ok else [], "bbox": b}
+            for lb, c, b, ok, a, h in zip(self.labels, self.scores.tolist(), self.boxes.tolist(), valid, areas, hists)
+        ]
+
+    def to_columnar(self) -> Dict[str, Any]:
+        n = len(self)
+        return {
+            "count": n,
+            "names": self.names,
+            "class_id": self.class_ids,
+            "confidence": self.scores,
+            "bbox": self.boxes,
+            "area": self.areas if self.areas is not None else np.zeros(n, dtype=np.int64),
+            "histogram": self.histograms if self.histograms is not None
+            else np.zeros((n, HIST_BINS), dtype=np.float32),
+            "valid": self.valid if self.valid is not None else np.zeros(n, dtype=bool),
+        }
+
+# mean Sobel response (|gx|+|gy|) along an edge that counts as confidence 1.0;
+# a full-contrast step edge peaks at 4*255
+STRONG_EDGE = 510.0
+
+def contour_batch(image, max_dets: Optional[int] = None, fallback: bool = True) -> DetectionBatch:
+    import cv2
+    from app.utils.image import load_image
+    from app.utils.boxes import nms, merge_overlapping, contained
+    from app.core.config import settings
+    ctx = load_image(image)
+    if ctx is None:
+        return DetectionBatch.empty()
+    gray = ctx.gray
+    H, W = gray.shape[:2]
+    scale = 1.0
+    side = settings.CONTOUR_MAX_SIDE
+    if side and max(H, W) > side:
+        scale = side / max(H, W)
+        gray = cv2.resize(gray, (max(1, round(W * scale)), max(1, round(H * scale))), interpolation=cv2.INTER_AREA)
+
     edges = cv2.Canny(gray, 50, 150)
-    edges = cv2.dilate(edges, None, iterations=1)
-    cnts, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    dets: List[Detection] = []
-    for c in cnts:
-        x, y, w, h = cv2.boundingRect(c)
-        if w * h < 100:
-            continue
-        dets.append(Detection(label="blob", confidence=1.0, bbox=[int(x), int(y), int(x+w), int(y+h)]))
-    if not dets:
-        h, w = gray.shape[:2]
-        dets.append(Detection(label="blob", confidence=1.0, bbox=[0, 0, int(w), int(h)]))
-    return dets
+    # one box per connected edge component; those nested in another box are dropped below,
+    # as findContours(RETR_EXTERNAL) would, minus the per-contour loop
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(cv2.dilate(edges, None, iterations=1), connectivity=8)
+    rects = stats[1:, :4].astype(np.float32)  # x, y, w, h; label 0 is background
+    boxes = np.empty_like(rects)
+    boxes[:, :2] = rects[:, :2] / scale
+    boxes[:, 2:] = (rects[:, :2] + rects[:, 2:]) / scale
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, W)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, H)
+
+    # confidence: mean gradient strength on the component's own Canny pixels
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    on_edge = edges.ravel() > 0
+    lab = labels.ravel()[on_edge]
+    strength = np.bincount(lab, weights=(np.abs(gx) + np.abs(gy)).ravel()[on_edge], minlength=n)
+    counts = np.bincount(lab, minlength=n)
+    scores = np.clip(strength[1:] / np.maximum(counts[1:], 1) / STRONG_EDGE, 0.0, 1.0).astype(np.float32)
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = (areas >= settings.CONTOUR_MIN_AREA) & (scores >= settings.CONTOUR_MIN_SCORE)
+    boxes, scores, areas = boxes[keep], scores[keep], areas[keep]
+    if len(boxes) > settings.CONTOUR_MAX_CANDIDATES:
+        # pairwise merging is quadratic, so only the largest candidates go through it
+        top = np.argsort(-areas, kind="stable")[:settings.CONTOUR_MAX_CANDIDATES]
+        boxes, scores = boxes[top], scores[top]
+    outer = ~contained(boxes)
+    boxes, scores = boxes[outer], scores[outer]
+
+    cap = settings.CONTOUR_MAX_BOXES
+    if max_dets:
+        cap = min(cap, max_dets) if cap else max_dets
+    merge = settings.CONTOUR_MERGE.lower()
+    if merge == "union":
+        boxes, scores = merge_overlapping(boxes, scores, settings.CONTOUR_MERGE_OVERLAP)
+        order = np.argsort(-scores, kind="stable")[:cap or None]
+    elif merge == "nms":
+        order = nms(boxes, scores, settings.CONTOUR_NMS_IOU, max_out=cap or None)
+    else:
+        order = np.argsort(-scores, kind="stable")[:cap or None]
+
+    if not len(order):
+        if not fallback:
+            return DetectionBatch.empty()
+        return DetectionBatch([[0, 0, W, H]], [1.0], [0], ["blob"])
+    return DetectionBatch(np.round(boxes[order]), np.round(scores[order].astype(np.float64), 4),
+                          np.zeros(len(order), np.int32), ["blob"])
+
+
+def _detect_contour(image, max_dets: Optional[int] = None, fallback: bool = True) -> List[Detection]:
+    return contour_batch(image, max_dets=max_dets, fallback=fallback).to_detections()
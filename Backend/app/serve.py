@@ -0,0 +1,198 @@
+"""Preforking server: `python -m app.serve --workers 4 --port 8000`.
+
+The parent imports the app and loads and warms the default model once, then forks the
+workers, which share the weights and every imported module copy-on-write: another
+worker costs its own heap, not another copy of the model. Dead workers are replaced;
+SIGTERM/SIGINT give them SERVE_GRACEFUL_TIMEOUT seconds to finish.
+"""
+import argparse, contextlib, gc, os, signal, socket, sys, threading, time, traceback
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+
+def _bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _parent_warmup() -> Tuple[bool, str]:
+    """Whether the model can be loaded before forking, and why not."""
+    detector = (settings.DETECTOR or "auto").lower()
+    if detector == "contour" or not settings.MODEL_WARMUP:
+        return False, "no model to warm"
+    if detector == "onnx":
+        return False, "onnxruntime sessions own thread pools that don't survive fork"
+    device = (settings.MODEL_DEVICE or "auto").lower()
+    if device.startswith("cuda") or device.isdigit():
+        return False, "a CUDA context can't be shared with forked workers"
+    if device == "auto":
+        os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")  # ask without initialising CUDA
+        try:
+            import torch
+            if torch.cuda.is_available():
+                return False, "a CUDA context can't be shared with forked workers"
+        except ImportError:
+            pass
+    return True, ""
+
+
+@contextlib.contextmanager
+def _single_threaded() -> Iterator[None]:
+    # no OpenMP / OpenCV thread pool may exist at fork time: the children would inherit
+    # a pool without its threads and hang on their first parallel op
+    torch, cv2 = sys.modules.get("torch"), sys.modules.get("cv2")
+    if torch is not None:
+        torch.set_num_threads(1)
+    if cv2 is not None:
+        cv2.setNumThreads(1)
+    yield
+
+
+def _set_threads(n: int) -> None:
+    torch, cv2 = sys.modules.get("torch"), sys.modules.get("cv2")
+    if torch is not None:
+        torch.set_num_threads(n)
+    if cv2 is not None:
+        cv2.setNumThreads(n)
+
+
+def preload(warm: bool = True) -> Dict[str, Any]:
+    """Import and warm everything the workers should share, then freeze it for the GC."""
+    t0 = time.perf_counter()
+    import cv2, numpy  # noqa: F401  (the API imports them on first use; here once for all workers)
+    import app.main  # noqa: F401
+    from app.services.model_registry import warmup_default_model, warmup_status
+    can, why = _parent_warmup() if warm else (False, "disabled")
+    if can:
+        with _single_threaded():
+            warmup_default_model()
+    else:
+        print(f"[serve] model not preloaded ({why}); each worker loads its own")
+    others = [t.name for t in threading.enumerate() if t is not threading.main_thread()]
+    if others:
+        print(f"[serve] threads running before fork, they won't exist in workers: {', '.join(others)}")
+    # collected and frozen: the workers' GC won't write to (and so copy) the shared pages
+    gc.collect()
+    gc.freeze()
+    return {"seconds": round(time.perf_counter() - t0, 3), "model": dict(warmup_status)}
+
+
+class Arbiter:
+    """Forks `workers` children running `target` and keeps that many alive until stopped."""
+
+    def __init__(self, target: Callable[[], None], workers: int, graceful_timeout: float = 30.0) -> None:
+        self.target = target
+        self.workers = max(1, int(workers))
+        self.graceful_timeout = graceful_timeout
+        self.children: Dict[int, float] = {}  # pid -> started (monotonic)
+        self._stopping = threading.Event()
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                self.target()
+                code = 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def _reap(self) -> List[Tuple[int, int, float]]:
+        out = []
+        for pid, started in list(self.children.items()):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done, status = pid, 0
+            if done:
+                del self.children[pid]
+                out.append((pid, os.waitstatus_to_exitcode(status), time.monotonic() - started))
+        return out
+
+    def request_stop(self, *_: Any) -> None:
+        self._stopping.set()
+
+    def run(self) -> int:
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.request_stop)
+            signal.signal(signal.SIGINT, self.request_stop)
+        try:
+            while not self._stopping.is_set():
+                for pid, code, lived in self._reap():
+                    print(f"[serve] worker {pid} exited with {code} after {lived:.1f}s")
+                    if lived < 1.0:
+                        self._stopping.wait(1.0)  # crash loop: don't fork as fast as it dies
+                while len(self.children) < self.workers and not self._stopping.is_set():
+                    self.spawn()
+                self._stopping.wait(0.1)
+        finally:
+            self.stop()
+        return 0
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for sig, wait in ((signal.SIGTERM, self.graceful_timeout), (signal.SIGKILL, 5.0)):
+            for pid in list(self.children):
+                try:
+                    os.kill(pid, sig)
+                except ProcessLookupError:
+                    pass
+            deadline = time.monotonic() + wait
+            while self.children and time.monotonic() < deadline:
+                self._reap()
+                if self.children:
+                    time.sleep(0.05)
+            if not self.children:
+                return
+
+
+def _serve_worker(sock: socket.socket, threads: int, log_level: str) -> None:
+    import uvicorn
+    from app.main import app
+    _set_threads(threads)
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default=settings.SERVE_HOST)
+    ap.add_argument("--port", type=int, default=settings.SERVE_PORT)
+    ap.add_argument("--workers", type=int, default=settings.SERVE_WORKERS)
+    ap.add_argument("--no-preload", dest="preload", action="store_false", default=settings.SERVE_PRELOAD,
+                    help="every worker loads and warms its own model")
+    ap.add_argument("--torch-threads", type=int, default=settings.SERVE_TORCH_THREADS,
+                    help="intra-op threads per worker (0 = cpu count / workers)")
+    ap.add_argument("--log-level", default="info")
+    args = ap.parse_args(argv)
+    if not hasattr(os, "fork"):
+        print("[serve] needs os.fork; use `uvicorn app.main:app --workers N` on this platform", file=sys.stderr)
+        return 2
+
+    loaded = preload(warm=args.preload)
+    sock = _bind(args.host, args.port)
+    threads = args.torch_threads or max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    print(f"[serve] preloaded in {loaded['seconds']:.2f}s (model {loaded['model']['state']}); "
+          f"{args.workers} workers x {threads} threads on {args.host}:{args.port}")
+    arbiter = Arbiter(lambda: _serve_worker(sock, threads, args.log_level), args.workers,
+                      settings.SERVE_GRACEFUL_TIMEOUT)
+    return arbiter.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
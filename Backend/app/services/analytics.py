@@ -1,20 +1,93 @@
-from typing import Dict
-import cv2
+from typing import Dict, List, Sequence, Union
 import numpy as np
-from app.models.detection import Detection
-
-def compute_statistics(image_path: str, det: Detection) -> Dict:
-    img = cv2.imread(image_path)
-    if img is None:
-        return {"area": 0, "histogram": []}
-    x1,y1,x2,y2 = det.bbox
-    x1 = max(0, int(x1)); y1 = max(0, int(y1))
-    x2 = min(img.shape[1], int(x2)); y2 = min(img.shape[0], int(y2))
-    roi = img[y1:y2, x1:x2]
-    area = int((x2 - x1) * (y2 - y1))
-    if roi.size == 0:
-        return {"area": 0, "histogram": []}
-    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    hist = cv2.calcHist([gray], [0], None, [16], [0,256]).flatten()
-    hist = hist / (hist.sum() + 1e-6)
-    return {"area": area, "histogram": hist.astype(float).tolist()}
+from app.models.detection import Detection, HIST_BINS
+from app.utils.image import ImageSource, load_image
+from app.core.timing import timed
+from app.core.config import settings
+
+_BIN_SHIFT = 4  # 256 gray levels -> 16 bins, same edges as calcHist([0, 256], 16)
+
+# Past this many boxes (or this much box area relative to the image) one
+# integral image per bin is cheaper than histogramming each ROI separately.
+_INTEGRAL_MIN_BOXES = 32
+_INTEGRAL_AREA_RATIO = 2.0
+
+def _clamp_boxes(boxes: np.ndarray, width: int, height: int):
+    x1 = np.maximum(boxes[:, 0], 0)
+    y1 = np.maximum(boxes[:, 1], 0)
+    x2 = np.minimum(boxes[:, 2], width)
+    y2 = np.minimum(boxes[:, 3], height)
+    valid = (x2 > x1) & (y2 > y1)
+    # park empty boxes on a zero-size window so indexing stays in range
+    x1 = np.where(valid, x1, 0); x2 = np.where(valid, x2, 0)
+    y1 = np.where(valid, y1, 0); y2 = np.where(valid, y2, 0)
+    return x1, y1, x2, y2, valid
+
+def _counts_per_roi(q: np.ndarray, x1, y1, x2, y2, valid) -> np.ndarray:
+    counts = np.zeros((len(x1), HIST_BINS), dtype=np.int64)
+    for i in np.flatnonzero(valid):
+        roi = q[y1[i]:y2[i], x1[i]:x2[i]]
+        counts[i] = np.bincount(roi.ravel(), minlength=HIST_BINS)
+    return counts
+
+def _counts_per_roi_bgr(image: np.ndarray, x1, y1, x2, y2, valid) -> np.ndarray:
+    import cv2
+    counts = np.zeros((len(x1), HIST_BINS), dtype=np.int64)
+    for i in np.flatnonzero(valid):
+        roi = cv2.cvtColor(np.ascontiguousarray(image[y1[i]:y2[i], x1[i]:x2[i]]), cv2.COLOR_BGR2GRAY)
+        counts[i] = np.bincount((roi >> _BIN_SHIFT).ravel(), minlength=HIST_BINS)
+    return counts
+
+def _counts_integral(q: np.ndarray, x1, y1, x2, y2) -> np.ndarray:
+    import cv2
+    counts = np.empty((len(x1), HIST_BINS), dtype=np.int64)
+    mask = np.empty(q.shape, dtype=np.uint8)
+    for b in range(HIST_BINS):
+        np.equal(q, b, out=mask.view(bool))
+        ii = cv2.integral(mask, sdepth=cv2.CV_32S)
+        counts[:, b] = ii[y2, x2] - ii[y1, x2] - ii[y2, x1] + ii[y1, x1]
+    return counts
+
+@timed("statistics")
+def compute_statistics_batch(
+    image: ImageSource,
+    boxes: Union[np.ndarray, Sequence[Sequence[int]]],
+) -> Dict[str, np.ndarray]:
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    n = len(boxes)
+    ctx = load_image(image)
+    if ctx is None or n == 0:
+        return {
+            "areas": np.zeros(n, dtype=np.int64),
+            "histograms": np.zeros((n, HIST_BINS), dtype=np.float32),
+            "valid": np.zeros(n, dtype=bool),
+        }
+
+    h, w = ctx.height, ctx.width
+    x1, y1, x2, y2, valid = _clamp_boxes(boxes, w, h)
+    areas = (x2 - x1) * (y2 - y1)
+
+    if h * w >= settings.TILE_MIN_PIXELS:
+        # tiled sizes: neither a full gray copy nor 16 integral images are affordable,
+        # each box is converted on its own instead
+        counts = _counts_per_roi_bgr(ctx.image, x1, y1, x2, y2, valid)
+    elif n >= _INTEGRAL_MIN_BOXES or areas.sum() > _INTEGRAL_AREA_RATIO * h * w:
+        counts = _counts_integral(ctx.gray >> _BIN_SHIFT, x1, y1, x2, y2)
+    else:
+        counts = _counts_per_roi(ctx.gray >> _BIN_SHIFT, x1, y1, x2, y2, valid)
+
+    counts = counts.astype(np.float32)
+    hists = counts / (counts.sum(axis=1, keepdims=True) + np.float32(1e-6))
+    return {"areas": areas, "histograms": hists, "valid": valid}
+
+def statistics_to_list(stats: Dict[str, np.ndarray]) -> List[Dict]:
+    out: List[Dict] = []
+    for area, hist, ok in zip(stats["areas"].tolist(), stats["histograms"], stats["valid"].tolist()):
+        if not ok:
+            out.append({"area": 0, "histogram": []})
+        else:
+            out.append({"area": int(area), "histogram": hist.astype(float).tolist()})
+    return out
+
+def compute_statistics(image: ImageSource, det: Detection) -> Dict:
+    return statistics_to_list(compute_statistics_batch(image, [det.bbox]))[0]
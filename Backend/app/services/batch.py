@@ -0,0 +1,148 @@
+import asyncio, os, zipfile, hashlib
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+import anyio
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from app.services.executor import analysis_executor, QueueFullError
+from app.services.pipeline import analyze_upload, cache_result, replay_cached, ImageDecodeError
+from app.services.result_cache import result_cache
+from app.utils.storage import check_image_header, HEADER_BYTES, UploadRejected
+from app.utils.history import append_history, append_history_many
+from app.core.timing import add_stages
+from app.core.config import settings
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff", ".gif"}
+
+def _is_zip(f: UploadFile) -> bool:
+    ct = (f.content_type or "").lower()
+    return ct in ("application/zip", "application/x-zip-compressed") or (f.filename or "").lower().endswith(".zip")
+
+async def iter_batch_sources(files: List[UploadFile]) -> AsyncIterator[Tuple[str, Union[bytes, UploadRejected]]]:
+    # yields (name, bytes) one image at a time, or (name, UploadRejected) for entries to skip
+    for f in files:
+        if _is_zip(f):
+            zf = await run_in_threadpool(zipfile.ZipFile, f.file)
+            try:
+                for info in zf.infolist():
+                    if info.is_dir():
+                        continue
+                    name = os.path.basename(info.filename)
+                    if os.path.splitext(name)[1].lower() not in IMAGE_EXTS:
+                        continue
+                    if settings.MAX_UPLOAD_BYTES and info.file_size > settings.MAX_UPLOAD_BYTES:
+                        yield name, UploadRejected(413, f"Upload exceeds {settings.MAX_UPLOAD_BYTES} bytes")
+                        continue
+                    yield name, await run_in_threadpool(zf.read, info)
+            finally:
+                zf.close()
+        elif f.content_type and f.content_type.startswith("image/"):
+            yield f.filename, await f.read(settings.MAX_UPLOAD_BYTES + 1 if settings.MAX_UPLOAD_BYTES else -1)
+        else:
+            yield f.filename, UploadRejected(400, "Invalid file type")
+
+def _record_late(fut: Future) -> None:
+    try:
+        append_history(fut.result()["entry"])
+    except Exception:
+        pass
+
+async def analyze_batch(
+    files: List[UploadFile],
+    conf: float = 0.25,
+    max_dets: int = 100,
+    detector: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    window = max(1, settings.BATCH_MAX_IN_FLIGHT)
+    pending: Dict[asyncio.Future, Tuple[int, str, Future, str]] = {}
+    entries: List[Dict[str, Any]] = []
+
+    def success(index: int, name: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        entries.append(result["entry"])
+        return {
+            "index": index,
+            "filename": name,
+            "message": "analysis_complete",
+            "objects": result["detections"].to_objects(),
+            "annotated_url": result["annotated_url"],
+            "history_id": result["history_id"],
+            "engine": result["route"]["engine"],
+            "engine_reason": result["route"]["reason"],
+        }
+
+    def finish(fut: asyncio.Future) -> Dict[str, Any]:
+        index, name, _, key = pending.pop(fut)
+        base = {"index": index, "filename": name, "objects": []}
+        try:
+            result = fut.result()
+        except ImageDecodeError:
+            return {**base, "message": "analysis_failed", "error": "Could not decode image"}
+        except Exception as e:
+            return {**base, "message": "analysis_failed", "error": str(e)}
+        add_stages(result.pop("timings", None))
+        cache_result(key, result)
+        return success(index, name, result)
+
+    async def flush() -> None:
+        if entries:
+            batch = entries[:]
+            entries.clear()
+            await run_in_threadpool(append_history_many, batch)
+
+    try:
+        index = -1
+        async for name, data in iter_batch_sources(files):
+            index += 1
+            try:
+                if isinstance(data, UploadRejected):
+                    raise data
+                if settings.MAX_UPLOAD_BYTES and len(data) > settings.MAX_UPLOAD_BYTES:
+                    raise UploadRejected(413, f"Upload exceeds {settings.MAX_UPLOAD_BYTES} bytes")
+                check_image_header(data[:HEADER_BYTES], source=data)
+            except UploadRejected as e:
+                yield {"index": index, "filename": name, "message": "analysis_failed",
+                       "objects": [], "error": e.detail}
+                continue
+            sha256 = hashlib.sha256(data).hexdigest()
+            key = result_cache.key(sha256, detector, conf, max_dets)
+            cached = result_cache.get(key)
+            if cached is not None:
+                yield success(index, name, replay_cached(cached, detector, record_history=False))
+                continue
+            while True:
+                if len(pending) < window:
+                    try:
+                        cf = analysis_executor.submit(
+                            analyze_upload, data, name,
+                            conf=conf, max_dets=max_dets, detector=detector,
+                            record_history=False, sha256=sha256,
+                        )
+                        break
+                    except QueueFullError:
+                        if not pending:
+                            # the pool is busy with other requests only
+                            await asyncio.sleep(settings.BATCH_RETRY_DELAY_MS / 1000.0)
+                            continue
+                done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    yield finish(fut)
+                if len(entries) >= settings.BATCH_HISTORY_FLUSH:
+                    await flush()
+            pending[asyncio.wrap_future(cf)] = (index, name, cf, key)
+            del data
+
+        while pending:
+            done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                yield finish(fut)
+            if len(entries) >= settings.BATCH_HISTORY_FLUSH:
+                await flush()
+    finally:
+        # client went away: whatever is still running records its own history
+        for _, _, cf, _ in pending.values():
+            cf.add_done_callback(_record_late)
+        if entries:
+            # off the event loop; shielded, since a disconnect lands here inside a cancelled scope
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(append_history_many, entries)
@@ -0,0 +1,199 @@
+import asyncio, threading, time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.core.config import settings
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class AnalysisCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """Shared between a request and its worker: the request side cancels (client gone,
+    timeout), the worker checks between stages and `commit`s before its first durable
+    write, after which cancelling is refused. Only the clock crosses into worker processes."""
+
+    __slots__ = ("started", "deadline", "reason", "_cancelled", "_committed", "_lock")
+
+    def __init__(self, started: Optional[float] = None, timeout_ms: Optional[float] = None) -> None:
+        self.started = time.time() if started is None else started
+        self.deadline = self.started + timeout_ms / 1000.0 if timeout_ms else None
+        self.reason: Optional[str] = None
+        self._cancelled = False
+        self._committed = False
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> tuple:
+        return self.started, self.deadline
+
+    def __setstate__(self, state: tuple) -> None:
+        self.started, self.deadline = state
+        self.reason = None
+        self._cancelled = self._committed = False
+        self._lock = threading.Lock()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        with self._lock:
+            if self._committed:
+                return False
+            if not self._cancelled:
+                self._cancelled, self.reason = True, reason
+            return True
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._cancelled and self.expired():
+            self.cancel("timeout")
+        return self._cancelled
+
+    def elapsed_ms(self) -> float:
+        return (time.time() - self.started) * 1000.0
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise AnalysisCancelled(self.reason)
+
+    def commit(self) -> None:
+        self.check()
+        with self._lock:
+            if self._cancelled:
+                raise AnalysisCancelled(self.reason)
+            self._committed = True
+
+
+class AnalysisExecutor:
+    """Bounded pool for blocking CV work: at most `workers` running plus `queue_size` waiting."""
+
+    def __init__(self, kind: str = "thread", workers: int = 2, queue_size: int = 8) -> None:
+        self.kind = (kind or "thread").lower()
+        self.workers = max(1, int(workers))
+        self.queue_size = max(0, int(queue_size))
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    if self.kind == "process":
+                        from app.services.model_registry import warmup_default_model
+                        self._pool = ProcessPoolExecutor(
+                            max_workers=self.workers, initializer=warmup_default_model
+                        )
+                    else:
+                        self._pool = ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix="analyze"
+                        )
+        return self._pool
+
+    def _track(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _done(self, _fut: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        with self._lock:
+            if self._pending >= self.capacity:
+                self._rejected += 1
+                raise QueueFullError(f"analysis queue full ({self._pending}/{self.capacity})")
+            self._pending += 1
+        try:
+            pool = self._get_pool()
+            if self.kind == "process":
+                fut = pool.submit(fn, *args, **kwargs)
+            else:
+                fut = pool.submit(self._track, fn, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        fut.add_done_callback(self._done)
+        return fut
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    async def run_cancellable(
+        self,
+        cancel: CancelToken,
+        is_disconnected: Callable[[], Awaitable[bool]],
+        fn: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """`run`, watching for a client disconnect or the token's deadline meanwhile.
+
+        Either one drops the call if it is still queued, or cancels the token so a running
+        thread worker stops at its next checkpoint; both raise AnalysisCancelled here. Work
+        past its commit point, or running in a worker process (which only sees the
+        deadline), is waited for.
+        """
+        cfut = self.submit(fn, *args, **kwargs)
+        fut = asyncio.wrap_future(cfut)
+        gave_up = False
+        while True:
+            done, _ = await asyncio.wait({fut}, timeout=settings.CANCEL_POLL_MS / 1000.0)
+            if done:
+                return fut.result()
+            if gave_up:
+                continue
+            reason = "timeout" if cancel.expired() else "disconnected" if await is_disconnected() else None
+            if reason is None:
+                continue
+            if cfut.cancel() or (self.kind != "process" and cancel.cancel(reason)):
+                cancel.cancel(reason)
+                raise AnalysisCancelled(reason)
+            gave_up = True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = self._pending
+            # process workers can't report back, assume the pool is saturated first
+            running = self._running if self.kind != "process" else min(pending, self.workers)
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": running,
+                "queued": max(0, pending - running),
+                "utilization": running / self.workers,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+analysis_executor = AnalysisExecutor(
+    kind=settings.ANALYZE_EXECUTOR,
+    workers=settings.ANALYZE_WORKERS,
+    queue_size=settings.ANALYZE_QUEUE_SIZE,
+)
@@ -1,42 +1,265 @@
-import os
-from typing import List, Optional
-from app.models.detection import Detection, _detect_contour
+import os, math, queue, threading, time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from app.models.detection import Detection, DetectionBatch, contour_batch
+from app.utils.image import ImageContext, ImageSource
+from app.services.model_registry import model_registry
+from app.services.tiling import detect_tiled, should_tile
+from app.services.onnx_engine import onnx_registry
+from app.services.executor import CancelToken, AnalysisCancelled
+from app.services.routing import LatencyEstimator, EngineRouter, Route
+from app.core.metrics import Histogram, LATENCY_MS_BUCKETS, FALLBACKS
+from app.core.timing import timed
 from app.core.config import settings
 
-def _detect_yolo(image_path: str, conf: float, max_dets: int) -> List[Detection]:
-    from ultralytics import YOLO
-    model = YOLO(settings.MODEL_WEIGHTS)
-    results = model.predict(image_path, conf=conf, max_det=max_dets, verbose=False)
-    dets: List[Detection] = []
-    for r in results:
-        if r.boxes is None:
-            continue
-        names = r.names if hasattr(r, "names") else {}
-        for b in r.boxes:
-            xyxy = b.xyxy[0].tolist()
-            x1, y1, x2, y2 = map(int, xyxy)
-            confv = float(b.conf[0]) if hasattr(b, "conf") else 1.0
-            cls_id = int(b.cls[0]) if hasattr(b, "cls") else 0
-            label = names.get(cls_id, f"id_{cls_id}")
-            dets.append(Detection(label=label, confidence=confv, bbox=[x1, y1, x2, y2]))
-    return dets
+def _predict_kwargs(conf: float, max_dets: int) -> Dict[str, Any]:
+    kwargs = {"conf": conf, "max_det": max_dets, "verbose": False}
+    if settings.MODEL_DEVICE:
+        kwargs["device"] = settings.MODEL_DEVICE
+    return kwargs
 
-def run_inference(
-    image_path: str,
+def _numpy(t: Any) -> np.ndarray:
+    return t.cpu().numpy() if hasattr(t, "cpu") else np.asarray(t)
+
+def _result_to_batch(r: Any) -> DetectionBatch:
+    boxes = r.boxes
+    if boxes is None or len(boxes) == 0:
+        return DetectionBatch.empty()
+    cls = _numpy(boxes.cls).astype(np.int32)
+    names = r.names if hasattr(r, "names") else {}
+    table = [names.get(i, f"id_{i}") for i in range(max(max(names, default=-1), int(cls.max())) + 1)]
+    return DetectionBatch(_numpy(boxes.xyxy), _numpy(boxes.conf), cls, table)
+
+def _result_to_detections(r: Any) -> List[Detection]:
+    return _result_to_batch(r).to_detections()
+
+# the models are shared and an ultralytics predictor keeps per-call state: one predict at a time
+_predict_lock = threading.Lock()
+
+
+class _Pending:
+    __slots__ = ("image", "conf", "max_dets", "token", "future", "enqueued")
+
+    def __init__(self, image: np.ndarray, conf: float, max_dets: int, token: Optional[CancelToken] = None) -> None:
+        self.image = image
+        self.conf = conf
+        self.max_dets = max_dets
+        self.token = token
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class InferenceScheduler:
+    """Collects concurrent YOLO requests into one batched predict call.
+
+    A batch closes when it reaches `max_batch` images or when the oldest
+    request has waited `max_wait_ms`. The batch runs with the loosest
+    conf/max_det of its members and each caller's own thresholds are applied
+    to its result afterwards.
+    """
+
+    def __init__(self, max_batch: int = 8, max_wait_ms: float = 4.0, latency: Optional[LatencyEstimator] = None) -> None:
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.latency = latency
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batch_sizes = Histogram((1, 2, 4, 8, 16, 32, 64))
+        self.wait_ms = Histogram(LATENCY_MS_BUCKETS)
+        self.predict_ms = Histogram(LATENCY_MS_BUCKETS)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._loop, name="inference-batcher", daemon=True
+                    )
+                    self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, image: np.ndarray, conf: float, max_dets: int, token: Optional[CancelToken] = None) -> Future:
+        item = _Pending(image, conf, max_dets, token)
+        self._ensure_thread()
+        self._queue.put(item)
+        return item.future
+
+    def infer_batch(
+        self, image: np.ndarray, conf: float, max_dets: int, token: Optional[CancelToken] = None
+    ) -> DetectionBatch:
+        return self.submit(image, conf, max_dets, token).result()
+
+    def infer(self, image: np.ndarray, conf: float, max_dets: int) -> List[Detection]:
+        return self.infer_batch(image, conf, max_dets).to_detections()
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+
+    def _run_batch(self, batch: List[_Pending]) -> None:
+        # requests cancelled while queued leave the batch here instead of costing a predict slot
+        for item in batch:
+            if item.token is not None and item.token.cancelled:
+                item.future.set_exception(AnalysisCancelled(item.token.reason))
+        batch = [it for it in batch if not it.future.done()]
+        if not batch:
+            return
+        start = time.perf_counter()
+        self.batch_sizes.observe(len(batch))
+        for item in batch:
+            self.wait_ms.observe((start - item.enqueued) * 1000.0)
+
+        model = model_registry.get()
+        conf = min(it.conf for it in batch)
+        max_dets = max(it.max_dets for it in batch)
+        with _predict_lock:
+            results = model.predict([it.image for it in batch], **_predict_kwargs(conf, max_dets))
+        ms = (time.perf_counter() - start) * 1000.0
+        self.predict_ms.observe(ms)
+        if self.latency is not None:
+            self.latency.observe("yolo", ms)
+
+        for item, r in zip(batch, results):
+            # ultralytics returns boxes sorted by confidence
+            b = _result_to_batch(r)
+            item.future.set_result(b.take(np.flatnonzero(b.scores >= item.conf)[: item.max_dets]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "pending": self._queue.qsize(),
+            "batch_size": self.batch_sizes.snapshot(),
+            "wait_ms": self.wait_ms.snapshot(),
+            "predict_ms": self.predict_ms.snapshot(),
+        }
+
+
+engine_latency = LatencyEstimator(
+    settings.ROUTE_EWMA_ALPHA,
+    {"yolo": settings.ROUTE_YOLO_PRIOR_MS, "contour": settings.ROUTE_CONTOUR_PRIOR_MS},
+)
+inference_scheduler = InferenceScheduler(
+    max_batch=settings.INFER_BATCH_SIZE, max_wait_ms=settings.INFER_BATCH_WAIT_MS, latency=engine_latency
+)
+engine_router = EngineRouter(inference_scheduler, engine_latency)
+
+def _detect_yolo(
+    image: ImageSource, conf: float, max_dets: int, token: Optional[CancelToken] = None
+) -> DetectionBatch:
+    source = image.image if isinstance(image, ImageContext) else image
+    if isinstance(source, np.ndarray):
+        # through the batcher even with INFER_BATCH_SIZE=1: its thread serializes the predicts
+        return inference_scheduler.infer_batch(source, conf, max_dets, token)
+    model = model_registry.get()
+    t0 = time.perf_counter()
+    with _predict_lock:
+        results = model.predict(source, **_predict_kwargs(conf, max_dets))
+    engine_latency.observe("yolo", (time.perf_counter() - t0) * 1000.0)
+    return DetectionBatch.concat([_result_to_batch(r) for r in results])
+
+def _detect_onnx(image: ImageSource, conf: float, max_dets: int) -> DetectionBatch:
+    from app.utils.image import load_image
+    ctx = load_image(image)
+    if ctx is None:
+        return DetectionBatch.empty()
+    return onnx_registry.get().detect_batch(ctx.image, conf=conf, max_dets=max_dets)
+
+@timed("inference")
+def route_inference(
+    image: ImageSource,
     conf: float = 0.25,
     max_dets: int = 100,
     detector_override: Optional[str] = None,
-) -> List[Detection]:
+    budget_ms: Optional[float] = None,
+    token: Optional[CancelToken] = None,
+) -> Tuple[DetectionBatch, Route]:
+    """Detections plus the route taken: {"engine", "reason"} and, when a budget was
+    weighed, the YOLO estimate it was compared against."""
     mode = (detector_override or settings.DETECTOR or "auto").lower()
 
-    if mode == "contour":
-        return _detect_contour(image_path)
+    arr = image.image if isinstance(image, ImageContext) else image
+    tiles = 1
+    if isinstance(arr, np.ndarray) and should_tile(*arr.shape[:2]):
+        h, w = arr.shape[:2]
+        step = max(1, settings.TILE_SIZE - settings.TILE_OVERLAP)
+        tiles = math.ceil(w / step) * math.ceil(h / step)
+
+        def contour() -> DetectionBatch:
+            dets = detect_tiled(arr, lambda t: contour_batch(t, max_dets=max_dets, fallback=False), max_dets)
+            return dets if len(dets) else DetectionBatch([[0, 0, w, h]], [1.0], [0], ["blob"])
+
+        def yolo() -> DetectionBatch:
+            return detect_tiled(arr, lambda t: _detect_yolo(t, conf=conf, max_dets=max_dets, token=token), max_dets)
+
+        def onnx() -> DetectionBatch:
+            return detect_tiled(arr, lambda t: _detect_onnx(t, conf=conf, max_dets=max_dets), max_dets)
+    else:
+        def contour() -> DetectionBatch:
+            t0 = time.perf_counter()
+            dets = contour_batch(image, max_dets=max_dets)
+            engine_latency.observe("contour", (time.perf_counter() - t0) * 1000.0)
+            return dets
+
+        def yolo() -> DetectionBatch:
+            return _detect_yolo(image, conf=conf, max_dets=max_dets, token=token)
+
+        def onnx() -> DetectionBatch:
+            return _detect_onnx(image, conf=conf, max_dets=max_dets)
 
+    route = engine_router.choose(mode, budget_ms=budget_ms, token=token, tiles=tiles)
+    engine = route["engine"]
+    if engine == "contour":
+        return contour(), route
+    if engine == "onnx":
+        return onnx(), route
     if mode == "yolo":
-        return _detect_yolo(image_path, conf=conf, max_dets=max_dets)
+        return yolo(), route
 
     try:
-        return _detect_yolo(image_path, conf=conf, max_dets=max_dets)
+        return yolo(), route
+    except AnalysisCancelled:
+        raise
     except Exception as e:
         print(f"[inference] YOLO failed -> fallback to contour: {e}")
-        return _detect_contour(image_path)
+        FALLBACKS.inc()
+        engine_router.yolo_failed()
+        return contour(), engine_router.record({"engine": "contour", "reason": "yolo_error"})
+
+def run_inference_batch(
+    image: ImageSource,
+    conf: float = 0.25,
+    max_dets: int = 100,
+    detector_override: Optional[str] = None,
+) -> DetectionBatch:
+    return route_inference(image, conf, max_dets, detector_override)[0]
+
+def run_inference(
+    image: ImageSource,
+    conf: float = 0.25,
+    max_dets: int = 100,
+    detector_override: Optional[str] = None,
+) -> List[Detection]:
+    return run_inference_batch(image, conf, max_dets, detector_override).to_detections()
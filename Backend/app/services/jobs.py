@@ -0,0 +1,287 @@
+import os, json, time, queue, itertools, threading
+from uuid import uuid4
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services.executor import analysis_executor, QueueFullError
+from app.services.pipeline import analyze_upload, cache_result, replay_cached, ImageDecodeError
+from app.services.result_cache import result_cache
+from app.utils.history import append_history_many
+from app.utils.storage import release_pending
+from app.core.timing import add_stages
+from app.core.config import settings
+
+# API priorities run 0 (lowest) .. 9 (most urgent)
+MAX_PRIORITY = 9
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _admitted(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    # on the shared analysis executor, as /analyze and /analyze/batch are: jobs count against
+    # its workers and queue, and wait for room instead of being rejected
+    while True:
+        try:
+            fut = analysis_executor.submit(fn, *args, **kwargs)
+        except QueueFullError:
+            time.sleep(settings.BATCH_RETRY_DELAY_MS / 1000.0)
+            continue
+        return fut.result()
+
+
+def run_job_chunk(
+    items: List[Dict[str, Any]],
+    conf: float = 0.25,
+    max_dets: int = 100,
+    detector: Optional[str] = None,
+    run: Optional[Callable[..., Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Analyze already-stored uploads; shared by the local queue and the Celery task.
+
+    `run(fn, *args, **kwargs)` calls the analysis; by default directly (a Celery worker is its own pool).
+    """
+    out: List[Dict[str, Any]] = []
+    entries: List[Dict[str, Any]] = []
+    for item in items:
+        base = {"index": item["index"], "filename": item["original_name"], "objects": []}
+        path = os.path.join(settings.UPLOAD_DIR, item["filename"])
+        try:
+            key = result_cache.key(item["sha256"], detector, conf, max_dets) if item.get("sha256") else None
+            cached = result_cache.get(key) if key else None
+            if cached is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                release_pending([item["filename"]])
+                result = replay_cached(cached, detector, record_history=False)
+            else:
+                result = (run or _call)(
+                    analyze_upload, None, item["original_name"],
+                    conf=conf, max_dets=max_dets, detector=detector,
+                    record_history=False, sha256=item.get("sha256"), filename=item["filename"],
+                )
+                add_stages(result.pop("timings", None))
+                cache_result(key, result)
+        except ImageDecodeError:
+            out.append({**base, "message": "analysis_failed", "error": "Could not decode image"})
+            continue
+        except Exception as e:
+            out.append({**base, "message": "analysis_failed", "error": str(e)})
+            continue
+        entries.append(result["entry"])
+        out.append({
+            **base,
+            "message": "analysis_complete",
+            "objects": result["detections"].to_objects(),
+            "annotated_url": result["annotated_url"],
+            "history_id": result["history_id"],
+            "engine": result["route"]["engine"],
+            "engine_reason": result["route"]["reason"],
+        })
+    append_history_many(entries)
+    return out
+
+
+def _call(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return fn(*args, **kwargs)
+
+
+def _chunks(items: List[Dict[str, Any]], size: int) -> List[List[Dict[str, Any]]]:
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _summarize(job: Dict[str, Any], results: List[Dict[str, Any]], chunks_done: int) -> Dict[str, Any]:
+    failed = sum(1 for r in results if r.get("error"))
+    done = len(results)
+    if chunks_done < job["chunks"]:
+        status = "running" if chunks_done or job.get("started") else "queued"
+    else:
+        status = "failed" if failed == job["total"] and job["total"] else "completed"
+    return {
+        "job_id": job["id"],
+        "status": status,
+        "priority": job["priority"],
+        "total": job["total"],
+        "completed": done - failed,
+        "failed": failed,
+        "created_at": job["created_at"],
+        "finished_at": job.get("finished_at"),
+    }
+
+
+class LocalJobBackend:
+    """In-process priority queue; used when no broker is configured."""
+
+    name = "local"
+
+    def __init__(self, workers: int = 1, keep_seconds: float = 3600.0) -> None:
+        self.workers = max(1, int(workers))
+        self.keep_seconds = keep_seconds
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def _ensure_workers(self) -> None:
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._loop, name=f"jobs-{len(self._threads)}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _loop(self) -> None:
+        while True:
+            _, _, job_id, chunk_idx = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job["started"] = True
+                chunk = job["pending"][chunk_idx]
+                params = job["params"]
+            try:
+                results = run_job_chunk(chunk, **params, run=_admitted)
+            except Exception as e:
+                results = [{"index": it["index"], "filename": it["original_name"], "objects": [],
+                            "message": "analysis_failed", "error": str(e)} for it in chunk]
+            with self._lock:
+                job["pending"][chunk_idx] = None
+                job["results"].extend(results)
+                job["chunks_done"] += 1
+                if job["chunks_done"] >= job["chunks"]:
+                    job["finished_at"] = _now()
+                    job["finished_ts"] = time.time()
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.keep_seconds
+        with self._lock:
+            for jid in [j for j, job in self._jobs.items() if job.get("finished_ts", cutoff + 1) < cutoff]:
+                del self._jobs[jid]
+
+    def submit(self, items: List[Dict[str, Any]], rejected: List[Dict[str, Any]], params: Dict[str, Any],
+               priority: int, chunk_size: int) -> str:
+        self._expire()
+        job_id = uuid4().hex
+        chunks = _chunks(items, chunk_size)
+        job = {
+            "id": job_id, "priority": priority, "params": params, "created_at": _now(),
+            "total": len(items) + len(rejected), "chunks": len(chunks), "chunks_done": 0,
+            "pending": chunks, "results": list(rejected),
+        }
+        if not chunks:
+            job["finished_at"] = job["created_at"]
+            job["finished_ts"] = time.time()
+        with self._lock:
+            self._jobs[job_id] = job
+        self._ensure_workers()
+        for i in range(len(chunks)):
+            self._queue.put((-priority, next(self._seq), job_id, i))
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return _summarize(job, job["results"], job["chunks_done"])
+
+    def result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            items = sorted(job["results"], key=lambda r: r["index"])
+            return {**_summarize(job, items, job["chunks_done"]), "items": items}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.name, "queued_chunks": self._queue.qsize(), "jobs": len(self._jobs)}
+
+
+class CeleryJobBackend:
+    """Sends each chunk to the Celery workers; the job manifest lives next to the uploads."""
+
+    name = "celery"
+
+    def _manifest_path(self, job_id: str) -> str:
+        return os.path.join(settings.UPLOAD_DIR, "jobs", f"{job_id}.json")
+
+    def submit(self, items: List[Dict[str, Any]], rejected: List[Dict[str, Any]], params: Dict[str, Any],
+               priority: int, chunk_size: int) -> str:
+        from app.worker import analyze_chunk_task
+        job_id = uuid4().hex
+        chunks = _chunks(items, chunk_size)
+        task_ids = []
+        chunk_items = [[[it["index"], it["original_name"]] for it in chunk] for chunk in chunks]
+        for chunk in chunks:
+            # redis/kombu treat 0 as the most urgent, the API uses 9
+            r = analyze_chunk_task.apply_async(args=[chunk], kwargs=params, priority=MAX_PRIORITY - priority)
+            task_ids.append(r.id)
+        manifest = {
+            "id": job_id, "priority": priority, "created_at": _now(),
+            "total": len(items) + len(rejected), "chunks": len(chunks),
+            "tasks": task_ids, "chunk_items": chunk_items, "rejected": rejected,
+        }
+        os.makedirs(os.path.dirname(self._manifest_path(job_id)), exist_ok=True)
+        with open(self._manifest_path(job_id), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        return job_id
+
+    def _load(self, job_id: str):
+        try:
+            with open(self._manifest_path(job_id), "r", encoding="utf-8") as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None, [], 0
+        from app.worker import celery
+        results = list(job["rejected"])
+        done = 0
+        for tid, chunk in zip(job["tasks"], job["chunk_items"]):
+            r = celery.AsyncResult(tid)
+            if r.state == "STARTED":
+                job["started"] = True
+            if r.ready():
+                done += 1
+                if r.successful():
+                    results.extend(r.result)
+                else:
+                    results.extend({"index": i, "filename": name, "objects": [],
+                                    "message": "analysis_failed", "error": str(r.result)}
+                                   for i, name in chunk)
+        return job, results, done
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job, results, done = self._load(job_id)
+        return _summarize(job, results, done) if job else None
+
+    def result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job, results, done = self._load(job_id)
+        if job is None:
+            return None
+        items = sorted(results, key=lambda r: r["index"])
+        return {**_summarize(job, items, done), "items": items}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "queued_chunks": None, "jobs": None}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_job_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.broker_url:
+                _backend = CeleryJobBackend()
+            else:
+                _backend = LocalJobBackend(
+                    workers=settings.JOBS_LOCAL_WORKERS, keep_seconds=settings.JOBS_KEEP_SECONDS
+                )
+        return _backend
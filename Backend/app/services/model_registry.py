@@ -0,0 +1,205 @@
+import os, threading, time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.core.timing import stage
+from app.core.config import settings
+
+RegistryKey = Tuple[str, str]
+
+
+def _load_yolo(weights: str, device: str) -> Any:
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    if device != "auto":
+        model.to(device)
+    return model
+
+
+def _warm_yolo(model: Any, device: str, imgsz: int) -> None:
+    import numpy as np
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    kwargs = {"verbose": False, "imgsz": imgsz}
+    if device != "auto":
+        kwargs["device"] = device
+    model.predict(dummy, **kwargs)
+
+
+class _Entry:
+    __slots__ = ("model", "lock", "loaded", "warm", "load_seconds", "warm_seconds", "last_used", "error")
+
+    def __init__(self) -> None:
+        self.model: Any = None
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.warm = False
+        self.load_seconds: Optional[float] = None
+        self.warm_seconds: Optional[float] = None
+        self.last_used: Optional[float] = None
+        self.error: Optional[str] = None
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models, keyed by (weights, device), with an LRU cap."""
+
+    def __init__(
+        self,
+        capacity: int = 2,
+        loader: Callable[[str, str], Any] = _load_yolo,
+        warmer: Callable[[Any, str, int], None] = _warm_yolo,
+    ) -> None:
+        self.capacity = max(1, int(capacity))
+        self._loader = loader
+        self._warmer = warmer
+        self._entries: "OrderedDict[RegistryKey, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(weights: Optional[str] = None, device: Optional[str] = None) -> RegistryKey:
+        w = weights or settings.MODEL_WEIGHTS or "yolov8n.pt"
+        if os.path.exists(w):
+            w = os.path.abspath(w)
+        d = (device if device is not None else settings.MODEL_DEVICE) or "auto"
+        return (w, d.lower())
+
+    def _entry(self, key: RegistryKey) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry()
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                old_key, _ = self._entries.popitem(last=False)
+                print(f"[models] evicted {old_key[0]} ({old_key[1]})")
+            return entry
+
+    def get(self, weights: Optional[str] = None, device: Optional[str] = None) -> Any:
+        key = self.key(weights, device)
+        entry = self._entry(key)
+        if not entry.loaded:
+            # per-key lock: concurrent callers for the same weights load once,
+            # different weights can load in parallel
+            with entry.lock:
+                if not entry.loaded:
+                    t0 = time.perf_counter()
+                    try:
+                        with stage("model_load"):
+                            entry.model = self._loader(*key)
+                    except Exception as e:
+                        entry.error = str(e)
+                        raise
+                    entry.load_seconds = time.perf_counter() - t0
+                    entry.loaded = True
+                    entry.error = None
+        entry.last_used = time.time()
+        return entry.model
+
+    def warmup(
+        self,
+        weights: Optional[str] = None,
+        device: Optional[str] = None,
+        imgsz: Optional[int] = None,
+    ) -> Any:
+        key = self.key(weights, device)
+        model = self.get(*key)
+        entry = self._entry(key)
+        if entry.warm:
+            return model
+        with entry.lock:
+            if not entry.warm:
+                t0 = time.perf_counter()
+                self._warmer(model, key[1], int(imgsz or settings.MODEL_WARMUP_IMGSZ))
+                entry.warm_seconds = time.perf_counter() - t0
+                entry.warm = True
+        return model
+
+    def is_loaded(self, weights: Optional[str] = None, device: Optional[str] = None) -> bool:
+        with self._lock:
+            entry = self._entries.get(self.key(weights, device))
+        return bool(entry and entry.loaded)
+
+    def is_warm(self, weights: Optional[str] = None, device: Optional[str] = None) -> bool:
+        with self._lock:
+            entry = self._entries.get(self.key(weights, device))
+        return bool(entry and entry.warm)
+
+    def evict(self, weights: Optional[str] = None, device: Optional[str] = None) -> bool:
+        with self._lock:
+            return self._entries.pop(self.key(weights, device), None) is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = list(self._entries.items())
+        return [
+            {
+                "weights": k[0],
+                "device": k[1],
+                "loaded": e.loaded,
+                "warm": e.warm,
+                "load_seconds": e.load_seconds,
+                "warm_seconds": e.warm_seconds,
+                "last_used": e.last_used,
+                "error": e.error,
+            }
+            for k, e in reversed(items)
+        ]
+
+
+model_registry = ModelRegistry(capacity=settings.MODEL_CACHE_SIZE)
+
+# pending -> warming -> warm | failed (-> loaded, once a later lazy load succeeds); skipped when
+# nothing needs warming. Forked workers inherit it.
+warmup_status: Dict[str, Any] = {"state": "pending", "seconds": None, "error": None}
+_warmup_lock = threading.Lock()
+
+
+def warmup_default_model() -> bool:
+    with _warmup_lock:
+        if warmup_status["state"] == "warm":
+            return True
+        if not settings.MODEL_WARMUP or (settings.DETECTOR or "auto").lower() == "contour":
+            warmup_status["state"] = "skipped"
+            return False
+        warmup_status.update(state="warming", error=None)
+        try:
+            t0 = time.perf_counter()
+            if settings.DETECTOR.lower() == "onnx":
+                from app.services.onnx_engine import onnx_registry
+                onnx_registry.warmup(imgsz=settings.ONNX_IMGSZ)
+            else:
+                model_registry.warmup()
+            warmup_status.update(state="warm", seconds=round(time.perf_counter() - t0, 3))
+            print(f"[models] warm in {warmup_status['seconds']:.2f}s: {settings.MODEL_WEIGHTS}")
+            return True
+        except Exception as e:
+            warmup_status.update(state="failed", error=str(e))
+            print(f"[models] warmup skipped: {e}")
+            return False
+
+
+def warmup_in_background() -> Optional[threading.Thread]:
+    if warmup_status["state"] in ("warm", "warming", "loaded", "skipped"):
+        return None
+    t = threading.Thread(target=warmup_default_model, name="model-warmup", daemon=True)
+    t.start()
+    return t
+
+
+def readiness() -> Dict[str, Any]:
+    """Ready once the default model is warm. detector=auto also serves (with contour) if the load failed."""
+    detector = (settings.DETECTOR or "auto").lower()
+    state = warmup_status["state"]
+    if state == "failed":
+        registry = model_registry
+        if detector == "onnx":
+            from app.services.onnx_engine import onnx_registry as registry
+        if registry.is_loaded():
+            # a request (or auto's background warm) loaded the model after the warmup failed
+            warmup_status.update(state="loaded", error=None)
+            state = "loaded"
+    ready = state in ("warm", "loaded", "skipped") or (state == "failed" and detector == "auto")
+    return {"ready": ready, "detector": detector, **warmup_status}
@@ -0,0 +1,149 @@
+import os, ast, shutil, hashlib, tempfile, threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.detection import Detection, DetectionBatch
+from app.services.model_registry import ModelRegistry
+from app.services.result_cache import weights_fingerprint
+from app.utils.storage import FileLock
+from app.utils.boxes import nms
+from app.core.config import settings
+
+_export_lock = threading.Lock()  # threads of this process; the FileLock covers other workers
+
+
+def _cache_dir(weights: str) -> str:
+    return settings.ONNX_CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(weights)), ".onnx_cache")
+
+
+def _artifact_path(weights: str, imgsz: int, int8: bool) -> str:
+    # keyed by the weights' path, size and mtime so a new checkpoint gets a fresh export
+    tag = hashlib.sha1(weights_fingerprint(weights).encode()).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    return os.path.join(_cache_dir(weights), f"{stem}-{tag}-{imgsz}{'-int8' if int8 else ''}.onnx")
+
+
+def export_onnx(weights: Optional[str] = None, imgsz: Optional[int] = None, int8: Optional[bool] = None) -> str:
+    """Path of the ONNX export of `weights`, exporting (and quantizing) on first use."""
+    weights = weights or settings.MODEL_WEIGHTS or "yolov8n.pt"
+    imgsz = int(imgsz or settings.ONNX_IMGSZ)
+    int8 = settings.ONNX_QUANTIZE if int8 is None else int8
+    if weights.endswith(".onnx"):
+        return weights
+    if not os.path.exists(weights):
+        raise FileNotFoundError(f"ONNX export needs a local weights file: {weights}")
+    fp32 = _artifact_path(weights, imgsz, False)
+    target = _artifact_path(weights, imgsz, True) if int8 else fp32
+    if os.path.exists(target):
+        return target
+    cache_dir = os.path.dirname(fp32)
+    with _export_lock, FileLock(os.path.join(cache_dir, ".export.lock")):
+        if not os.path.exists(fp32):
+            from ultralytics import YOLO
+            # ultralytics writes <weights>.onnx next to its input: export a private copy so nothing
+            # shared is ever half-written, then move the finished file into place
+            work = tempfile.mkdtemp(prefix=".export-", dir=cache_dir)
+            try:
+                local = os.path.join(work, os.path.basename(weights))
+                shutil.copyfile(weights, local)
+                exported = YOLO(local).export(format="onnx", imgsz=imgsz, dynamic=False, simplify=False)
+                os.replace(exported, fp32)
+            finally:
+                shutil.rmtree(work, ignore_errors=True)
+            print(f"[onnx] exported {weights} -> {fp32}")
+        if int8 and not os.path.exists(target):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            tmp = f"{target}.{os.getpid()}.tmp"
+            quantize_dynamic(fp32, tmp, weight_type=QuantType.QUInt8)
+            os.replace(tmp, target)
+            print(f"[onnx] quantized -> {target}")
+    return target
+
+
+def letterbox(image: np.ndarray, size: int) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """Resize keeping aspect ratio and pad to size x size; returns (1, 3, size, size) float32, ratio, (padx, pady)."""
+    import cv2
+    h, w = image.shape[:2]
+    r = min(size / h, size / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    if (nw, nh) != (w, h):
+        image = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    padx, pady = (size - nw) / 2, (size - nh) / 2
+    top, left = int(round(pady - 0.1)), int(round(padx - 0.1))
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[top:top + nh, left:left + nw] = image
+    blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)  # BGR HWC uint8 -> RGB NCHW float32
+    return blob, r, (left, top)
+
+
+def decode_output(
+    pred: np.ndarray,
+    ratio: float,
+    pad: Tuple[float, float],
+    shape: Tuple[int, int],
+    names: Dict[int, str],
+    conf: float,
+    max_dets: int,
+    iou: float,
+) -> DetectionBatch:
+    """YOLOv8 head output (1, 4 + classes, anchors) -> Detections in original image coordinates."""
+    p = pred[0].T  # anchors x (4 + classes)
+    cls_scores = p[:, 4:]
+    cls = cls_scores.argmax(axis=1)
+    scores = cls_scores[np.arange(len(p)), cls]
+    keep = scores >= conf
+    if not keep.any():
+        return DetectionBatch.empty()
+    p, cls, scores = p[keep], cls[keep], scores[keep]
+    boxes = np.empty((len(p), 4), dtype=np.float32)
+    boxes[:, 0] = p[:, 0] - p[:, 2] / 2
+    boxes[:, 1] = p[:, 1] - p[:, 3] / 2
+    boxes[:, 2] = p[:, 0] + p[:, 2] / 2
+    boxes[:, 3] = p[:, 1] + p[:, 3] / 2
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / ratio).clip(0, shape[1])
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / ratio).clip(0, shape[0])
+    order = nms(boxes, scores, iou, max_out=max_dets, classes=cls)
+    table = [names.get(i, f"id_{i}") for i in range(max(max(names, default=-1), int(cls.max())) + 1)]
+    return DetectionBatch(boxes[order], scores[order], cls[order], table)
+
+
+class OnnxDetector:
+    def __init__(self, path: str) -> None:
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.ONNX_INTRA_THREADS:
+            opts.intra_op_num_threads = settings.ONNX_INTRA_THREADS
+        if settings.ONNX_INTER_THREADS:
+            opts.inter_op_num_threads = settings.ONNX_INTER_THREADS
+            opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.imgsz = int(inp.shape[2]) if isinstance(inp.shape[2], int) else int(settings.ONNX_IMGSZ)
+        meta = self.session.get_modelmeta().custom_metadata_map
+        try:
+            self.names = {int(k): v for k, v in ast.literal_eval(meta.get("names", "{}")).items()}
+        except (ValueError, SyntaxError):
+            self.names = {}
+
+    def detect_batch(self, image: np.ndarray, conf: float = 0.25, max_dets: int = 100) -> DetectionBatch:
+        blob, ratio, pad = letterbox(image, self.imgsz)
+        pred = self.session.run(None, {self.input_name: blob})[0]
+        return decode_output(pred, ratio, pad, image.shape[:2], self.names, conf, max_dets, settings.ONNX_NMS_IOU)
+
+    def detect(self, image: np.ndarray, conf: float = 0.25, max_dets: int = 100) -> List[Detection]:
+        return self.detect_batch(image, conf, max_dets).to_detections()
+
+
+def _load_onnx(weights: str, device: str) -> Any:
+    return OnnxDetector(export_onnx(weights))
+
+
+def _warm_onnx(model: Any, device: str, imgsz: int) -> None:
+    model.detect(np.zeros((imgsz, imgsz, 3), dtype=np.uint8))
+
+
+onnx_registry = ModelRegistry(capacity=settings.MODEL_CACHE_SIZE, loader=_load_onnx, warmer=_warm_onnx)
@@ -0,0 +1,213 @@
+import os
+from uuid import uuid4
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from app.services.inference import route_inference
+from app.services.executor import CancelToken
+from app.services.result_cache import result_cache
+from app.services.routing import FALLBACK_REASONS
+from app.services.analytics import compute_statistics_batch
+from app.utils.storage import save_bytes, reserve_name, release_pending, annotated_name
+from app.utils.image import ImageContext, bmp_view, open_mapped
+from app.utils.visualize import draw_bboxes
+from app.utils.thumbnails import make_thumbnails
+from app.services.render import save_detections
+from app.services.similarity import index_detections
+from app.utils.history import append_history
+from app.core.timing import collect_stages, stage
+from app.core.config import settings
+
+
+class ImageDecodeError(ValueError):
+    pass
+
+
+def analyze_upload(
+    data: Optional[bytes],
+    original_name: str,
+    conf: float = 0.25,
+    max_dets: int = 100,
+    detector: Optional[str] = None,
+    record_history: bool = True,
+    sha256: Optional[str] = None,
+    filename: Optional[str] = None,
+    budget_ms: Optional[float] = None,
+    token: Optional[CancelToken] = None,
+) -> Dict[str, Any]:
+    # `filename` set means the ingestion stage already stored the bytes there; with `data` None
+    # the image is decoded from that file
+    reserved = filename is None
+    if reserved:
+        filename = reserve_name(original_name)
+    try:
+        # timings travel back with the result: executor threads and processes don't share the caller's context
+        with collect_stages() as timings, stage("analyze"):
+            if reserved:
+                save_bytes(data, os.path.join(settings.UPLOAD_DIR, filename))
+            result = _analyze(data, conf, max_dets, detector, record_history, sha256, filename, budget_ms, token)
+    except BaseException:
+        # decode errors, cancellation, crashes: no history entry will come to release the marker
+        release_pending([filename])
+        raise
+    result["timings"] = timings
+    return result
+
+
+def _analyze(
+    data: Optional[bytes],
+    conf: float,
+    max_dets: int,
+    detector: Optional[str],
+    record_history: bool,
+    sha256: Optional[str],
+    filename: str,
+    budget_ms: Optional[float] = None,
+    token: Optional[CancelToken] = None,
+) -> Dict[str, Any]:
+    save_path = os.path.join(settings.UPLOAD_DIR, filename)
+    try:
+        # uncompressed BMP: read pixels in place instead of decoding a second copy
+        with stage("decode"):
+            if data is None:
+                view = open_mapped(save_path)
+                ctx = ImageContext(view, path=save_path) if view is not None else ImageContext.from_path(save_path)
+            else:
+                view = bmp_view(data)
+                ctx = ImageContext(view, path=save_path) if view is not None else ImageContext.from_bytes(data, path=save_path)
+    except ValueError as e:
+        try:
+            os.remove(save_path)
+        except OSError:
+            pass
+        raise ImageDecodeError(str(e))
+    del data
+
+    # a cancelled request (client gone, timed out) stops at these checkpoints; the
+    # caller discards the stored upload
+    if token is not None:
+        token.check()
+    detections, route = route_inference(
+        ctx, conf=conf, max_dets=max_dets, detector_override=detector, budget_ms=budget_ms, token=token
+    )
+    if token is not None:
+        token.check()
+    detections.with_stats(compute_statistics_batch(ctx, detections.boxes))
+    if token is not None:
+        token.commit()  # from here on the result gets recorded even if the client is gone
+
+    if settings.THUMBS_AT_INGEST:
+        try:
+            make_thumbnails(ctx.image, filename)  # before annotation draws onto the buffer
+        except Exception as e:
+            print(f"[thumbs] skip: {e}")
+
+    hist_id = uuid4().hex
+    with stage("index"):
+        index_detections(hist_id, detections)
+    if settings.EAGER_ANNOTATE:
+        ann_name = annotated_name(filename)
+        # a BMP view can't be drawn on in place
+        draw_bboxes(ctx, detections.to_detections(), os.path.join(settings.UPLOAD_DIR, "annotated", ann_name),
+                    copy=not ctx.image.flags.c_contiguous)
+        annotated_url = f"/static/annotated/{ann_name}"
+        stored = f"annotated/{ann_name}"
+    else:
+        # rendered on first GET from the original plus these boxes
+        with stage("persist"):
+            save_detections(hist_id, filename, detections, size=(ctx.width, ctx.height))
+        annotated_url = f"/api/v1/annotated/{hist_id}"
+        stored = f"detections/{hist_id}.json"
+
+    entry = {
+        "id": hist_id,
+        "result_id": hist_id,
+        "filename": filename,
+        "original_url": f"/static/{filename}",
+        "annotated_url": annotated_url,
+        "uploaded_at": datetime.utcnow().isoformat() + "Z",
+        "objects_count": len(detections),
+        "labels": detections.label_set(),
+        "detector": (detector or settings.DETECTOR or "auto"),
+        "engine": route["engine"],
+        "engine_reason": route["reason"],
+    }
+    if sha256:
+        entry["sha256"] = sha256
+    if record_history:
+        try:
+            append_history(entry)
+        except Exception as e:
+            release_pending([filename])
+            print(f"[history] skip: {e}")
+
+    # "detections" is a DetectionBatch; callers pick their own output shape
+    return {
+        "detections": detections,
+        "annotated_url": entry["annotated_url"],
+        "history_id": hist_id,
+        "entry": entry,
+        "route": route,
+        "files": [filename, stored],
+    }
+
+
+def cache_value(result: Dict[str, Any]) -> Dict[str, Any]:
+    entry = result["entry"]
+    return {
+        "detections": result["detections"],
+        "files": result["files"],
+        "filename": entry["filename"],
+        "original_url": entry["original_url"],
+        "annotated_url": entry["annotated_url"],
+        "result_id": entry["result_id"],
+        "labels": entry["labels"],
+        "sha256": entry.get("sha256"),
+        "engine": entry.get("engine"),
+    }
+
+
+def cache_result(key: Optional[str], result: Dict[str, Any]) -> bool:
+    # contour answers given in place of YOLO would be replayed to later auto requests as if YOLO ran
+    if not key or result["route"]["reason"] in FALLBACK_REASONS:
+        return False
+    result_cache.put(key, cache_value(result))
+    return True
+
+
+def replay_cached(
+    cached: Dict[str, Any],
+    detector: Optional[str] = None,
+    record_history: bool = True,
+) -> Dict[str, Any]:
+    # same bytes, same params: point a fresh history entry at the stored files
+    hist_id = uuid4().hex
+    entry = {
+        "id": hist_id,
+        "result_id": cached["result_id"],
+        "filename": cached["filename"],
+        "original_url": cached["original_url"],
+        "annotated_url": cached["annotated_url"],
+        "uploaded_at": datetime.utcnow().isoformat() + "Z",
+        "objects_count": len(cached["detections"]),
+        "labels": list(cached["labels"]),
+        "detector": (detector or settings.DETECTOR or "auto"),
+        "engine": cached.get("engine"),
+        "engine_reason": "cached",
+        "cached": True,
+    }
+    if cached.get("sha256"):
+        entry["sha256"] = cached["sha256"]
+    if record_history:
+        try:
+            append_history(entry)
+        except Exception as e:
+            print(f"[history] skip: {e}")
+    return {
+        "detections": cached["detections"],
+        "annotated_url": entry["annotated_url"],
+        "history_id": hist_id,
+        "entry": entry,
+        "route": {"engine": entry["engine"], "reason": "cached"},
+        "files": cached["files"],
+    }
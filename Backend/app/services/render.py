@@ -0,0 +1,251 @@
+import os, json, hashlib, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.detection import Detection, DetectionBatch
+from app.utils.visualize import annotate
+from app.utils.thumbnails import read_reduced
+from app.utils.image import open_mapped
+from app.core.timing import timed
+from app.core.config import settings
+
+FORMATS = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+
+def detections_path(result_id: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, "detections", f"{result_id}.json")
+
+def render_dir(result_id: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, "render_cache", result_id)
+
+
+def save_detections(result_id: str, filename: str, detections: DetectionBatch,
+                    size: Optional[Tuple[int, int]] = None) -> str:
+    path = detections_path(result_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = {
+        "filename": filename,
+        "width": size[0] if size else None,
+        "height": size[1] if size else None,
+        "detections": detections.to_records(),
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+def load_detections(result_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(detections_path(result_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class RenderCache:
+    """Rendered variants, a byte-bounded LRU in memory in front of a byte-bounded directory."""
+
+    def __init__(self, mem_bytes: int, disk_bytes: int) -> None:
+        self.mem_bytes = max(0, int(mem_bytes))
+        self.disk_bytes = max(0, int(disk_bytes))
+        self._mem: "OrderedDict[str, bytes]" = OrderedDict()
+        self._mem_size = 0
+        self._disk: Optional["OrderedDict[str, int]"] = None  # path -> size, oldest first
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _load_disk_index(self) -> None:
+        # one scan per process, afterwards the index is kept in step with our own writes
+        root = os.path.join(settings.UPLOAD_DIR, "render_cache")
+        found = []
+        for dirpath, _, names in os.walk(root):
+            for n in names:
+                p = os.path.join(dirpath, n)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, p, st.st_size))
+        found.sort()
+        self._disk = OrderedDict((p, size) for _, p, size in found)
+        self._disk_size = sum(size for _, _, size in found)
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.mem_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_size -= len(old)
+        self._mem[key] = data
+        self._mem_size += len(data)
+        while self._mem_size > self.mem_bytes:
+            _, dropped = self._mem.popitem(last=False)
+            self._mem_size -= len(dropped)
+
+    def get(self, path: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._mem.get(path)
+            if data is not None:
+                self._mem.move_to_end(path)
+                self.hits += 1
+                return data
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(path, data)
+            if self._disk is not None and path in self._disk:
+                self._disk.move_to_end(path)
+        return data
+
+    def put(self, path: str, data: bytes) -> None:
+        with self._lock:
+            self._remember(path, data)
+        if not self.disk_bytes or len(data) > self.disk_bytes:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._disk is None:
+                self._load_disk_index()
+            else:
+                self._disk_size += len(data) - self._disk.pop(path, 0)
+                self._disk[path] = len(data)
+            while self._disk_size > self.disk_bytes and self._disk:
+                p, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                dropped = self._mem.pop(p, None)
+                if dropped is not None:
+                    self._mem_size -= len(dropped)
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def forget(self, result_id: str) -> None:
+        prefix = render_dir(result_id) + os.sep
+        with self._lock:
+            for p in [p for p in self._mem if p.startswith(prefix)]:
+                self._mem_size -= len(self._mem.pop(p))
+            if self._disk is not None:
+                for p in [p for p in self._disk if p.startswith(prefix)]:
+                    self._disk_size -= self._disk.pop(p)
+
+    def clear(self) -> None:
+        # memory only; files on disk go with their results, the index is rebuilt on the next put
+        with self._lock:
+            self._mem.clear()
+            self._mem_size = 0
+            self._disk = None
+            self._disk_size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_entries": len(self._mem),
+                "memory_bytes": self._mem_size,
+                "disk_entries": None if self._disk is None else len(self._disk),
+                "disk_bytes": None if self._disk is None else self._disk_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+render_cache = RenderCache(settings.RENDER_CACHE_MEM_BYTES, settings.RENDER_CACHE_DISK_BYTES)
+
+
+def _pick_format(filename: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    ext = os.path.splitext(filename)[1].lower().lstrip(".")
+    return "png" if ext == "png" else "jpg"
+
+
+def variant(
+    result_id: str,
+    conf: Optional[float] = None,
+    labels: Optional[List[str]] = None,
+    max_width: Optional[int] = None,
+    fmt: Optional[str] = None,
+) -> Optional[Tuple[str, str, str, Dict[str, Any]]]:
+    """(etag, cache path, format, sidecar) for a render request, without rendering anything."""
+    sidecar = load_detections(result_id)
+    if sidecar is None:
+        return None
+    fmt = _pick_format(sidecar["filename"], fmt)
+    labels_key = ",".join(sorted(set(labels))) if labels else ""
+    spec = f"{result_id}|{conf if conf is not None else ''}|{labels_key}|{max_width or ''}|{fmt}"
+    etag = hashlib.sha1(spec.encode()).hexdigest()[:20]
+    return etag, os.path.join(render_dir(result_id), f"{etag}.{fmt}"), fmt, sidecar
+
+
+@timed("render")
+def render_annotated(
+    sidecar: Dict[str, Any],
+    conf: Optional[float] = None,
+    labels: Optional[List[str]] = None,
+    max_width: Optional[int] = None,
+    fmt: str = "jpg",
+) -> Optional[bytes]:
+    import cv2
+    path = os.path.join(settings.UPLOAD_DIR, sidecar["filename"])
+    # huge originals: map BMPs in place, let libjpeg decode JPEGs at reduced scale
+    img = open_mapped(path)
+    if img is None:
+        img = read_reduced(path, max_width) if max_width else cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    wanted = set(labels) if labels else None
+    dets = [
+        Detection(**d) for d in sidecar["detections"]
+        if (conf is None or d["confidence"] >= conf) and (wanted is None or d["label"] in wanted)
+    ]
+    scale = img.shape[1] / (sidecar.get("width") or img.shape[1])
+    if max_width and img.shape[1] > max_width:
+        f = max_width / img.shape[1]
+        img = cv2.resize(img, (max_width, max(1, round(img.shape[0] * f))), interpolation=cv2.INTER_AREA)
+        scale *= f
+    elif not img.flags.writeable or not img.flags.c_contiguous:
+        # a read-only map that is already contiguous (top-down BMP) would come back as is
+        img = np.array(img)
+    annotate(img, dets, scale=scale)
+    if fmt == "jpg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, settings.RENDER_JPEG_QUALITY]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, settings.RENDER_JPEG_QUALITY]
+    else:
+        params = []
+    ok, buf = cv2.imencode(f".{fmt}", img, params)
+    return buf.tobytes() if ok else None
+
+
+def get_rendered(
+    sidecar: Dict[str, Any],
+    path: str,
+    conf: Optional[float] = None,
+    labels: Optional[List[str]] = None,
+    max_width: Optional[int] = None,
+    fmt: str = "jpg",
+) -> Optional[bytes]:
+    data = render_cache.get(path)
+    if data is None:
+        data = render_annotated(sidecar, conf=conf, labels=labels, max_width=max_width, fmt=fmt)
+        if data is not None:
+            render_cache.put(path, data)
+    return data
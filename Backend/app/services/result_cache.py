@@ -0,0 +1,114 @@
+import os, time, threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+from app.core.config import settings
+
+
+def weights_fingerprint(weights: Optional[str] = None) -> str:
+    w = weights or settings.MODEL_WEIGHTS or "yolov8n.pt"
+    try:
+        st = os.stat(w)
+        return f"{os.path.abspath(w)}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        return w
+
+
+class ResultCache:
+    """Maps (content hash, analysis params) to a finished analysis result."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0) -> None:
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self._data: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._weights: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, sha256: str, detector: Optional[str], conf: float, max_dets: int) -> str:
+        mode = (detector or settings.DETECTOR or "auto").lower()
+        weights = "-" if mode == "contour" else self._check_weights()
+        if mode == "onnx" and settings.ONNX_QUANTIZE:
+            weights += "|int8"
+        return f"{sha256}|{mode}|{conf:.4f}|{max_dets}|{weights}"
+
+    def _check_weights(self) -> str:
+        fp = weights_fingerprint()
+        if fp != self._weights:
+            with self._lock:
+                if self._weights is not None and fp != self._weights:
+                    self._data.clear()
+                    self.invalidations += 1
+                    print("[cache] model weights changed, results invalidated")
+                self._weights = fp
+        return fp
+
+    @staticmethod
+    def _files_exist(value: Dict[str, Any]) -> bool:
+        for rel in value.get("files", ()):
+            if not os.path.exists(os.path.join(settings.UPLOAD_DIR, rel)):
+                return False
+        return True
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.max_entries == 0:
+            return None
+        now = time.time()
+        with self._lock:
+            hit = self._data.get(key)
+        # stat the files without holding the lock; drop the entry only if nobody replaced it meanwhile
+        stale = hit is not None and (now - hit[0] > self.ttl or not self._files_exist(hit[1]))
+        with self._lock:
+            if stale and self._data.get(key) is hit:
+                del self._data[key]
+                self.evictions += 1
+            if hit is None or stale:
+                self.misses += 1
+                return None
+            if key in self._data:
+                self._data.move_to_end(key)
+            self.hits += 1
+            return hit[1]
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard_files(self, filenames: Iterable[str]) -> int:
+        gone = {fn for fn in filenames if fn}
+        if not gone:
+            return 0
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if gone.intersection(v.get("files", ()))]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+result_cache = ResultCache(
+    max_entries=settings.RESULT_CACHE_SIZE, ttl_seconds=settings.RESULT_CACHE_TTL
+)
@@ -0,0 +1,290 @@
+import os, re, time, shutil, threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.utils.storage import FileLock, CONTENT_DIR, PENDING_DIR, upload_key
+from app.utils.history import get_history_backend, delete_history_items
+from app.services.result_cache import result_cache
+
+# pre-sharding uploads and debug files sit directly in UPLOAD_DIR; anything else there is bookkeeping
+_FLAT_UPLOAD = re.compile(r"^(smoke_|min_)?[0-9a-f]{32}_")
+_PART = re.compile(r"^\.[0-9a-f]{32}\.part$")
+
+FileInfo = Tuple[str, int, float, float]  # (relative path, size, atime, mtime)
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _pending(root: str, now: float) -> Set[str]:
+    """Upload keys still waiting for their history entry; markers past STORAGE_PENDING_MAX_AGE are dropped."""
+    keys: Set[str] = set()
+    pdir = os.path.join(root, PENDING_DIR)
+    try:
+        it = os.scandir(pdir)
+    except OSError:
+        return keys
+    with it:
+        for e in it:
+            try:
+                if now - e.stat().st_mtime < settings.STORAGE_PENDING_MAX_AGE:
+                    keys.add(e.name)
+                else:
+                    os.remove(e.path)
+            except OSError:
+                continue
+    return keys
+
+def _walk(root: str) -> Iterator[FileInfo]:
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root, rel_dir) if rel_dir else root)
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                rel = f"{rel_dir}/{e.name}" if rel_dir else e.name
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(rel)
+                    elif e.is_file(follow_symlinks=False):
+                        st = e.stat(follow_symlinks=False)
+                        yield rel, st.st_size, st.st_atime, st.st_mtime
+                except OSError:
+                    continue
+
+
+class _Live:
+    """What the history still references, keyed the way files on disk name their owner."""
+
+    def __init__(self) -> None:
+        self.by_file: Dict[str, List[str]] = defaultdict(list)  # stored filename -> history ids
+        self.rid_file: Dict[str, str] = {}  # result id -> stored filename
+        self.annotated: Dict[str, str] = {}  # "annotated/..." -> stored filename
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        fn = entry.get("filename") or ""
+        self.by_file[fn].append(entry["id"])
+        if entry.get("result_id"):
+            self.rid_file[entry["result_id"]] = fn
+        url = entry.get("annotated_url") or ""
+        if url.startswith("/static/"):
+            self.annotated[url[len("/static/"):]] = fn
+
+    def drop(self, fn: str) -> None:
+        self.by_file.pop(fn, None)
+
+    def owner(self, rel: str) -> Tuple[Optional[str], bool]:
+        """(stored filename the file belongs to, whether the sweeper may delete it)."""
+        top, _, rest = rel.partition("/")
+        if not rest:
+            return (rel, True) if _FLAT_UPLOAD.match(rel) or _PART.match(rel) else (None, False)
+        if top == CONTENT_DIR:
+            return rel, True
+        if top == "thumbs":
+            return os.path.splitext(rest.partition("/")[2])[0], True
+        if top == "annotated":
+            return self.annotated.get(rel, rel), True
+        if top in ("detections", "render_cache"):
+            rid = rest.split("/")[0].split(".")[0]
+            return self.rid_file.get(rid, f"\0{rid}"), True
+        return None, False  # history, index, jobs, profiles, locks
+
+    def referenced(self, owner: str) -> bool:
+        return owner in self.by_file
+
+
+class StorageSweeper:
+    """Expires old entries, enforces the disk quota (least recently used first) and
+    removes files no history entry points at, all in batches off the request path."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()  # one sweep per process; the file lock covers other workers
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.removed_entries = 0
+        self.removed_files = 0
+        self.freed_bytes = 0
+        self.usage_bytes: Optional[int] = None
+        self.last: Dict[str, Any] = {}
+
+    def start(self) -> None:
+        if settings.STORAGE_SWEEP_INTERVAL <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="storage-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(settings.STORAGE_SWEEP_INTERVAL):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[retention] sweep failed: {e}")
+
+    def purge_async(self, before: float) -> threading.Thread:
+        # after clear_history: everything unreferenced and older than `before` goes, no grace period
+        def run() -> None:
+            try:
+                self.sweep(orphans_before=before, retention=False, blocking=True)
+            except Exception as e:
+                print(f"[retention] purge failed: {e}")
+        t = threading.Thread(target=run, name="storage-purge", daemon=True)
+        t.start()
+        return t
+
+    def sweep(
+        self,
+        now: Optional[float] = None,
+        orphans_before: Optional[float] = None,
+        retention: bool = True,
+        blocking: bool = False,
+    ) -> Dict[str, Any]:
+        now = time.time() if now is None else now
+        flock = FileLock(os.path.join(settings.UPLOAD_DIR, ".sweep.lock"))
+        if not self._lock.acquire(blocking=blocking):
+            return {"skipped": True}
+        try:
+            if not flock.acquire(blocking=blocking):
+                return {"skipped": True}  # another worker process is sweeping
+            try:
+                out = self._sweep(now, orphans_before if orphans_before is not None
+                                  else now - settings.STORAGE_ORPHAN_GRACE, retention)
+            finally:
+                flock.release()
+            self.runs += 1
+            self.removed_entries += out["expired"] + out["evicted"]
+            self.removed_files += out["orphans"]
+            self.freed_bytes += out["freed_bytes"]
+            self.usage_bytes = out["usage_bytes"]
+            self.last = {**out, "at": now}
+            return out
+        finally:
+            self._lock.release()
+
+    def _sweep(self, now: float, orphans_before: float, retention: bool) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        out = {"expired": 0, "evicted": 0, "orphans": 0, "freed_bytes": 0, "usage_bytes": 0}
+        ttl = settings.STORAGE_TTL_HOURS * 3600.0 if retention else 0.0
+        live = _Live()
+        expired: List[str] = []
+        undated = 0
+        for entry in get_history_backend().iter_all():
+            uploaded = _timestamp(entry.get("uploaded_at")) if ttl else None
+            if ttl and uploaded is None:
+                undated += 1  # can't tell its age: kept
+            if uploaded is not None and uploaded < now - ttl:
+                expired.append(entry["id"])
+            else:
+                live.add(entry)
+        if undated:
+            print(f"[retention] {undated} entries without a readable uploaded_at kept")
+        out["expired"] = self._delete(expired)
+
+        # one walk: total usage, per-entry footprint and last use, orphans
+        root = settings.UPLOAD_DIR
+        pending = _pending(root, now)
+        # sidecars and partial writes can't be traced to an upload: never younger than the grace
+        # period, also in a purge, so requests still running keep theirs
+        untraced_before = min(orphans_before, now - settings.STORAGE_ORPHAN_GRACE)
+        sizes: Dict[str, int] = defaultdict(int)
+        last_used: Dict[str, float] = {}
+        orphans: List[Tuple[str, int]] = []
+        for rel, size, atime, mtime in _walk(root):
+            out["usage_bytes"] += size
+            owner, removable = live.owner(rel)
+            if owner is None:
+                continue
+            if live.referenced(owner):
+                sizes[owner] += size
+                if rel == owner:
+                    last_used[owner] = max(atime, mtime)
+            elif removable:
+                key = upload_key(owner)
+                if key in pending:
+                    continue  # uploaded, history entry not written yet (queued job, running analysis)
+                if mtime < (orphans_before if key else untraced_before):
+                    orphans.append((rel, size))
+        removed: Set[str] = set()
+        for rel, size in orphans:
+            if self._remove(root, rel):
+                removed.add(rel)
+                out["orphans"] += 1
+                out["freed_bytes"] += size
+        result_cache.discard_files(removed)
+        out["usage_bytes"] -= out["freed_bytes"]
+
+        quota = settings.STORAGE_QUOTA_BYTES if retention else 0
+        if quota and out["usage_bytes"] > quota:
+            target = quota * min(1.0, max(0.0, settings.STORAGE_QUOTA_LOW))
+            lru = sorted(last_used, key=last_used.get)
+            evict: List[str] = []
+            for fn in lru:
+                if out["usage_bytes"] <= target:
+                    break
+                evict.extend(live.by_file[fn])
+                out["usage_bytes"] -= sizes[fn]
+                out["freed_bytes"] += sizes[fn]
+                live.drop(fn)
+            out["evicted"] = self._delete(evict)
+        out["took_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        if out["expired"] or out["evicted"] or out["orphans"]:
+            print(f"[retention] expired={out['expired']} evicted={out['evicted']} orphans={out['orphans']} "
+                  f"freed={out['freed_bytes']}B in {out['took_ms']}ms")
+        return out
+
+    @staticmethod
+    def _delete(hids: List[str]) -> int:
+        n = 0
+        step = max(1, settings.STORAGE_SWEEP_BATCH)
+        for start in range(0, len(hids), step):
+            n += len(delete_history_items(hids[start:start + step]))
+        return n
+
+    @staticmethod
+    def _remove(root: str, rel: str) -> bool:
+        path = os.path.join(root, rel)
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        if rel.startswith("render_cache/"):
+            from app.services.render import render_cache
+            render_cache.forget(rel.split("/")[1])
+        # drop shard / per-result directories once empty, never the top-level ones
+        parent = os.path.dirname(rel)
+        while "/" in parent:
+            try:
+                os.rmdir(os.path.join(root, parent))
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "interval_seconds": settings.STORAGE_SWEEP_INTERVAL,
+            "ttl_hours": settings.STORAGE_TTL_HOURS,
+            "quota_bytes": settings.STORAGE_QUOTA_BYTES,
+            "usage_bytes": self.usage_bytes,
+            "runs": self.runs,
+            "removed_entries": self.removed_entries,
+            "removed_files": self.removed_files,
+            "freed_bytes": self.freed_bytes,
+            "last": self.last or None,
+        }
+
+
+sweeper = StorageSweeper()
@@ -0,0 +1,127 @@
+import math, threading, time
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.executor import CancelToken
+from app.services.model_registry import model_registry
+from app.core.config import settings
+
+Route = Dict[str, Any]  # {"engine", "reason", "estimate_ms"?, "budget_ms"?}
+# contour answers given in place of YOLO (budget, cold or failing model); not what an
+# unhurried auto request would get. Every reason with engine "contour" for mode auto is here.
+FALLBACK_REASONS = ("over_budget", "yolo_cold", "yolo_cooldown", "yolo_error")
+
+
+class LatencyEstimator:
+    """Exponentially weighted latency per engine; the configured prior until the first sample."""
+
+    def __init__(self, alpha: float = 0.2, priors: Optional[Dict[str, float]] = None) -> None:
+        self.alpha = min(1.0, max(0.01, float(alpha)))
+        self.priors = dict(priors or {})
+        self._ewma: Dict[str, float] = {}
+        self._count: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, engine: str, ms: float) -> None:
+        with self._lock:
+            old = self._ewma.get(engine)
+            self._ewma[engine] = ms if old is None else old + self.alpha * (ms - old)
+            self._count[engine] = self._count.get(engine, 0) + 1
+
+    def estimate(self, engine: str) -> float:
+        with self._lock:
+            return self._ewma.get(engine, self.priors.get(engine, 0.0))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            engines = set(self._ewma) | set(self.priors)
+            return {e: {"estimate_ms": self._ewma.get(e, self.priors.get(e, 0.0)),
+                        "samples": self._count.get(e, 0)} for e in sorted(engines)}
+
+
+class EngineRouter:
+    """Picks the engine for detector=auto.
+
+    Without a budget it's YOLO, as before. With one, YOLO is used only when its
+    estimate (time to drain the batcher queue ahead of us plus one predict) fits
+    in what is left of the budget; otherwise, or while the model is cold or in a
+    failure cooldown, the contour engine answers.
+    """
+
+    def __init__(self, scheduler: Any, latency: LatencyEstimator) -> None:
+        self.scheduler = scheduler
+        self.latency = latency
+        self._failed_at = 0.0
+        self._warming = False
+        self._lock = threading.Lock()
+        self.decisions: Dict[Tuple[str, str], int] = {}
+
+    def yolo_failed(self) -> None:
+        self._failed_at = time.monotonic()
+
+    def _cooling_down(self) -> bool:
+        return self._failed_at and time.monotonic() - self._failed_at < settings.ROUTE_FAILURE_COOLDOWN
+
+    def yolo_estimate(self, tiles: int = 1) -> float:
+        predict = self.latency.estimate("yolo")
+        pending = self.scheduler.pending
+        batch = max(1, self.scheduler.max_batch)
+        # batches ahead of ours, then ours (tiles of one image are batched together too)
+        rounds = pending // batch + max(1, math.ceil(tiles / batch))
+        wait = self.scheduler.max_wait * 1000.0 if batch > 1 else 0.0
+        return rounds * predict + wait
+
+    def _warm_in_background(self) -> None:
+        with self._lock:
+            if self._warming:
+                return
+            self._warming = True
+
+        def run() -> None:
+            try:
+                model_registry.get()
+            except Exception as e:
+                print(f"[routing] YOLO load failed: {e}")
+                self.yolo_failed()
+            finally:
+                self._warming = False
+        threading.Thread(target=run, name="yolo-warm", daemon=True).start()
+
+    def choose(
+        self,
+        mode: str,
+        budget_ms: Optional[float] = None,
+        token: Optional[CancelToken] = None,
+        tiles: int = 1,
+    ) -> Route:
+        if mode != "auto":
+            return self.record({"engine": mode, "reason": "requested"})
+        if self._cooling_down():
+            return self.record({"engine": "contour", "reason": "yolo_cooldown"})
+        if not budget_ms:
+            return self.record({"engine": "yolo", "reason": "default"})
+        left = budget_ms - (token.elapsed_ms() if token is not None else 0.0)
+        if not model_registry.is_loaded():
+            # don't make this request pay for the load; later ones get the warm model
+            self._warm_in_background()
+            return self.record({"engine": "contour", "reason": "yolo_cold", "budget_ms": budget_ms})
+        est = self.yolo_estimate(tiles)
+        route = {"estimate_ms": round(est, 1), "budget_ms": budget_ms}
+        if est <= left:
+            return self.record({"engine": "yolo", "reason": "within_budget", **route})
+        return self.record({"engine": "contour", "reason": "over_budget", **route})
+
+    def record(self, route: Route) -> Route:
+        key = (route["engine"], route["reason"])
+        with self._lock:
+            self.decisions[key] = self.decisions.get(key, 0) + 1
+        return route
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            decisions = [{"engine": e, "reason": r, "count": n} for (e, r), n in sorted(self.decisions.items())]
+        return {
+            "latency": self.latency.stats(),
+            "yolo_estimate_ms": self.yolo_estimate(),
+            "yolo_cooldown": bool(self._cooling_down()),
+            "decisions": decisions,
+        }
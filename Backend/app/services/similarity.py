@@ -0,0 +1,279 @@
+import os, json, threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models.detection import DetectionBatch, HIST_BINS
+from app.utils.storage import FileLock
+from app.core.config import settings
+
+# one row per stored object; vectors live in a separate (rows, HIST_BINS) float32 file
+META_DTYPE = np.dtype([
+    ("rid", "S32"),         # result id (uuid hex)
+    ("obj", "<i4"),         # object index within that result
+    ("label", "<i4"),       # id into labels.json
+    ("bbox", "<i4", (4,)),
+    ("norm2", "<f4"),       # squared L2 norm of the vector, for distances via one mat-vec
+    ("live", "u1"),         # 0 once the result is deleted
+    ("_pad", "V3"),
+])
+VEC_BYTES = HIST_BINS * 4
+METRICS = ("l2", "cosine", "intersection")
+
+
+class HistogramIndex:
+    """Append-only, memory-mapped store of per-object histograms for nearest-neighbour search.
+
+    Writers append under a file lock, so uvicorn and executor processes can share one
+    directory; readers remap whenever the files have grown. Deletes clear `live` in place.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._flock = FileLock(os.path.join(directory, "index.lock"))
+        self._vecs: Optional[np.ndarray] = None
+        self._meta: Optional[np.ndarray] = None
+        self._mapped: Tuple[int, int] = (-1, 0)  # (inode, rows) behind the current maps
+        self._labels: List[str] = []
+        self._label_ids: Dict[str, int] = {}
+        self._labels_mtime = 0.0
+
+    @property
+    def vec_path(self) -> str:
+        return os.path.join(self.directory, "vectors.f32")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.directory, "meta.bin")
+
+    @property
+    def labels_path(self) -> str:
+        return os.path.join(self.directory, "labels.json")
+
+    def _sizes(self) -> int:
+        return self._stat()[1]
+
+    def _stat(self) -> Tuple[int, int]:
+        try:
+            n_vec = os.path.getsize(self.vec_path) // VEC_BYTES
+            st = os.stat(self.meta_path)
+        except OSError:
+            return -1, 0
+        return st.st_ino, min(n_vec, st.st_size // META_DTYPE.itemsize)  # a writer may be between the two appends
+
+    def _load_labels(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.labels_path)
+        except OSError:
+            self._labels, self._label_ids, self._labels_mtime = [], {}, 0.0
+            return
+        if mtime != self._labels_mtime:
+            with open(self.labels_path, encoding="utf-8") as f:
+                self._labels = json.load(f)
+            self._label_ids = {lb: i for i, lb in enumerate(self._labels)}
+            self._labels_mtime = mtime
+
+    def _open(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            ino, n = self._stat()
+            if self._meta is None or self._mapped != (ino, n):
+                self._mapped = (ino, n)
+                if n == 0:
+                    self._vecs = np.zeros((0, HIST_BINS), dtype=np.float32)
+                    self._meta = np.zeros(0, dtype=META_DTYPE)
+                else:
+                    self._vecs = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(n, HIST_BINS))
+                    self._meta = np.memmap(self.meta_path, dtype=META_DTYPE, mode="r", shape=(n,))
+                self._load_labels()
+            return self._vecs, self._meta
+
+    def _label_id(self, label: str) -> int:
+        # caller holds the file lock
+        i = self._label_ids.get(label)
+        if i is None:
+            i = len(self._labels)
+            self._labels.append(label)
+            self._label_ids[label] = i
+            tmp = f"{self.labels_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._labels, f)
+            os.replace(tmp, self.labels_path)
+            self._labels_mtime = os.path.getmtime(self.labels_path)
+        return i
+
+    def add(self, result_id: str, detections: DetectionBatch) -> int:
+        if detections.histograms is None or not len(detections):
+            return 0
+        keep = np.flatnonzero(detections.valid) if detections.valid is not None else np.arange(len(detections))
+        if not len(keep):
+            return 0
+        vecs = np.ascontiguousarray(detections.histograms[keep], dtype=np.float32)
+        labels = [detections.names[c] for c in detections.class_ids[keep].tolist()]
+        with self._lock, self._flock:
+            self._load_labels()
+            meta = np.zeros(len(keep), dtype=META_DTYPE)
+            meta["rid"] = result_id.encode()
+            meta["obj"] = keep
+            meta["label"] = [self._label_id(lb) for lb in labels]
+            meta["bbox"] = detections.boxes[keep]
+            meta["norm2"] = np.einsum("ij,ij->i", vecs, vecs)
+            meta["live"] = 1
+            os.makedirs(self.directory, exist_ok=True)
+            n = self._sizes()
+            # truncate a torn append left by a crashed writer before adding rows
+            for path, size, data in ((self.vec_path, n * VEC_BYTES, vecs), (self.meta_path, n * META_DTYPE.itemsize, meta)):
+                with open(path, "ab") as f:
+                    if f.tell() != size:
+                        f.truncate(size)
+                    f.write(data.tobytes())
+        return len(keep)
+
+    def _rows(self, meta: np.ndarray, result_id: str) -> np.ndarray:
+        return np.flatnonzero(meta["rid"] == result_id.encode())
+
+    def get(self, result_id: str, obj: int) -> Optional[Dict[str, Any]]:
+        vecs, meta = self._open()
+        rows = self._rows(meta, result_id)
+        rows = rows[(meta["obj"][rows] == obj) & (meta["live"][rows] == 1)]
+        if not len(rows):
+            return None
+        row = int(rows[0])
+        return {"row": row, "vector": np.array(vecs[row]), **self._describe(meta[row])}
+
+    def remove(self, result_id: str) -> int:
+        return self.remove_many([result_id])
+
+    def remove_many(self, result_ids: Sequence[str]) -> int:
+        # one pass over the meta file for a whole batch of deleted entries
+        ids = np.array([r.encode() for r in result_ids], dtype=META_DTYPE["rid"])
+        if not len(ids):
+            return 0
+        with self._lock, self._flock:
+            n = self._sizes()
+            if n == 0:
+                return 0
+            meta = np.memmap(self.meta_path, dtype=META_DTYPE, mode="r+", shape=(n,))
+            rows = np.flatnonzero(np.isin(meta["rid"], ids) & (meta["live"] == 1))
+            if len(rows):
+                meta["live"][rows] = 0
+                meta.flush()
+            del meta
+            return len(rows)
+
+    def clear(self) -> None:
+        with self._lock, self._flock:
+            self._vecs = self._meta = None
+            self._mapped = (-1, 0)
+            for p in (self.vec_path, self.meta_path, self.labels_path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            self._labels, self._label_ids, self._labels_mtime = [], {}, 0.0
+
+    def _describe(self, m: np.void) -> Dict[str, Any]:
+        label = int(m["label"])
+        if label >= len(self._labels):
+            self._labels_mtime = 0.0
+            self._load_labels()
+        return {
+            "result_id": m["rid"].decode(),
+            "object": int(m["obj"]),
+            "label": self._labels[label] if label < len(self._labels) else f"id_{label}",
+            "bbox": m["bbox"].tolist(),
+        }
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int = 10,
+        labels: Optional[Sequence[str]] = None,
+        metric: str = "l2",
+        exclude_row: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Top-k live rows nearest to `query`, closest first, scanned in fixed-size chunks."""
+        vecs, meta = self._open()
+        n = len(meta)
+        q = np.asarray(query, dtype=np.float32).reshape(HIST_BINS)
+        qn = float(q @ q)
+        wanted = None
+        if labels:
+            wanted = np.array([self._label_ids[lb] for lb in labels if lb in self._label_ids], dtype=np.int32)
+            if not len(wanted):
+                return []
+        chunk = max(1024, settings.SIMILARITY_CHUNK_ROWS)
+        best_d: List[np.ndarray] = []
+        best_i: List[np.ndarray] = []
+        for start in range(0, n, chunk):
+            X = vecs[start:start + chunk]
+            m = meta[start:start + chunk]
+            if metric == "intersection":
+                d = 1.0 - np.minimum(X, q).sum(axis=1)
+            else:
+                dot = X @ q
+                if metric == "cosine":
+                    d = 1.0 - dot / np.sqrt(np.maximum(m["norm2"] * qn, 1e-12))
+                else:
+                    d = np.maximum(m["norm2"] - 2.0 * dot + qn, 0.0)
+            mask = m["live"] == 1
+            if wanted is not None:
+                mask &= np.isin(m["label"], wanted)
+            if exclude_row is not None and start <= exclude_row < start + len(m):
+                mask[exclude_row - start] = False
+            idx = np.flatnonzero(mask)
+            if not len(idx):
+                continue
+            d = d[idx]
+            if len(idx) > k:
+                part = np.argpartition(d, k - 1)[:k]
+                idx, d = idx[part], d[part]
+            best_i.append(idx + start)
+            best_d.append(d)
+        if not best_i:
+            return []
+        rows, dists = np.concatenate(best_i), np.concatenate(best_d)
+        order = np.argsort(dists, kind="stable")[:k]
+        out = []
+        for row, dist in zip(rows[order].tolist(), dists[order].tolist()):
+            item = self._describe(meta[row])
+            item["distance"] = float(np.sqrt(dist)) if metric == "l2" else float(dist)
+            out.append(item)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        _, meta = self._open()
+        return {"rows": len(meta), "live": int((meta["live"] == 1).sum()) if len(meta) else 0,
+                "labels": len(self._labels)}
+
+
+_index: Optional[HistogramIndex] = None
+_index_lock = threading.Lock()
+
+def get_index() -> HistogramIndex:
+    global _index
+    directory = settings.SIMILARITY_DIR or os.path.join(settings.UPLOAD_DIR, "index")
+    with _index_lock:
+        if _index is None or _index.directory != directory:
+            _index = HistogramIndex(directory)
+        return _index
+
+
+def index_detections(result_id: str, detections: DetectionBatch) -> None:
+    if not settings.SIMILARITY_INDEX:
+        return
+    try:
+        get_index().add(result_id, detections)
+    except Exception as e:
+        print(f"[similarity] index skip: {e}")
+
+
+def describe_upload(path: str, conf: float, max_dets: int, detector: Optional[str]) -> DetectionBatch:
+    # detections + histograms for a query image; nothing is stored
+    from app.utils.image import ImageContext, open_mapped
+    from app.services.inference import run_inference_batch
+    from app.services.analytics import compute_statistics_batch
+    view = open_mapped(path)
+    ctx = ImageContext(view) if view is not None else ImageContext.from_path(path)
+    dets = run_inference_batch(ctx, conf=conf, max_dets=max_dets, detector_override=detector)
+    return dets.with_stats(compute_statistics_batch(ctx, dets.boxes))
@@ -0,0 +1,115 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.detection import DetectionBatch
+from app.utils.boxes import nms, box_area, pairwise_intersection
+from app.core.config import settings
+
+Window = Tuple[int, int, int, int]  # x1, y1, x2, y2
+
+
+def tile_windows(height: int, width: int, tile: int, overlap: int) -> List[Window]:
+    tile = max(32, int(tile))
+    overlap = min(max(0, int(overlap)), tile // 2)
+    step = tile - overlap
+
+    def starts(n: int) -> List[int]:
+        if n <= tile:
+            return [0]
+        out = list(range(0, n - tile, step))
+        out.append(n - tile)  # last tile flush with the edge instead of a thin sliver
+        return out
+
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in starts(height) for x in starts(width)]
+
+
+def should_tile(height: int, width: int) -> bool:
+    mode = settings.TILE_MODE.lower()
+    if mode == "off":
+        return False
+    if max(height, width) <= settings.TILE_SIZE:
+        return False
+    return mode == "on" or height * width >= settings.TILE_MIN_PIXELS
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, settings.TILE_WORKERS), thread_name_prefix="tile")
+        return _pool
+
+
+def detect_tiled(
+    image: np.ndarray,
+    detect: Callable[[np.ndarray], DetectionBatch],
+    max_dets: Optional[int] = None,
+    tile: Optional[int] = None,
+    overlap: Optional[int] = None,
+) -> DetectionBatch:
+    """Run `detect` over overlapping tiles and merge the boxes in image coordinates.
+
+    Tiles are copied out of `image` only when their turn comes, and at most 2 x TILE_WORKERS
+    are alive at once, so tiling adds little on top of `image` itself. Only a memmapped
+    image (uncompressed BMP, .npy) stays out of RAM; the pipeline decodes any other format
+    whole before tiling, so MAX_IMAGE_PIXELS is what bounds the peak.
+    """
+    height, width = image.shape[:2]
+    windows = tile_windows(height, width, tile or settings.TILE_SIZE,
+                           settings.TILE_OVERLAP if overlap is None else overlap)
+
+    def run(win: Window) -> Tuple[DetectionBatch, np.ndarray]:
+        x1, y1, x2, y2 = win
+        dets = detect(np.ascontiguousarray(image[y1:y2, x1:x2]))
+        b = dets.boxes
+        # touches a tile edge that is not also an image edge
+        cut = (((b[:, 0] <= 1) & (x1 > 0)) | ((b[:, 1] <= 1) & (y1 > 0))
+               | ((b[:, 2] >= x2 - x1 - 1) & (x2 < width)) | ((b[:, 3] >= y2 - y1 - 1) & (y2 < height)))
+        return dets.shift(x1, y1), cut
+
+    pool = _get_pool()
+    window = max(1, settings.TILE_WORKERS) * 2
+    pending: deque = deque()
+    parts: List[DetectionBatch] = []
+    cuts: List[np.ndarray] = []
+    todo = iter(windows)
+    while True:
+        while len(pending) < window:
+            win = next(todo, None)
+            if win is None:
+                break
+            pending.append(pool.submit(run, win))
+        if not pending:
+            break
+        dets, cut = pending.popleft().result()
+        if len(dets):
+            parts.append(dets)
+            cuts.append(cut)
+
+    merged = DetectionBatch.concat(parts)
+    if not len(merged):
+        return merged
+    arr = merged.boxes.astype(np.float32)
+    classes = merged.class_ids
+
+    # a box cut by a tile border is a fragment of an object that a neighbouring tile saw
+    # whole (when it fits in the overlap); drop fragments mostly covered by such a box
+    cut_mask = np.concatenate(cuts)
+    drop = np.zeros(len(arr), dtype=bool)
+    if cut_mask.any() and (~cut_mask).any():
+        frag, whole = np.flatnonzero(cut_mask), np.flatnonzero(~cut_mask)
+        inter = pairwise_intersection(arr[frag], arr[whole])
+        inter *= classes[frag][:, None] == classes[whole][None, :]
+        covered = inter.max(axis=1) > 0.5 * np.maximum(box_area(arr[frag]), 1e-9)
+        drop[frag[covered]] = True
+
+    rest = np.flatnonzero(~drop)
+    keep = nms(arr[rest], merged.scores[rest], settings.TILE_NMS_IOU, max_out=max_dets, classes=classes[rest])
+    return merged.take(rest[keep])
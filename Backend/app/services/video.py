@@ -0,0 +1,297 @@
+import os, asyncio, queue, threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.models.detection import DetectionBatch
+from app.services.inference import run_inference_batch
+from app.services.analytics import compute_statistics_batch
+from app.utils.image import ImageContext
+from app.utils.thumbnails import make_thumbnails, remove_thumbnails
+from app.utils.history import append_history
+from app.utils.storage import release_pending
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    import cv2
+
+VIDEO_EXTS = {".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v", ".mpg", ".mpeg"}
+SCENE_SIZE = (64, 36)  # frames are compared at this size for scene-change sampling
+
+Frame = Tuple[int, float, np.ndarray]  # index, time in ms, BGR image
+
+
+class VideoDecodeError(ValueError):
+    pass
+
+
+class VideoInfo:
+    __slots__ = ("fps", "frame_count", "width", "height")
+
+    def __init__(self, fps: float, frame_count: int, width: int, height: int) -> None:
+        self.fps = fps
+        self.frame_count = frame_count
+        self.width = width
+        self.height = height
+
+
+def open_video(path: str) -> Tuple["cv2.VideoCapture", VideoInfo]:
+    import cv2
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        cap.release()
+        raise VideoDecodeError("could not open video")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    info = VideoInfo(
+        fps=fps if fps and np.isfinite(fps) and fps > 0 else 0.0,
+        frame_count=max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)),
+        width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0),
+        height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0),
+    )
+    return cap, info
+
+
+def frame_stride(info: VideoInfo, every: Optional[int] = None, fps: Optional[float] = None) -> int:
+    if every:
+        return max(1, int(every))
+    if fps and info.fps:
+        return max(1, int(round(info.fps / fps)))
+    return 1
+
+
+def sample_frames(
+    cap: "cv2.VideoCapture",
+    info: VideoInfo,
+    stride: int = 1,
+    scene_threshold: Optional[float] = None,
+    max_frames: Optional[int] = None,
+) -> Iterator[Frame]:
+    """Every `stride`-th frame; with `scene_threshold`, only those that differ enough from the last one kept.
+
+    Skipped frames are only grabbed, not converted, which is most of the decode cost saved.
+    """
+    import cv2
+    prev: Optional[np.ndarray] = None
+    index, taken = -1, 0
+    while max_frames is None or taken < max_frames:
+        if not cap.grab():
+            break
+        index += 1
+        if index % stride:
+            continue
+        ok, frame = cap.retrieve()
+        if not ok or frame is None:
+            break
+        if scene_threshold is not None:
+            small = cv2.cvtColor(cv2.resize(frame, SCENE_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+            if prev is not None and cv2.absdiff(small, prev).mean() / 255.0 < scene_threshold:
+                continue
+            prev = small
+        taken += 1
+        t_ms = index * 1000.0 / info.fps if info.fps else float(cap.get(cv2.CAP_PROP_POS_MSEC) or 0.0)
+        yield index, t_ms, frame
+
+
+class LabelTimeline:
+    """Per-label summary over the sampled frames.
+
+    A segment is a run of consecutive samples that contain the label, as [start_ms, end_ms].
+    """
+
+    def __init__(self) -> None:
+        self.labels: Dict[str, Dict[str, Any]] = {}
+        self._last: Dict[str, int] = {}  # label -> sample number it was last seen in
+        self.samples = 0
+        self.peak = 0
+
+    def add(self, t_ms: float, labels: List[str]) -> None:
+        t = round(t_ms, 1)
+        self.peak = max(self.peak, len(labels))
+        for label, n in Counter(labels).items():
+            s = self.labels.get(label)
+            if s is None:
+                s = self.labels[label] = {"frames": 0, "detections": 0, "peak": 0,
+                                          "first_ms": t, "last_ms": t, "segments": []}
+            s["frames"] += 1
+            s["detections"] += n
+            s["peak"] = max(s["peak"], n)
+            s["last_ms"] = t
+            if self._last.get(label) == self.samples - 1:
+                s["segments"][-1][1] = t
+            else:
+                s["segments"].append([t, t])
+            self._last[label] = self.samples
+        self.samples += 1
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        return {k: self.labels[k] for k in sorted(self.labels)}
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_active = threading.BoundedSemaphore(max(1, settings.VIDEO_MAX_ACTIVE))
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, settings.VIDEO_WORKERS), thread_name_prefix="video")
+        return _pool
+
+
+def try_acquire_slot() -> bool:
+    return _active.acquire(blocking=False)
+
+def release_slot() -> None:
+    _active.release()
+
+
+_EOF = object()
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_frames(
+    cap: "cv2.VideoCapture",
+    frames: Iterator[Frame],
+    out: queue.Queue,
+    stop: threading.Event,
+    thumb_name: Optional[str],
+) -> None:
+    # decode stage: runs ahead of inference until `out` is full
+    try:
+        for item in frames:
+            if thumb_name:
+                try:
+                    make_thumbnails(item[2], thumb_name)
+                except Exception as e:
+                    print(f"[video] thumbs skip: {e}")
+                thumb_name = None
+            if not _put(out, item, stop):
+                return
+        _put(out, _EOF, stop)
+    except Exception as e:
+        _put(out, e, stop)
+    finally:
+        cap.release()
+
+
+def _analyze_frame(frame: np.ndarray, conf: float, max_dets: int, detector: Optional[str]) -> DetectionBatch:
+    ctx = ImageContext(frame)
+    dets = run_inference_batch(ctx, conf=conf, max_dets=max_dets, detector_override=detector)
+    return dets.with_stats(compute_statistics_batch(ctx, dets.boxes))
+
+
+async def analyze_video(
+    path: str,
+    filename: str,
+    cap: "cv2.VideoCapture",
+    info: VideoInfo,
+    conf: float = 0.25,
+    max_dets: int = 100,
+    detector: Optional[str] = None,
+    every: Optional[int] = None,
+    fps: Optional[float] = None,
+    scene_threshold: Optional[float] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yields one dict per sampled frame, in order, then a summary with the history id.
+
+    Decoding (reader thread), inference (video pool, batched by the YOLO scheduler) and
+    serialization (the caller) overlap; the frame queue and the in-flight window bound memory.
+    """
+    stride = frame_stride(info, every, fps)
+    frames: queue.Queue = queue.Queue(maxsize=max(1, settings.VIDEO_QUEUE_SIZE))
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=_read_frames, name="video-reader", daemon=True,
+        args=(cap, sample_frames(cap, info, stride, scene_threshold, settings.VIDEO_MAX_FRAMES),
+              frames, stop, filename),
+    )
+    reader.start()
+
+    pool = _get_pool()
+    window = max(1, settings.VIDEO_WORKERS)
+    pending: deque = deque()
+    timeline = LabelTimeline()
+    last_index = -1
+    eof = False
+    done = False
+    try:
+        while True:
+            while not eof and len(pending) < window:
+                try:
+                    # block for a frame only when nothing is in flight
+                    item = frames.get_nowait() if pending else await run_in_threadpool(frames.get, True, 0.5)
+                except queue.Empty:
+                    if pending:
+                        break
+                    continue
+                if item is _EOF:
+                    eof = True
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                index, t_ms, image = item
+                fut = pool.submit(_analyze_frame, image, conf, max_dets, detector)
+                pending.append((index, t_ms, asyncio.wrap_future(fut)))
+            if not pending:
+                break
+            index, t_ms, fut = pending.popleft()
+            dets: DetectionBatch = await fut
+            timeline.add(t_ms, dets.labels)
+            last_index = index
+            yield {"frame": index, "time_ms": round(t_ms, 1), "objects": dets.to_objects()}
+
+        hist_id = uuid4().hex
+        summary = timeline.summary()
+        entry = {
+            "id": hist_id,
+            "kind": "video",
+            "filename": filename,
+            "original_url": f"/static/{filename}",
+            "annotated_url": None,
+            "uploaded_at": datetime.utcnow().isoformat() + "Z",
+            "objects_count": timeline.peak,  # most objects in one sampled frame
+            "labels": list(summary),
+            "detector": (detector or settings.DETECTOR or "auto"),
+            "fps": info.fps,
+            "frames_total": info.frame_count or last_index + 1,
+            "frames_sampled": timeline.samples,
+            "timeline": summary,
+        }
+        await run_in_threadpool(append_history, entry)
+        done = True
+        yield {
+            "message": "analysis_complete",
+            "history_id": hist_id,
+            "original_url": entry["original_url"],
+            "frames_total": entry["frames_total"],
+            "frames_sampled": timeline.samples,
+            "objects_count": timeline.peak,
+            "labels": entry["labels"],
+            "timeline": summary,
+        }
+    finally:
+        stop.set()
+        for _, _, fut in pending:
+            fut.cancel()
+        if not done:
+            # failed or abandoned: nothing in history points at the stored video
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            release_pending([filename])
+            remove_thumbnails(filename)
@@ -1,11 +1,32 @@
-from .storage import save_to_disk
-from .visualize import draw_bboxes
-from .history import append_history, list_history, get_history_by_id
-
-__all__ = [
-    "save_to_disk",
-    "draw_bboxes",
-    "append_history",
-    "list_history",
-    "get_history_by_id",
-]
+import importlib
+
+# resolved on first use so that `import app.utils.history` doesn't pull in cv2 and friends
+_EXPORTS = {
+    "save_to_disk": "storage",
+    "save_bytes": "storage",
+    "ingest_upload": "storage",
+    "UploadRejected": "storage",
+    "ImageContext": "image",
+    "load_image": "image",
+    "draw_bboxes": "visualize",
+    "append_history": "history",
+    "append_history_many": "history",
+    "list_history": "history",
+    "list_history_page": "history",
+    "get_history_by_id": "history",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,121 @@
+from typing import Optional, Tuple
+import numpy as np
+
+# boxes are (N, 4) arrays of x1, y1, x2, y2
+
+
+def box_area(boxes: np.ndarray) -> np.ndarray:
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def pairwise_intersection(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    return np.clip(w, 0, None) * np.clip(h, 0, None)
+
+
+def pairwise_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    inter = pairwise_intersection(a, b)
+    union = box_area(a)[:, None] + box_area(b)[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def nms(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    iou_threshold: float = 0.5,
+    max_out: Optional[int] = None,
+    classes: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Greedy NMS; returns kept indices, best score first. `classes` makes it per-class."""
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    boxes = boxes.astype(np.float32, copy=False)
+    if classes is not None:
+        # shift each class into its own coordinate range so boxes of different classes never overlap
+        boxes = boxes + (classes.astype(np.float32) * (boxes.max() + 1))[:, None]
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = box_area(boxes)
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        if max_out is not None and len(keep) >= max_out:
+            break
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def contained(boxes: np.ndarray) -> np.ndarray:
+    """Mask of boxes lying inside another box; of identical boxes, all but the first."""
+    n = len(boxes)
+    if n < 2:
+        return np.zeros(n, dtype=bool)
+    inside = ((boxes[:, None, 0] >= boxes[None, :, 0]) & (boxes[:, None, 1] >= boxes[None, :, 1])
+              & (boxes[:, None, 2] <= boxes[None, :, 2]) & (boxes[:, None, 3] <= boxes[None, :, 3]))
+    np.fill_diagonal(inside, False)
+    idx = np.arange(n)
+    inside &= ~inside.T | (idx[None, :] < idx[:, None])
+    return inside.any(axis=1)
+
+
+def _components(i: np.ndarray, j: np.ndarray, n: int) -> np.ndarray:
+    # union-find over the edges (i, j), vectorized: hook each root under the smallest root it
+    # shares an edge with, then compress paths; a few rounds, each linear in the edges
+    parent = np.arange(n)
+    while True:
+        pi, pj = parent[i], parent[j]
+        lo, hi = np.minimum(pi, pj), np.maximum(pi, pj)
+        moved = lo != hi
+        if not moved.any():
+            return parent
+        np.minimum.at(parent, hi[moved], lo[moved])
+        while True:
+            nxt = parent[parent]
+            if np.array_equal(nxt, parent):
+                break
+            parent = nxt
+
+
+def _merge_once(boxes: np.ndarray, scores: np.ndarray, min_overlap: float) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(boxes)
+    areas = box_area(boxes)
+    inter = pairwise_intersection(boxes, boxes)
+    linked = inter > min_overlap * np.minimum(areas[:, None], areas[None, :])
+    i, j = np.nonzero(np.triu(linked, 1))
+    groups, inverse = np.unique(_components(i, j, n), return_inverse=True)
+    out = np.empty((len(groups), 4), dtype=np.float64)
+    out[:, :2] = np.inf
+    out[:, 2:] = -np.inf
+    for k in (0, 1):
+        np.minimum.at(out[:, k], inverse, boxes[:, k])
+    for k in (2, 3):
+        np.maximum.at(out[:, k], inverse, boxes[:, k])
+    best = np.full(len(groups), -np.inf, dtype=np.float64)
+    np.maximum.at(best, inverse, scores)
+    return out.astype(boxes.dtype), best.astype(scores.dtype)
+
+
+def merge_overlapping(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    min_overlap: float = 0.0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Replace each group of overlapping boxes by their union box and best score.
+
+    Two boxes are linked when their intersection covers more than `min_overlap` of the
+    smaller one; groups are the connected components of that graph. Repeats until no
+    union box overlaps another.
+    """
+    while len(boxes) > 1:
+        merged, merged_scores = _merge_once(boxes, scores, min_overlap)
+        if len(merged) == len(boxes):
+            break
+        boxes, scores = merged, merged_scores
+    return boxes, scores
@@ -0,0 +1,37 @@
+import json
+from typing import Any
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback, slower on large arrays
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+def _plain(obj: Any) -> Any:
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"not serializable: {type(obj).__name__}")
+
+
+def dumps_json(obj: Any) -> bytes:
+    """JSON bytes; NumPy arrays are written directly when orjson is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_plain, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_plain, separators=(",", ":")).encode()
+
+
+def dumps_msgpack(obj: Any) -> bytes:
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    # float32 on the wire: scores and histograms don't carry more precision than that
+    return msgpack.packb(obj, default=_plain, use_bin_type=True, use_single_float=True)
@@ -1,7 +1,18 @@
-import os, json
-from typing import List, Optional, Dict, Any, Tuple
+import os, json, time, base64, bisect, shutil, threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter
+from typing import List, Optional, Dict, Any, Iterator, Set, Tuple
+from app.core.timing import timed
+from app.utils.storage import FileLock, release_pending
 from app.core.config import settings
 
+HistoryPage = Tuple[List[Dict[str, Any]], Optional[str]]
+
+
+class StaleCursor(ValueError):
+    """A page cursor whose position no longer exists; start again from the first page."""
+
 def _history_path() -> str:
     return os.path.join(settings.UPLOAD_DIR, "history.jsonl")
 
@@ -28,98 +39,427 @@ def _paths_from_entry(entry: Dict[str, Any]) -> Tuple[Optional[str], Optional[st
 
     return (orig_from_filename, ann_path)
 
-def append_history(entry: Dict[str, Any]) -> None:
+def _remove_entry_files(entry: Dict[str, Any], index: bool = True) -> None:
+    orig_p, ann_p = _paths_from_entry(entry)
+    _safe_unlink(orig_p or "")
+    _safe_unlink(ann_p or "")
+    if entry.get("filename"):
+        from app.utils.thumbnails import remove_thumbnails
+        remove_thumbnails(entry["filename"])
+    rid = entry.get("result_id")
+    if rid:
+        # lazily rendered entries: detections sidecar plus any cached variants
+        from app.services.render import detections_path, render_dir, render_cache
+        _safe_unlink(detections_path(rid))
+        render_cache.forget(rid)
+        rdir = render_dir(rid)
+        if _is_under_uploads(rdir):
+            shutil.rmtree(rdir, ignore_errors=True)
+        if index:
+            _remove_from_index([rid])
+
+def _remove_from_index(rids: List[str]) -> None:
+    from app.services.similarity import get_index
     try:
-        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        with open(_history_path(), "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        get_index().remove_many(rids)
     except Exception as e:
-        print(f"[history] warning: {e}")
+        print(f"[history] index warn: {len(rids)} results -> {e}")
 
-def list_history(limit: int = 20) -> List[Dict[str, Any]]:
-    p = _history_path()
-    if not os.path.exists(p):
-        return []
-    with open(p, "r", encoding="utf-8") as f:
-        lines = [l for l in f if l.strip()]
-    items = [json.loads(l) for l in lines][-limit:]
-    return list(reversed(items))
 
-def get_history_by_id(hid: str) -> Optional[Dict[str, Any]]:
-    p = _history_path()
-    if not os.path.exists(p):
-        return None
-    with open(p, "r", encoding="utf-8") as f:
-        for l in reversed(list(f)):
-            if not l.strip():
+class HistoryBackend(ABC):
+    def append(self, entry: Dict[str, Any]) -> None:
+        self.append_many([entry])
+
+    @abstractmethod
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def list(self, limit: int = 20, cursor: Optional[str] = None, label: Optional[str] = None) -> HistoryPage:
+        ...
+
+    @abstractmethod
+    def get(self, hid: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def delete(self, hid: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    def delete_many(self, hids: List[str]) -> List[Dict[str, Any]]:
+        return [obj for obj in (self.delete(h) for h in dict.fromkeys(hids)) if obj is not None]
+
+    @abstractmethod
+    def iter_all(self) -> Iterator[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def clear(self) -> int:
+        ...
+
+    @abstractmethod
+    def filename_refs(self, filename: str) -> int:
+        # live entries pointing at this stored file (cache hits share files)
+        ...
+
+
+class JsonlHistory(HistoryBackend):
+    """Append-only history.jsonl with an in-memory offset index.
+
+    Deletes append a tombstone line instead of rewriting the file; the log is
+    compacted in the background once enough of it is dead.
+    """
+
+    def __init__(self, path: str, compact_ratio: float = 0.3, compact_min_dead: int = 1000) -> None:
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.compact_min_dead = compact_min_dead
+        self._flock = FileLock(path + ".lock")
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._reset()
+
+    def _reset(self) -> None:
+        self._index: Dict[str, int] = {}   # live id -> byte offset
+        self._tail = array("q")            # offsets of every entry line, file order
+        self._dead: Set[int] = set()       # tombstoned offsets still in the file
+        self._refs: Counter = Counter()    # filename -> live entries using it
+        self._end = 0
+        self._ino: Optional[int] = None
+
+    @staticmethod
+    def _encode(obj: Dict[str, Any]) -> bytes:
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _scan(self, f, start: int) -> None:
+        f.seek(start)
+        pos = start
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # a writer is mid-append; pick it up next time
+            off, pos = pos, pos + len(line)
+            self._end = pos
+            if not line.strip():
                 continue
             try:
-                obj = json.loads(l)
+                obj = json.loads(line)
             except Exception:
                 continue
-            if obj.get("id") == hid:
-                return obj
-    return None
+            dead_id = obj.get("_deleted")
+            if dead_id is not None:
+                old = self._index.pop(dead_id, None)
+                if old is not None:
+                    self._dead.add(old)
+                    if obj.get("filename"):
+                        self._refs[obj["filename"]] -= 1
+                continue
+            hid = obj.get("id")
+            if hid is None:
+                continue
+            old = self._index.get(hid)
+            if old is not None:
+                self._dead.add(old)
+            elif obj.get("filename"):
+                self._refs[obj["filename"]] += 1
+            self._index[hid] = off
+            self._tail.append(off)
 
-def delete_history_item(hid: str) -> Optional[Dict[str, Any]]:
-    p = _history_path()
-    if not os.path.exists(p):
-        return None
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._ino is not None or self._end:
+                self._reset()
+            return
+        if st.st_ino != self._ino or st.st_size < self._end:
+            self._reset()  # first load, or compacted/cleared by another process
+        if st.st_size > self._end or self._ino is None:
+            with open(self.path, "rb") as f:
+                self._scan(f, self._end)
+            self._ino = st.st_ino
+
+    # cursor: the file generation (inode), the offset of the page's last entry and its id.
+    # Offsets only hold within one generation; after a compaction the entry is found by id.
+    def _encode_cursor(self, off: int, hid: str) -> str:
+        return base64.urlsafe_b64encode(f"{self._ino}|{off}|{hid}".encode()).decode().rstrip("=")
 
-    deleted: Optional[Dict[str, Any]] = None
-    with open(p, "r", encoding="utf-8") as f:
-        lines = [l for l in f if l.strip()]
-    items = []
-    for l in lines:
+    def _resume(self, cursor: str) -> int:
         try:
-            obj = json.loads(l)
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            ino, off, hid = raw.split("|", 2)
+            ino, off = int(ino), int(off)
         except Exception:
-            continue
-        if obj.get("id") == hid and deleted is None:
-            deleted = obj
-            orig_p, ann_p = _paths_from_entry(obj)
-            _safe_unlink(orig_p or "")
-            _safe_unlink(ann_p or "")
-            continue
-        items.append(obj)
+            return len(self._tail)  # not one of ours: first page, as the sqlite backend does
+        if ino != self._ino:
+            off = self._index.get(hid)
+            if off is None:
+                raise StaleCursor("history was compacted and the cursor's entry deleted")
+        return bisect.bisect_left(self._tail, off)
 
-    if deleted is None:
-        return None
+    def _read_at(self, f, off: int) -> Optional[Dict[str, Any]]:
+        f.seek(off)
+        try:
+            return json.loads(f.readline())
+        except Exception:
+            return None
 
-    try:
-        with open(p, "w", encoding="utf-8") as f:
-            for obj in items:
-                f.write(json.dumps(obj, ensure_ascii=False) + "\n")
-    except Exception as e:
-        print(f"[history] rewrite warn: {e}")
+    def _append_bytes(self, payload: bytes) -> None:
+        with self._flock:
+            with open(self.path, "ab") as f:
+                f.write(payload)
+        self._refresh()
 
-    return deleted
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        with self._lock:
+            self._append_bytes(b"".join(self._encode(e) for e in entries))
 
-def clear_history() -> int:
-    p = _history_path()
-    if not os.path.exists(p):
-        return 0
+    def list(self, limit: int = 20, cursor: Optional[str] = None, label: Optional[str] = None) -> HistoryPage:
+        with self._lock:
+            self._refresh()
+            if not self._tail:
+                return [], None
+            i = self._resume(cursor) if cursor else len(self._tail)
+            items: List[Dict[str, Any]] = []
+            offs: List[int] = []
+            with open(self.path, "rb") as f:
+                while i > 0 and len(items) <= limit:
+                    i -= 1
+                    off = self._tail[i]
+                    if off in self._dead:
+                        continue
+                    obj = self._read_at(f, off)
+                    if obj is None or (label and label not in (obj.get("labels") or [])):
+                        continue
+                    items.append(obj)
+                    offs.append(off)
+            nxt = self._encode_cursor(offs[limit - 1], items[limit - 1]["id"]) if len(items) > limit else None
+            return items[:limit], nxt
 
-    count = 0
-    try:
-        with open(p, "r", encoding="utf-8") as f:
-            for l in f:
-                if not l.strip():
-                    continue
+    def get(self, hid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            off = self._index.get(hid)
+            if off is None:
+                return None
+            with open(self.path, "rb") as f:
+                return self._read_at(f, off)
+
+    def delete(self, hid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            obj = self.get(hid)
+            if obj is None:
+                return None
+            self._append_bytes(self._encode({"_deleted": hid, "filename": obj.get("filename")}))
+            self._maybe_compact()
+            return obj
+
+    def delete_many(self, hids: List[str]) -> List[Dict[str, Any]]:
+        # one tombstone write for the whole batch
+        with self._lock:
+            objs = [obj for obj in (self.get(h) for h in dict.fromkeys(hids)) if obj is not None]
+            if objs:
+                self._append_bytes(b"".join(
+                    self._encode({"_deleted": o["id"], "filename": o.get("filename")}) for o in objs
+                ))
+                self._maybe_compact()
+            return objs
+
+    def iter_all(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            offs = [o for o in self._tail if o not in self._dead]
+            if not offs:
+                return
+            # the open handle keeps pointing at this generation even if it gets compacted
+            f = open(self.path, "rb")
+        with f:
+            for off in offs:
+                obj = self._read_at(f, off)
+                if obj is not None:
+                    yield obj
+
+    def clear(self) -> int:
+        with self._lock:
+            with self._flock:
+                self._refresh()
+                n = len(self._index)
                 try:
-                    obj = json.loads(l)
-                except Exception:
-                    continue
-                orig_p, ann_p = _paths_from_entry(obj)
-                _safe_unlink(orig_p or "")
-                _safe_unlink(ann_p or "")
-                count += 1
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                except Exception as e:
+                    print(f"[history] remove history.jsonl warn: {e}")
+                self._reset()
+            return n
+
+    def filename_refs(self, filename: str) -> int:
+        with self._lock:
+            self._refresh()
+            return max(0, self._refs.get(filename, 0))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            return {"live": len(self._index), "dead": len(self._dead), "bytes": self._end}
+
+    def _maybe_compact(self) -> None:
+        dead = len(self._dead)
+        if self._compacting or dead < self.compact_min_dead:
+            return
+        if dead < self.compact_ratio * len(self._tail):
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name="history-compact", daemon=True).start()
+
+    def compact(self) -> None:
+        tmp = self.path + ".compact"
+        try:
+            # copy the live lines without blocking readers or writers...
+            with self._lock:
+                self._refresh()
+                live = [o for o in self._tail if o not in self._dead]
+                end, ino = self._end, self._ino
+                src = open(self.path, "rb")
+            with src, open(tmp, "wb") as dst:
+                for off in live:
+                    src.seek(off)
+                    dst.write(src.readline())
+                # ...then carry over whatever was appended meanwhile (entries and
+                # tombstones alike) and swap the files while holding the locks
+                with self._lock, self._flock:
+                    if os.stat(self.path).st_ino != ino:
+                        return  # cleared or compacted elsewhere
+                    src.seek(end)
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                    os.replace(tmp, self.path)
+                    self._reset()
+                    self._refresh()
+        except Exception as e:
+            print(f"[history] compact warn: {e}")
+        finally:
+            self._compacting = False
+            try:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            except OSError:
+                pass
+
+
+_backend: Optional[HistoryBackend] = None
+_backend_key: Optional[Tuple[str, str]] = None
+_backend_lock = threading.Lock()
+
+def get_history_backend() -> HistoryBackend:
+    global _backend, _backend_key
+    kind = (settings.HISTORY_BACKEND or "jsonl").lower()
+    if kind == "sqlite":
+        key = (kind, settings.HISTORY_DB_PATH or os.path.join(settings.UPLOAD_DIR, "history.db"))
+    else:
+        key = (kind, _history_path())
+    with _backend_lock:
+        if _backend is None or _backend_key != key:
+            if kind == "sqlite":
+                from app.utils.history_sqlite import SqliteHistory, import_jsonl
+                _backend = SqliteHistory(key[1])
+                if settings.HISTORY_AUTO_IMPORT and _backend.count() == 0 and os.path.exists(_history_path()):
+                    n = import_jsonl(_history_path(), key[1])
+                    print(f"[history] imported {n} entries from history.jsonl")
+            else:
+                _backend = JsonlHistory(
+                    key[1],
+                    compact_ratio=settings.HISTORY_COMPACT_RATIO,
+                    compact_min_dead=settings.HISTORY_COMPACT_MIN_DEAD,
+                )
+            _backend_key = key
+        return _backend
+
+def warm_history_index() -> None:
+    try:
+        get_history_backend().list(limit=1)
     except Exception as e:
-        print(f"[history] clear warn: {e}")
+        print(f"[history] index warn: {e}")
 
+@timed("history")
+def append_history(entry: Dict[str, Any]) -> None:
     try:
-        os.remove(p)
+        get_history_backend().append(entry)
     except Exception as e:
-        print(f"[history] remove history.jsonl warn: {e}")
+        print(f"[history] warning: {e}")
+    release_pending([entry.get("filename") or ""])
 
-    return count
+@timed("history")
+def append_history_many(entries: List[Dict[str, Any]]) -> None:
+    if not entries:
+        return
+    try:
+        get_history_backend().append_many(entries)
+    except Exception as e:
+        print(f"[history] warning: {e}")
+    release_pending(e.get("filename") or "" for e in entries)
+
+@timed("history")
+def list_history_page(limit: int = 20, cursor: Optional[str] = None, label: Optional[str] = None) -> HistoryPage:
+    return get_history_backend().list(limit=limit, cursor=cursor, label=label)
+
+def list_history(limit: int = 20) -> List[Dict[str, Any]]:
+    return list_history_page(limit=limit)[0]
+
+@timed("history")
+def get_history_by_id(hid: str) -> Optional[Dict[str, Any]]:
+    return get_history_backend().get(hid)
+
+@timed("history")
+def delete_history_item(hid: str) -> Optional[Dict[str, Any]]:
+    backend = get_history_backend()
+    deleted = backend.delete(hid)
+    if deleted is None:
+        return None
+    if deleted.get("filename") and backend.filename_refs(deleted["filename"]) > 0:
+        return deleted  # files still used by another entry
+    _remove_entry_files(deleted)
+    _forget_cached([deleted.get("filename") or ""])
+    return deleted
+
+def _forget_cached(filenames) -> None:
+    # results replayed from the cache would point new entries at the removed files
+    from app.services.result_cache import result_cache
+    result_cache.discard_files(filenames)
+
+@timed("history")
+def delete_history_items(hids: List[str]) -> List[Dict[str, Any]]:
+    backend = get_history_backend()
+    deleted = backend.delete_many(hids)
+    done: Set[str] = set()
+    rids: List[str] = []
+    for entry in deleted:
+        fn = entry.get("filename")
+        if fn and (fn in done or backend.filename_refs(fn) > 0):
+            continue  # files still used by another entry
+        if fn:
+            done.add(fn)
+        _remove_entry_files(entry, index=False)
+        if entry.get("result_id"):
+            rids.append(entry["result_id"])
+    if rids:
+        _remove_from_index(rids)
+    _forget_cached(done)
+    return deleted
+
+@timed("history")
+def clear_history() -> int:
+    # entries go now; their files become orphans that a background purge removes in batches
+    from app.services.similarity import get_index
+    from app.services.retention import sweeper
+    from app.services.result_cache import result_cache
+    from app.services.render import render_cache
+    cutoff = time.time()
+    get_index().clear()
+    n = get_history_backend().clear()
+    # nothing may replay or serve what the purge is about to delete
+    result_cache.clear()
+    render_cache.clear()
+    sweeper.purge_async(before=cutoff)
+    return n
@@ -0,0 +1,190 @@
+import os, sys, json, base64, sqlite3, threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from app.utils.history import HistoryBackend, HistoryPage, _history_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    id          TEXT NOT NULL UNIQUE,
+    uploaded_at TEXT NOT NULL,
+    filename    TEXT,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_history_uploaded ON history(uploaded_at, seq);
+CREATE INDEX IF NOT EXISTS ix_history_filename ON history(filename);
+CREATE TABLE IF NOT EXISTS history_labels (
+    label       TEXT NOT NULL,
+    uploaded_at TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    PRIMARY KEY (label, uploaded_at, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_history_labels_seq ON history_labels(seq);
+"""
+
+def _encode_cursor(uploaded_at: str, seq: int) -> str:
+    return base64.urlsafe_b64encode(f"{uploaded_at}|{seq}".encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, seq = raw.rsplit("|", 1)
+        return ts, int(seq)
+    except Exception:
+        return None
+
+
+class SqliteHistory(HistoryBackend):
+    """History in SQLite: indexed by id, uploaded_at and label, keyset-paginated."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _rows(entries: List[Dict[str, Any]]):
+        for e in entries:
+            yield (e["id"], e.get("uploaded_at") or "", e.get("filename"), json.dumps(e, ensure_ascii=False)), e
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        conn = self._conn()
+        with conn:
+            for row, e in self._rows(entries):
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO history(id, uploaded_at, filename, data) VALUES (?, ?, ?, ?)", row
+                )
+                if cur.rowcount:
+                    seq = cur.lastrowid
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO history_labels(label, uploaded_at, seq) VALUES (?, ?, ?)",
+                        [(lb, row[1], seq) for lb in set(e.get("labels") or [])],
+                    )
+
+    def list(self, limit: int = 20, cursor: Optional[str] = None, label: Optional[str] = None) -> HistoryPage:
+        after = _decode_cursor(cursor) if cursor else None
+        where, args = [], []
+        if label:
+            sql = (
+                "SELECT h.seq, h.uploaded_at, h.data FROM history_labels l "
+                "JOIN history h ON h.seq = l.seq WHERE l.label = ?"
+            )
+            args.append(label)
+            if after:
+                where.append("(l.uploaded_at, l.seq) < (?, ?)")
+                args.extend(after)
+            order = " ORDER BY l.uploaded_at DESC, l.seq DESC"
+        else:
+            sql = "SELECT seq, uploaded_at, data FROM history"
+            if after:
+                where.append("(uploaded_at, seq) < (?, ?)")
+                args.extend(after)
+            order = " ORDER BY uploaded_at DESC, seq DESC"
+        if where:
+            sql += (" AND " if label else " WHERE ") + " AND ".join(where)
+        sql += order + " LIMIT ?"
+        args.append(limit + 1)
+        rows = self._conn().execute(sql, args).fetchall()
+        items = [json.loads(r[2]) for r in rows[:limit]]
+        nxt = _encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+        return items, nxt
+
+    def get(self, hid: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data FROM history WHERE id = ?", (hid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, hid: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT seq, data FROM history WHERE id = ?", (hid,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM history_labels WHERE seq = ?", (row[0],))
+            conn.execute("DELETE FROM history WHERE seq = ?", (row[0],))
+        return json.loads(row[1])
+
+    def delete_many(self, hids: List[str]) -> List[Dict[str, Any]]:
+        conn = self._conn()
+        out: List[Dict[str, Any]] = []
+        with conn:
+            for hid in dict.fromkeys(hids):
+                row = conn.execute("SELECT seq, data FROM history WHERE id = ?", (hid,)).fetchone()
+                if row is None:
+                    continue
+                conn.execute("DELETE FROM history_labels WHERE seq = ?", (row[0],))
+                conn.execute("DELETE FROM history WHERE seq = ?", (row[0],))
+                out.append(json.loads(row[1]))
+        return out
+
+    def iter_all(self) -> Iterator[Dict[str, Any]]:
+        last = 0
+        while True:
+            rows = self._conn().execute(
+                "SELECT seq, data FROM history WHERE seq > ? ORDER BY seq LIMIT 1000", (last,)
+            ).fetchall()
+            if not rows:
+                return
+            for seq, data in rows:
+                yield json.loads(data)
+            last = rows[-1][0]
+
+    def clear(self) -> int:
+        conn = self._conn()
+        with conn:
+            n = conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+            conn.execute("DELETE FROM history_labels")
+            conn.execute("DELETE FROM history")
+        return int(n)
+
+    def filename_refs(self, filename: str) -> int:
+        row = self._conn().execute("SELECT COUNT(*) FROM history WHERE filename = ?", (filename,)).fetchone()
+        return int(row[0])
+
+    def count(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM history").fetchone()[0])
+
+
+def import_jsonl(jsonl_path: Optional[str] = None, db_path: Optional[str] = None, chunk: int = 5000) -> int:
+    from app.core.config import settings
+    jsonl_path = jsonl_path or _history_path()
+    db_path = db_path or settings.HISTORY_DB_PATH or os.path.join(settings.UPLOAD_DIR, "history.db")
+    if not os.path.exists(jsonl_path):
+        return 0
+    store = SqliteHistory(db_path)
+    before = store.count()
+    buf: List[Dict[str, Any]] = []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for l in f:
+            if not l.strip():
+                continue
+            try:
+                obj = json.loads(l)
+            except Exception:
+                continue
+            if not obj.get("id"):
+                continue
+            buf.append(obj)
+            if len(buf) >= chunk:
+                store.append_many(buf)
+                buf = []
+    store.append_many(buf)
+    return store.count() - before
+
+
+if __name__ == "__main__":
+    # python -m app.utils.history_sqlite [history.jsonl] [history.db]
+    args = sys.argv[1:]
+    n = import_jsonl(args[0] if args else None, args[1] if len(args) > 1 else None)
+    print(f"[history] imported {n} entries")
@@ -0,0 +1,97 @@
+import os, struct
+from typing import Optional, Union
+import numpy as np
+
+
+class ImageContext:
+    """A decoded BGR image shared by every stage of one analysis request."""
+
+    __slots__ = ("image", "path", "_gray")
+
+    def __init__(self, image: np.ndarray, path: Optional[str] = None) -> None:
+        self.image = image
+        self.path = path
+        self._gray: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_bytes(cls, data: Union[bytes, bytearray, memoryview], path: Optional[str] = None) -> "ImageContext":
+        import cv2
+        buf = np.frombuffer(data, dtype=np.uint8)
+        img = cv2.imdecode(buf, cv2.IMREAD_COLOR) if buf.size else None
+        if img is None:
+            raise ValueError("could not decode image")
+        return cls(img, path=path)
+
+    @classmethod
+    def from_path(cls, path: str) -> "ImageContext":
+        import cv2
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"could not decode image: {path}")
+        return cls(img, path=path)
+
+    @property
+    def height(self) -> int:
+        return int(self.image.shape[0])
+
+    @property
+    def width(self) -> int:
+        return int(self.image.shape[1])
+
+    @property
+    def gray(self) -> np.ndarray:
+        import cv2
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+
+ImageSource = Union[str, np.ndarray, ImageContext]
+
+
+def load_image(source: ImageSource) -> Optional[ImageContext]:
+    if isinstance(source, ImageContext):
+        return source
+    if isinstance(source, np.ndarray):
+        return ImageContext(source)
+    try:
+        return ImageContext.from_path(source)
+    except ValueError:
+        return None
+
+
+def bmp_view(buf: Union[bytes, bytearray, memoryview, np.ndarray]) -> Optional[np.ndarray]:
+    """Zero-copy (H, W, 3) BGR view of an uncompressed 24/32-bit BMP; None for anything else."""
+    raw = np.frombuffer(buf, dtype=np.uint8) if not isinstance(buf, np.ndarray) else buf
+    head = raw[:54].tobytes()
+    if len(head) < 54 or head[:2] != b"BM":
+        return None
+    offset = struct.unpack("<I", head[10:14])[0]
+    width, height = struct.unpack("<ii", head[18:26])
+    bpp, compression = struct.unpack("<HI", head[28:34])
+    if bpp not in (24, 32) or compression not in (0, 3) or width <= 0 or height == 0:
+        return None
+    if compression == 3 and bpp != 32:
+        return None
+    stride = ((width * bpp + 31) // 32) * 4
+    rows = abs(height)
+    if offset + stride * rows > raw.size:
+        return None
+    view = np.ndarray(
+        shape=(rows, width, 3), dtype=np.uint8, buffer=raw, offset=offset, strides=(stride, bpp // 8, 1),
+    )
+    # positive height means rows are stored bottom-up
+    return view[::-1] if height > 0 else view
+
+
+def open_mapped(path: str) -> Optional[np.ndarray]:
+    """Memory-map an image file when its pixels can be read in place (.npy, uncompressed BMP)."""
+    try:
+        if path.lower().endswith(".npy"):
+            arr = np.load(path, mmap_mode="r")
+            return arr if arr.dtype == np.uint8 and arr.ndim == 3 and arr.shape[2] == 3 else None
+        if os.path.getsize(path) < 54:
+            return None
+        return bmp_view(np.memmap(path, dtype=np.uint8, mode="r"))
+    except (OSError, ValueError):
+        return None
@@ -1,5 +1,145 @@
-import os, shutil
+import io, os, re, shutil, struct, hashlib, time
+from typing import Any, BinaryIO, Iterable, Optional, Tuple, Union
+from uuid import uuid4
 from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process installs only
+    fcntl = None
+
+CHUNK_SIZE = 1 << 20
+HEADER_BYTES = 128 * 1024  # enough to get past EXIF to a JPEG SOF marker in practice
+
+ImageInfo = Tuple[str, Optional[int], Optional[int]]  # (format, width, height)
+CONTENT_DIR = "files"  # sharded uploads: files/ab/cd/<uuid>_<name>
+PENDING_DIR = ".pending"  # one marker per upload not yet in history; the sweeper leaves those alone
+_UPLOAD_KEY = re.compile(r"^(?:smoke_|min_)?([0-9a-f]{32})_")
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class FileLock:
+    # advisory lock on a sidecar file so several uvicorn workers can append safely
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+
+def content_name(original_name: Optional[str], prefix: str = "") -> str:
+    """Relative path for a new upload, spread over STORAGE_SHARD_DEPTH levels of 256 directories
+    by its random id so no directory grows past a few thousand files. 0 keeps the old flat layout."""
+    key = uuid4().hex
+    name = f"{prefix}{key}_{os.path.basename(original_name or '') or 'upload'}"
+    depth = max(0, min(4, settings.STORAGE_SHARD_DEPTH))
+    if not depth:
+        return name
+    return "/".join([CONTENT_DIR] + [key[2 * i:2 * i + 2] for i in range(depth)] + [name])
+
+def upload_key(filename: str) -> Optional[str]:
+    m = _UPLOAD_KEY.match(os.path.basename(filename or ""))
+    return m.group(1) if m else None
+
+def reserve_name(original_name: Optional[str]) -> str:
+    """content_name for an upload whose history entry is written later (after analysis, a queued
+    job, a video stream). Marked pending until append_history_many releases it."""
+    filename = content_name(original_name)
+    root = os.path.join(settings.UPLOAD_DIR, PENDING_DIR)
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, upload_key(filename)), "wb"):
+        pass
+    return filename
+
+def release_pending(filenames: Iterable[str]) -> None:
+    for fn in filenames:
+        key = upload_key(fn)
+        if key:
+            try:
+                os.remove(os.path.join(settings.UPLOAD_DIR, PENDING_DIR, key))
+            except OSError:
+                pass
+
+def annotated_name(filename: str) -> str:
+    # eager annotated copy, relative to UPLOAD_DIR/annotated, mirroring the original's shard
+    head, base = os.path.split(filename)
+    return f"{head}/annotated_{base}" if head else f"annotated_{base}"
+
+def safe_relpath(rel: str) -> bool:
+    # a stored name from a URL: relative, no "..", no backslashes
+    if not rel or rel.startswith("/") or "\\" in rel:
+        return False
+    return all(part not in ("", ".", "..") for part in rel.split("/"))
+
+def touch(path: str, min_age: float = 3600.0) -> None:
+    # bump atime for LRU eviction, at most once per `min_age` (relatime/noatime mounts don't)
+    try:
+        st = os.stat(path)
+        now = time.time()
+        if now - st.st_atime > min_age:
+            os.utime(path, (now, st.st_mtime))
+    except OSError:
+        pass
+
+
+def save_bytes(data: bytes, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+async def stream_to_disk(file: UploadFile, path: str, max_bytes: Optional[int] = None) -> int:
+    # chunked copy with a size cap; the partial file is removed on any failure
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadRejected(413, f"Upload exceeds {max_bytes} bytes")
+                await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return size
 
 def save_to_disk(file: UploadFile, path: str) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -9,3 +149,170 @@ def save_to_disk(file: UploadFile, path: str) -> None:
         pass
     with open(path, "wb") as f:
         shutil.copyfileobj(file.file, f)
+
+
+def _jpeg_size(b: bytes) -> Tuple[Optional[int], Optional[int]]:
+    i = 2
+    while i + 9 < len(b):
+        if b[i] != 0xFF:
+            i += 1
+            continue
+        marker = b[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            i += 1 if marker == 0xFF else 2
+            continue
+        seg_len = struct.unpack(">H", b[i + 2:i + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h, w = struct.unpack(">HH", b[i + 5:i + 9])
+            return w, h
+        i += 2 + seg_len
+    return None, None
+
+def _tiff_size(f: BinaryIO) -> Tuple[Optional[int], Optional[int]]:
+    # seeks instead of slicing: libtiff writes the first IFD after the pixel data
+    f.seek(0)
+    head = f.read(8)
+    end = "<" if head[:2] == b"II" else ">"
+    try:
+        f.seek(struct.unpack(end + "I", head[4:8])[0])
+        n = struct.unpack(end + "H", f.read(2))[0]
+        entries = f.read(12 * n)
+        dims = {}
+        for k in range(n):
+            e = 12 * k
+            tag, typ = struct.unpack(end + "HH", entries[e:e + 4])
+            if tag in (256, 257):
+                fmt = "H" if typ == 3 else "I"
+                dims[tag] = struct.unpack(end + fmt, entries[e + 8:e + 8 + struct.calcsize(fmt)])[0]
+        return dims.get(256), dims.get(257)
+    except (struct.error, ValueError, OSError):
+        return None, None
+
+def sniff_image(header: bytes) -> Optional[ImageInfo]:
+    b = header
+    if b.startswith(b"\x89PNG\r\n\x1a\n") and len(b) >= 24:
+        w, h = struct.unpack(">II", b[16:24])
+        return "png", w, h
+    if b.startswith(b"\xff\xd8\xff"):
+        return ("jpeg",) + _jpeg_size(b)
+    if b[:6] in (b"GIF87a", b"GIF89a") and len(b) >= 10:
+        w, h = struct.unpack("<HH", b[6:10])
+        return "gif", w, h
+    if b.startswith(b"BM") and len(b) >= 26:
+        w, h = struct.unpack("<ii", b[18:26])
+        return "bmp", abs(w), abs(h)
+    if b[:4] == b"RIFF" and b[8:12] == b"WEBP" and len(b) >= 30:
+        kind = b[12:16]
+        if kind == b"VP8 ":
+            w, h = struct.unpack("<HH", b[26:30])
+            return "webp", w & 0x3FFF, h & 0x3FFF
+        if kind == b"VP8L":
+            bits = struct.unpack("<I", b[21:25])[0]
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if kind == b"VP8X":
+            w = int.from_bytes(b[24:27], "little") + 1
+            h = int.from_bytes(b[27:30], "little") + 1
+            return "webp", w, h
+        return "webp", None, None
+    if b[:4] in (b"II*\x00", b"MM\x00*"):
+        return ("tiff",) + _tiff_size(io.BytesIO(b))
+    return None
+
+def check_image_header(
+    header: bytes, max_pixels: Optional[int] = None, source: Union[str, bytes, None] = None,
+) -> ImageInfo:
+    # `source` (a path or the whole upload) is where to look for TIFF dimensions the header didn't reach
+    info = sniff_image(header)
+    if info is None:
+        raise UploadRejected(415, "Unsupported image format")
+    fmt, w, h = info
+    if (w is None or h is None) and fmt == "tiff" and source is not None:
+        with (open(source, "rb") if isinstance(source, str) else io.BytesIO(source)) as f:
+            w, h = _tiff_size(f)
+        info = (fmt, w, h)
+    limit = settings.MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    if w is None or h is None:
+        if limit:
+            # the pixel cap can't be checked without decoding, which is what it guards against
+            raise UploadRejected(415, "Could not read image dimensions from the header")
+        return info
+    if w <= 0 or h <= 0:
+        raise UploadRejected(400, "Invalid image dimensions")
+    if limit and w * h > limit:
+        raise UploadRejected(413, f"Image too large: {w}x{h} exceeds {limit} pixels")
+    return info
+
+
+class IngestedUpload:
+    """An upload streamed to a temp file; `commit` moves it into place, `discard` drops it."""
+
+    __slots__ = ("tmp_path", "sha256", "size", "format", "width", "height", "path")
+
+    def __init__(self, tmp_path: str, sha256: str, size: int, info: ImageInfo) -> None:
+        self.tmp_path = tmp_path
+        self.sha256 = sha256
+        self.size = size
+        self.format, self.width, self.height = info
+        self.path: Optional[str] = None
+
+    def commit(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.replace(self.tmp_path, path)
+        self.path = path
+        return path
+
+    def discard(self) -> None:
+        for p in (self.tmp_path, self.path):
+            try:
+                if p and os.path.exists(p):
+                    os.remove(p)
+            except OSError:
+                pass
+        if self.path:
+            release_pending([self.path])
+
+
+async def ingest_upload(
+    file: UploadFile,
+    dest_dir: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+) -> IngestedUpload:
+    dest_dir = dest_dir or settings.UPLOAD_DIR
+    max_bytes = settings.MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = os.path.join(dest_dir, f".{uuid4().hex}.part")
+
+    hasher = hashlib.sha256()
+    size = 0
+    info: Optional[ImageInfo] = None
+    header = b""
+    f = open(tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise UploadRejected(413, f"Upload exceeds {max_bytes} bytes")
+            if info is None:
+                header += chunk
+                if len(header) >= HEADER_BYTES:
+                    info = sniff_image(header)
+                    # a TIFF whose IFD follows the pixel data is checked from the file once it's all here
+                    if info is None or info[0] != "tiff" or None not in info[1:]:
+                        info = check_image_header(header, max_pixels)
+            hasher.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+        f.close()
+        if info is None or None in info[1:]:
+            info = check_image_header(header, max_pixels, source=tmp_path)
+    except BaseException:
+        f.close()
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return IngestedUpload(tmp_path, hasher.hexdigest(), size, info)
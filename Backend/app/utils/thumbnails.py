@@ -0,0 +1,117 @@
+import os, hashlib, tempfile
+from typing import Dict, Optional
+from urllib.parse import quote
+
+import numpy as np
+
+from app.core.config import settings
+from app.utils.storage import sniff_image, safe_relpath, HEADER_BYTES
+from app.utils.image import open_mapped
+
+MEDIA_TYPES = {"webp": "image/webp", "jpg": "image/jpeg"}
+
+
+def thumb_sizes() -> Dict[str, int]:
+    return {"small": settings.THUMB_SMALL, "medium": settings.THUMB_MEDIUM}
+
+def thumb_format() -> str:
+    return "jpg" if settings.THUMB_FORMAT.lower() in ("jpg", "jpeg") else "webp"
+
+def thumb_path(filename: str, size: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, "thumbs", size, f"{filename}.{thumb_format()}")
+
+def thumb_urls(filename: Optional[str]) -> Dict[str, Optional[str]]:
+    if not filename:
+        return {"thumb_small_url": None, "thumb_medium_url": None}
+    return {f"thumb_{s}_url": f"/api/v1/thumbs/{s}/{quote(filename)}" for s in thumb_sizes()}
+
+def annotated_thumb_url(annotated_url: Optional[str]) -> Optional[str]:
+    # gallery image with the boxes drawn: a small render of a lazily annotated result; eager
+    # annotated copies are static files and are used as they are
+    if annotated_url and annotated_url.startswith("/api/v1/annotated/"):
+        return f"{annotated_url}?max_width={settings.THUMB_SMALL}&format={thumb_format()}"
+    return annotated_url
+
+def thumb_etag(filename: str, size: str) -> str:
+    spec = f"{filename}|{size}|{thumb_sizes().get(size)}|{thumb_format()}|{settings.THUMB_QUALITY}"
+    return hashlib.sha1(spec.encode()).hexdigest()[:20]
+
+
+def _fit(img: np.ndarray, side: int) -> np.ndarray:
+    import cv2
+    h, w = img.shape[:2]
+    scale = side / max(h, w)
+    if scale >= 1.0:
+        return img
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+def _write(img: np.ndarray, path: str) -> None:
+    import cv2
+    fmt = thumb_format()
+    flag = cv2.IMWRITE_JPEG_QUALITY if fmt == "jpg" else cv2.IMWRITE_WEBP_QUALITY
+    ok, buf = cv2.imencode(f".{fmt}", img, [flag, int(settings.THUMB_QUALITY)])
+    if not ok:
+        raise ValueError("thumbnail encode failed")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")  # concurrent writers of one thumbnail
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def make_thumbnails(image: np.ndarray, filename: str) -> None:
+    # pyramid: each level is resized from the previous one, largest first
+    for size, side in sorted(thumb_sizes().items(), key=lambda kv: -kv[1]):
+        image = _fit(image, side)
+        _write(image, thumb_path(filename, size))
+
+
+def read_reduced(path: str, side: int) -> Optional[np.ndarray]:
+    # JPEG decodes at 1/2, 1/4 or 1/8 scale in libjpeg, much cheaper than decode-then-resize
+    import cv2
+    try:
+        with open(path, "rb") as f:
+            info = sniff_image(f.read(HEADER_BYTES))
+    except OSError:
+        return None
+    flag = cv2.IMREAD_COLOR
+    if info and info[0] == "jpeg" and info[1] and info[2]:
+        longest = max(info[1], info[2])
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if longest // factor >= side:
+                flag = reduced
+                break
+    return cv2.imread(path, flag)
+
+
+def ensure_thumbnail(filename: str, size: str) -> Optional[str]:
+    sizes = thumb_sizes()
+    if size not in sizes or not safe_relpath(filename):
+        return None
+    path = thumb_path(filename, size)
+    if os.path.exists(path):
+        return path
+    src = os.path.join(settings.UPLOAD_DIR, filename)
+    img = open_mapped(src)
+    if img is None:
+        img = read_reduced(src, max(sizes.values()))
+    if img is None:
+        return None
+    make_thumbnails(img, filename)
+    return path
+
+
+def remove_thumbnails(filename: str) -> None:
+    for size in thumb_sizes():
+        try:
+            os.remove(thumb_path(filename, size))
+        except OSError:
+            pass
@@ -1,17 +1,17 @@
-import os, cv2
+import os, zlib
 from typing import Iterable
+from app.utils.image import ImageSource, load_image
+from app.core.timing import timed
 
 def _color_for_label(label: str) -> tuple[int,int,int]:
-    h = abs(hash(label))
+    h = zlib.crc32(label.encode())  # not hash(): str hashes change with PYTHONHASHSEED across workers
     return (50 + (h % 180), 50 + ((h // 7) % 180), 50 + ((h // 13) % 180))
 
-def draw_bboxes(image_path: str, detections: Iterable, output_path: str) -> None:
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    img = cv2.imread(image_path)
-    if img is None:
-        return
+def annotate(img, detections: Iterable, scale: float = 1.0):
+    # draws in place; `scale` maps original-resolution boxes onto a resized image
+    import cv2
     for det in detections:
-        x1,y1,x2,y2 = map(int, det.bbox)
+        x1,y1,x2,y2 = (int(round(v * scale)) for v in det.bbox)
         color = _color_for_label(det.label)
         cv2.rectangle(img, (x1,y1), (x2,y2), color, 2)
         label = f"{det.label} {det.confidence:.2f}"
@@ -19,4 +19,16 @@ def draw_bboxes(image_path: str, detections: Iterable, output_path: str) -> None
         top = max(0, y1 - th - 6)
         cv2.rectangle(img, (x1, top), (x1+tw+6, top+th+6), color, -1)
         cv2.putText(img, label, (x1+3, top+th+1), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 1, cv2.LINE_AA)
+    return img
+
+@timed("annotate")
+def draw_bboxes(image: ImageSource, detections: Iterable, output_path: str, copy: bool = True) -> None:
+    import cv2
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    ctx = load_image(image)
+    if ctx is None:
+        return
+    # copy=False draws straight onto the shared buffer; only for the last stage
+    img = ctx.image.copy() if copy else ctx.image
+    annotate(img, detections)
     cv2.imwrite(output_path, img)
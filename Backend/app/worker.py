@@ -1,27 +1,42 @@
+import os
 from celery import Celery
-from app.services.inference import run_inference
-from app.services.analytics import compute_statistics
+from celery.signals import worker_process_init
+from app.services.model_registry import warmup_default_model
+from app.services.pipeline import analyze_upload
+from app.services.jobs import run_job_chunk
 from app.core.config import settings
 
 celery = Celery(
     "worker",
-    broker=settings.REDIS_URL,
-    backend=settings.REDIS_URL
+    broker=settings.broker_url or "memory://",
+    backend=settings.result_backend_url or "cache+memory://",
 )
+celery.conf.task_track_started = True
+# let redis honour per-task priorities (0 = most urgent)
+celery.conf.broker_transport_options = {"priority_steps": list(range(10)), "queue_order_strategy": "priority"}
+celery.conf.worker_prefetch_multiplier = 1
 
-@celery.task(name="tasks.analyze_image")
-def analyze_image_task(image_path: str) -> dict:
-
-    detections = run_inference(image_path)
-    objects = []
-    for det in detections:
-        stats = compute_statistics(image_path, det)
-        objects.append({
-            "label": det.label,
-            "confidence": det.confidence,
-            "area": stats["area"],
-            "histogram": stats["histogram"]
-        })
-    return {"objects": objects}
+@worker_process_init.connect
+def _warmup_model(**_):
+    warmup_default_model()
 
+@celery.task(name="tasks.analyze_image")
+def analyze_image_task(image_path: str, conf: float = 0.25, max_dets: int = 100, detector: str = None) -> dict:
+    with open(image_path, "rb") as f:
+        data = f.read()
+    up = os.path.abspath(settings.UPLOAD_DIR)
+    ap = os.path.abspath(image_path)
+    stored = os.path.relpath(ap, up) if ap.startswith(up + os.sep) else None
+    result = analyze_upload(
+        data, os.path.basename(image_path),
+        conf=conf, max_dets=max_dets, detector=detector, filename=stored,
+    )
+    return {
+        "objects": result["detections"].to_objects(),
+        "annotated_url": result["annotated_url"],
+        "history_id": result["history_id"],
+    }
 
+@celery.task(name="tasks.analyze_chunk")
+def analyze_chunk_task(items: list, conf: float = 0.25, max_dets: int = 100, detector: str = None) -> list:
+    return run_job_chunk(items, conf=conf, max_dets=max_dets, detector=detector)
@@ -0,0 +1,176 @@
+"""Cold start and memory per worker: `python -m benchmarks.coldstart --workers 4 --out coldstart.json`.
+
+In fresh processes it measures how long importing app.main takes, then starts the server
+(`python -m app.serve` and/or `uvicorn --workers`) and records the time until /health
+and /ready answer and the first /analyze call. Once the workers are up it records RSS, PSS and
+shared memory per process. PSS splits shared pages between the processes mapping them,
+so it is the number that shows what preforking saves. Linux only: memory comes from /proc.
+"""
+import argparse, json, os, shutil, signal, socket, subprocess, sys, tempfile, time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.stats import summarize
+from benchmarks.synthetic import make_image, encode
+
+HEAVY = ("cv2", "numpy", "torch", "ultralytics", "onnxruntime")
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+
+def import_time(repeat: int, env: Dict[str, str]) -> Dict[str, Any]:
+    code = ("import sys, time; t = time.perf_counter(); import app.main; "
+            "print((time.perf_counter() - t) * 1000); print(','.join(m for m in %r if m in sys.modules))" % (HEAVY,))
+    samples: List[float] = []
+    heavy = ""
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=BACKEND, env=env,
+                             timeout=300, check=True).stdout.splitlines()
+        samples.append(float(out[0]))
+        heavy = out[1] if len(out) > 1 else ""
+    return {**summarize(samples), "heavy_modules": [m for m in heavy.split(",") if m]}
+
+
+def memory(pid: int) -> Dict[str, int]:
+    """Bytes from smaps_rollup: rss, pss, shared (clean + dirty) and private."""
+    fields: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def _children(pid: int) -> List[int]:
+    out = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{name}/cmdline", "rb") as f:
+                cmd = f.read()
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid and b"resource_tracker" not in cmd:  # multiprocessing's helper, not a worker
+            out.append(int(name))
+    return sorted(out)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait(client: httpx.Client, path: str, t0: float, deadline: float) -> Optional[float]:
+    while time.monotonic() < deadline:
+        try:
+            if client.get(path).status_code == 200:
+                return (time.monotonic() - t0) * 1000.0
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    return None
+
+
+def server(mode: str, workers: int, env: Dict[str, str], timeout: float, image: bytes) -> Dict[str, Any]:
+    port = _free_port()
+    if mode == "prefork":
+        cmd = [sys.executable, "-m", "app.serve", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers)]
+    t0 = time.monotonic()
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=log, start_new_session=True)
+    out: Dict[str, Any] = {"mode": mode, "workers": workers}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+            deadline = t0 + timeout
+            out["health_ms"] = _wait(client, "/health", t0, deadline)
+            out["ready_ms"] = _wait(client, "/ready", t0, deadline)
+            if out["ready_ms"] is None:
+                raise RuntimeError(f"{mode}: not ready after {timeout}s")
+            t1 = time.perf_counter()
+            res = client.post("/api/v1/analyze", files={"file": ("cold.jpg", image, "image/jpeg")})
+            out["first_request_ms"] = (time.perf_counter() - t1) * 1000.0
+            out["first_request_engine"] = res.json().get("engine") if res.status_code == 200 else res.status_code
+            # every worker: the kernel hands connections to whichever accepts first
+            for _ in range(workers * 4):
+                client.get("/ready")
+        time.sleep(1.0)
+        pids = _children(proc.pid) or [proc.pid]  # uvicorn with one worker doesn't fork
+        out["parent"] = memory(proc.pid) if pids != [proc.pid] else {}
+        out["per_worker"] = [memory(p) for p in pids]
+        n = max(1, len(pids))
+        out["rss_per_worker_mb"] = sum(m.get("rss", 0) for m in out["per_worker"]) / n / MB
+        out["pss_per_worker_mb"] = sum(m.get("pss", 0) for m in out["per_worker"]) / n / MB
+        out["pss_total_mb"] = (sum(m.get("pss", 0) for m in out["per_worker"]) + out["parent"].get("pss", 0)) / MB
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        if out.get("ready_ms") is None:
+            log.seek(0)
+            sys.stderr.write(log.read().decode(errors="replace")[-4000:])
+        log.close()
+    return out
+
+
+def main(argv: List[str] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--modes", default="prefork,uvicorn", help="prefork (python -m app.serve), uvicorn (--workers)")
+    ap.add_argument("--workers", default="1,4", help="comma-separated worker counts")
+    ap.add_argument("--repeat", type=int, default=5, help="fresh interpreters for the import timing")
+    ap.add_argument("--detector", default=None, help="DETECTOR for the servers (default: inherit, i.e. auto)")
+    ap.add_argument("--timeout", type=float, default=300.0)
+    ap.add_argument("--out", default="coldstart-results.json")
+    args = ap.parse_args(argv)
+
+    from benchmarks.run import _meta
+    workdir = tempfile.mkdtemp(prefix="ia-coldstart-")
+    env = {**os.environ, "UPLOAD_DIR": os.path.join(workdir, "uploads"), "RESULT_CACHE_SIZE": "0",
+           "STORAGE_SWEEP_INTERVAL": "0", "PYTHONPATH": BACKEND}
+    if args.detector:
+        env["DETECTOR"] = args.detector
+    image = encode(make_image(1280, 720, 20))
+
+    results: Dict[str, Any] = {"import/app.main": import_time(args.repeat, env)}
+    print(f"[coldstart] import app.main p50 {results['import/app.main']['p50_ms']:.0f}ms, heavy modules: "
+          f"{','.join(results['import/app.main']['heavy_modules']) or 'none'}", file=sys.stderr)
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        for workers in (int(w) for w in args.workers.split(",")):
+            try:
+                r = server(mode, workers, env, args.timeout, image)
+            except Exception as e:
+                print(f"[coldstart] {mode} x{workers}: {e}", file=sys.stderr)
+                continue
+            results[f"coldstart/{mode}/w{workers}"] = r
+            print(f"[coldstart] {mode} x{workers}: health {r['health_ms']:.0f}ms, ready {r['ready_ms']:.0f}ms, "
+                  f"first /analyze {r['first_request_ms']:.0f}ms; per worker RSS {r['rss_per_worker_mb']:.0f}MB "
+                  f"PSS {r['pss_per_worker_mb']:.0f}MB, total PSS {r['pss_total_mb']:.0f}MB", file=sys.stderr)
+
+    with open(args.out, "w") as f:
+        json.dump({"meta": _meta("coldstart"), "results": results}, f, indent=2, sort_keys=True)
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(f"[coldstart] wrote {args.out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
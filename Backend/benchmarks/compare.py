@@ -0,0 +1,57 @@
+import argparse, json, sys
+from typing import Any, Dict, List, Tuple
+
+Row = Tuple[str, float, float, float, str]  # name, baseline, current, ratio, verdict
+
+
+def compare(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    metric: str = "p50_ms",
+    tolerance: float = 0.25,
+    min_delta_ms: float = 0.05,
+) -> List[Row]:
+    """Benchmarks present in both result files; slower by more than `tolerance` (and
+    `min_delta_ms`, to ignore timer noise on tiny numbers) counts as a regression."""
+    rows: List[Row] = []
+    cur, base = current.get("results", {}), baseline.get("results", {})
+    for name in sorted(set(cur) & set(base)):
+        b, c = base[name].get(metric), cur[name].get(metric)
+        if b is None or c is None:
+            continue
+        ratio = c / b if b else float("inf") if c else 1.0
+        if ratio > 1 + tolerance and c - b > min_delta_ms:
+            verdict = "REGRESSION"
+        elif ratio < 1 / (1 + tolerance) and b - c > min_delta_ms:
+            verdict = "faster"
+        else:
+            verdict = "ok"
+        rows.append((name, b, c, ratio, verdict))
+    return rows
+
+
+def print_rows(rows: List[Row], metric: str) -> None:
+    width = max([len(r[0]) for r in rows] + [9])
+    print(f"{'benchmark':<{width}}  {'baseline':>10}  {'current':>10}  {'ratio':>6}  ({metric})")
+    for name, b, c, ratio, verdict in rows:
+        print(f"{name:<{width}}  {b:>10.3f}  {c:>10.3f}  {ratio:>6.2f}  {verdict if verdict != 'ok' else ''}")
+
+
+def main(argv: List[str] = None) -> int:
+    ap = argparse.ArgumentParser(description="Compare two benchmark result files")
+    ap.add_argument("current")
+    ap.add_argument("baseline")
+    ap.add_argument("--metric", default="p50_ms")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    args = ap.parse_args(argv)
+    with open(args.current) as f:
+        current = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, args.metric, args.tolerance)
+    print_rows(rows, args.metric)
+    return 1 if any(r[4] == "REGRESSION" for r in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
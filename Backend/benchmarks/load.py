@@ -0,0 +1,75 @@
+import asyncio, itertools, time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+
+from benchmarks.stats import summarize
+from benchmarks.synthetic import make_image, encode, history_entry
+
+Request = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+async def drive(app: Any, request: Request, concurrency: int, total: int) -> Dict[str, Any]:
+    """Send `total` requests from `concurrency` in-process clients; latency percentiles and throughput."""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = itertools.count()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120.0) as client:
+
+        async def worker() -> None:
+            while True:
+                i = next(counter)
+                if i >= total:
+                    return
+                t0 = time.perf_counter()
+                try:
+                    res = await request(client, i)
+                    statuses[str(res.status_code)] += 1
+                except Exception as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        wall = time.perf_counter() - start
+    out = summarize(latencies)
+    out.update({
+        "concurrency": concurrency,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "errors": sum(n for s, n in statuses.items() if not s.startswith("2")),
+        "status": dict(statuses),
+    })
+    return out
+
+
+def analyze_request(width: int, height: int, objects: int, detector: str, variants: int = 16) -> Request:
+    # distinct images so the duplicate-upload cache doesn't answer (unless it's enabled on purpose)
+    payloads = [encode(make_image(width, height, objects, seed=i)) for i in range(variants)]
+
+    async def send(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        files = {"file": (f"bench{i}.jpg", payloads[i % len(payloads)], "image/jpeg")}
+        return await client.post(f"/api/v1/analyze?detector={detector}", files=files)
+
+    return send
+
+
+def history_request(n_entries: int) -> Request:
+    from app.utils.history import append_history_many
+    entries = [history_entry(i) for i in range(n_entries)]
+    for start in range(0, n_entries, 5000):
+        append_history_many(entries[start:start + 5000])
+    ids = [e["id"] for e in entries]
+
+    async def send(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        # list pages and single-item lookups, as the gallery does
+        if i % 2:
+            return await client.get(f"/api/v1/history/{ids[(i * 7919) % len(ids)]}")
+        return await client.get("/api/v1/history?limit=20")
+
+    return send
+
+
+def run_load(app: Any, request: Request, concurrency: int, total: int) -> Dict[str, Any]:
+    return asyncio.run(drive(app, request, concurrency, total))
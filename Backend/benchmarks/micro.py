@@ -0,0 +1,120 @@
+import os, json, random
+import numpy as np
+from typing import Dict, Iterable, List
+
+from benchmarks.stats import measure
+from benchmarks.synthetic import RESOLUTIONS, DENSITIES, make_image, make_boxes, history_entry
+from app.core.config import settings
+from app.models.detection import Detection, DetectionBatch, HIST_BINS, _detect_contour
+from app.services.analytics import compute_statistics, compute_statistics_batch
+from app.utils.visualize import draw_bboxes
+from app.utils.history import list_history, list_history_page, get_history_by_id, get_history_backend
+
+Results = Dict[str, Dict[str, float]]
+
+
+def bench_contour(resolutions: Iterable[str], densities: Iterable[str], repeat: int) -> Results:
+    out: Results = {}
+    for res in resolutions:
+        w, h = RESOLUTIONS[res]
+        for seed, dens in enumerate(densities):
+            img = make_image(w, h, DENSITIES[dens], seed=seed)
+            out[f"contour/{res}/{dens}"] = measure(lambda: _detect_contour(img, max_dets=300), repeat=repeat)
+    return out
+
+
+def bench_statistics(resolutions: Iterable[str], box_counts: Iterable[int], repeat: int) -> Results:
+    out: Results = {}
+    for res in resolutions:
+        w, h = RESOLUTIONS[res]
+        img = make_image(w, h, 0)
+        for n in box_counts:
+            boxes = make_boxes(w, h, n)
+            dets = [Detection(label="blob", confidence=1.0, bbox=b) for b in boxes]
+            # per-detection API as called by older clients, and the batched one the pipeline uses
+            out[f"statistics/{res}/{n}/per_box"] = measure(lambda: [compute_statistics(img, d) for d in dets], repeat=repeat)
+            out[f"statistics/{res}/{n}/batch"] = measure(lambda: compute_statistics_batch(img, boxes), repeat=repeat)
+    return out
+
+
+def bench_draw(resolutions: Iterable[str], box_counts: Iterable[int], repeat: int, workdir: str) -> Results:
+    out: Results = {}
+    for res in resolutions:
+        w, h = RESOLUTIONS[res]
+        img = make_image(w, h, 0)
+        path = os.path.join(workdir, "draw", f"{res}.jpg")
+        for n in box_counts:
+            dets = [Detection(label=f"c{i % 5}", confidence=0.9, bbox=b) for i, b in enumerate(make_boxes(w, h, n))]
+            out[f"draw/{res}/{n}"] = measure(lambda: draw_bboxes(img, dets, path), repeat=repeat)
+    return out
+
+
+def seed_history(directory: str, n: int) -> List[str]:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "history.jsonl")
+    ids = []
+    with open(path, "w", encoding="utf-8") as f:
+        step = 10000
+        for start in range(0, n, step):
+            entries = [history_entry(i) for i in range(start, min(n, start + step))]
+            ids.extend(e["id"] for e in entries)
+            f.write("".join(json.dumps(e) + "\n" for e in entries))
+    return ids
+
+
+def bench_history(sizes: Iterable[int], backends: Iterable[str], repeat: int, workdir: str) -> Results:
+    out: Results = {}
+    saved = (settings.UPLOAD_DIR, settings.HISTORY_BACKEND, settings.HISTORY_DB_PATH)
+    rng = random.Random(0)
+    try:
+        for n in sizes:
+            directory = os.path.join(workdir, f"history-{n}")
+            ids = seed_history(directory, n)
+            for backend in backends:
+                settings.UPLOAD_DIR = directory
+                settings.HISTORY_BACKEND = backend
+                settings.HISTORY_DB_PATH = os.path.join(directory, "history.db")
+                name = f"history/{backend}/{n}"
+                # first call opens the backend: index scan for jsonl, import for an empty sqlite db
+                out[f"{name}/open"] = measure(lambda: get_history_backend().list(limit=1), repeat=1, warmup=0)
+                out[f"{name}/list"] = measure(lambda: list_history(limit=20), repeat=repeat)
+                cursor = None
+                for _ in range(50):
+                    cursor = list_history_page(limit=20, cursor=cursor)[1]
+                out[f"{name}/list_deep"] = measure(lambda: list_history_page(limit=20, cursor=cursor), repeat=repeat)
+                out[f"{name}/list_label"] = measure(lambda: list_history_page(limit=20, label="dog"), repeat=repeat)
+                picks = [rng.choice(ids) for _ in range(max(repeat, 100))]
+                it = iter(picks * 3)
+                out[f"{name}/get"] = measure(lambda: get_history_by_id(next(it)), repeat=len(picks))
+    finally:
+        settings.UPLOAD_DIR, settings.HISTORY_BACKEND, settings.HISTORY_DB_PATH = saved
+    return out
+
+
+def seed_index(directory: str, n: int, per_result: int = 50, seed: int = 0):
+    from app.services.similarity import HistogramIndex
+    index = HistogramIndex(directory)
+    rng = np.random.default_rng(seed)
+    names = ["person", "car", "dog", "blob"]
+    for r in range(0, n, per_result):
+        m = min(per_result, n - r)
+        hists = rng.dirichlet(np.ones(HIST_BINS), size=m).astype(np.float32)
+        dets = DetectionBatch(np.tile([0, 0, 8, 8], (m, 1)), np.ones(m), rng.integers(0, len(names), m), names,
+                              histograms=hists, valid=np.ones(m, dtype=bool))
+        index.add(f"{r:032x}", dets)
+    return index
+
+
+def bench_similarity(sizes: Iterable[int], repeat: int, workdir: str) -> Results:
+    out: Results = {}
+    rng = np.random.default_rng(1)
+    for n in sizes:
+        index = seed_index(os.path.join(workdir, f"index-{n}"), n)
+        queries = iter(rng.dirichlet(np.ones(HIST_BINS), size=repeat * 3 + 10).astype(np.float32))
+        for metric in ("l2", "cosine", "intersection"):
+            out[f"similarity/{n}/{metric}"] = measure(lambda: index.search(next(queries), k=10, metric=metric),
+                                                      repeat=repeat)
+        queries = iter(rng.dirichlet(np.ones(HIST_BINS), size=repeat + 2).astype(np.float32))
+        out[f"similarity/{n}/l2_label"] = measure(lambda: index.search(next(queries), k=10, labels=["dog"]),
+                                                  repeat=repeat)
+    return out
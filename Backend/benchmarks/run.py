@@ -0,0 +1,124 @@
+"""Offline benchmark suite: `python -m benchmarks.run --quick --out results.json [--baseline base.json]`.
+
+Runs against a throwaway UPLOAD_DIR with the contour detector, so no model weights or
+network are needed. Results are JSON; --baseline compares p50 against a stored run and
+exits 1 on a regression.
+"""
+import argparse, json, os, platform, shutil, subprocess, sys, tempfile, time
+from datetime import datetime
+from typing import Any, Dict, List
+
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "quick": {"resolutions": ["vga", "fhd"], "densities": ["sparse", "dense"], "boxes": [10, 300],
+              "history": [10_000], "index": [100_000], "repeat": 5, "requests": 60},
+    "default": {"resolutions": ["vga", "hd", "fhd"], "densities": ["sparse", "medium", "dense"],
+                "boxes": [10, 100, 1000], "history": [10_000, 100_000], "index": [100_000, 1_000_000],
+                "repeat": 20, "requests": 300},
+    "full": {"resolutions": ["vga", "hd", "fhd", "12mp"], "densities": ["sparse", "medium", "dense"],
+             "boxes": [10, 100, 1000], "history": [10_000, 100_000, 1_000_000], "index": [1_000_000, 5_000_000],
+             "repeat": 30, "requests": 1000},
+}
+SUITES = ("contour", "statistics", "draw", "history", "similarity", "load")
+
+
+def _csv(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _meta(preset: str) -> Dict[str, Any]:
+    import cv2, numpy
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             timeout=5).stdout.strip() or None
+    except Exception:
+        rev = None
+    return {
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "preset": preset,
+        "git": rev,
+        "python": sys.version.split()[0],
+        "numpy": numpy.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _load_suite(levels: List[str], total: int, detector: str) -> Dict[str, Any]:
+    from app.main import app
+    from benchmarks.load import run_load, analyze_request, history_request
+    analyze = analyze_request(1280, 720, 50, detector)
+    history = history_request(10_000)
+    out: Dict[str, Any] = {}
+    for c in (int(v) for v in levels):
+        out[f"load/analyze/hd/c{c}"] = run_load(app, analyze, c, total)
+        out[f"load/history/c{c}"] = run_load(app, history, c, total)
+    return out
+
+
+def main(argv: List[str] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--preset", choices=sorted(PRESETS), default="default")
+    ap.add_argument("--quick", action="store_const", const="quick", dest="preset")
+    ap.add_argument("--full", action="store_const", const="full", dest="preset")
+    ap.add_argument("--suites", default=",".join(SUITES), help=f"comma-separated subset of {','.join(SUITES)}")
+    ap.add_argument("--history-sizes", default=None, help="e.g. 10000,100000,1000000")
+    ap.add_argument("--history-backends", default="jsonl,sqlite")
+    ap.add_argument("--concurrency", default="1,8", help="load driver concurrency levels")
+    ap.add_argument("--requests", type=int, default=None, help="requests per load scenario")
+    ap.add_argument("--detector", default="contour")
+    ap.add_argument("--out", default="benchmark-results.json")
+    ap.add_argument("--baseline", default=None, help="result file to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args(argv)
+    cfg = PRESETS[args.preset]
+    suites = _csv(args.suites)
+
+    workdir = tempfile.mkdtemp(prefix="ia-bench-")
+    # before the app is imported: settings are read once
+    os.environ["UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ.setdefault("RESULT_CACHE_SIZE", "0")
+    os.environ.setdefault("MODEL_WARMUP", "false")
+
+    from benchmarks import micro
+    from benchmarks.compare import compare, print_rows
+
+    results: Dict[str, Any] = {}
+
+    def run(name: str, fn, *a) -> None:
+        t0 = time.perf_counter()
+        got = fn(*a)
+        results.update(got)
+        print(f"[bench] {name}: {len(got)} results in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    repeat = cfg["repeat"]
+    if "contour" in suites:
+        run("contour", micro.bench_contour, cfg["resolutions"], cfg["densities"], repeat)
+    if "statistics" in suites:
+        run("statistics", micro.bench_statistics, cfg["resolutions"], cfg["boxes"], repeat)
+    if "draw" in suites:
+        run("draw", micro.bench_draw, cfg["resolutions"], cfg["boxes"], repeat, workdir)
+    if "history" in suites:
+        sizes = [int(s) for s in _csv(args.history_sizes)] if args.history_sizes else cfg["history"]
+        run("history", micro.bench_history, sizes, _csv(args.history_backends), repeat, workdir)
+    if "similarity" in suites:
+        run("similarity", micro.bench_similarity, cfg["index"], repeat, workdir)
+    if "load" in suites:
+        run("load", _load_suite, _csv(args.concurrency), args.requests or cfg["requests"], args.detector)
+
+    report = {"meta": _meta(args.preset), "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"[bench] wrote {args.out}", file=sys.stderr)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(report, json.load(f), tolerance=args.tolerance)
+        print_rows(rows, "p50_ms")
+        return 1 if any(r[4] == "REGRESSION" for r in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
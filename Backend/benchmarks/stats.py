@@ -0,0 +1,37 @@
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Linear-interpolated percentile, q in 0-100."""
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    return {
+        "n": len(samples_ms),
+        "min_ms": min(samples_ms) if samples_ms else 0.0,
+        "p50_ms": percentile(samples_ms, 50),
+        "p95_ms": percentile(samples_ms, 95),
+        "p99_ms": percentile(samples_ms, 99),
+        "mean_ms": sum(samples_ms) / len(samples_ms) if samples_ms else 0.0,
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int = 20, warmup: int = 2, min_time: float = 0.0) -> Dict[str, float]:
+    """Time `fn` `repeat` times (more if `min_time` seconds haven't passed) after `warmup` calls."""
+    for _ in range(warmup):
+        fn()
+    samples: List[float] = []
+    start = time.perf_counter()
+    while len(samples) < repeat or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return summarize(samples)
@@ -0,0 +1,63 @@
+from typing import Dict, List, Tuple
+import cv2
+import numpy as np
+
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {  # name -> (width, height)
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "12mp": (4000, 3000),
+}
+DENSITIES: Dict[str, int] = {"sparse": 5, "medium": 50, "dense": 500}
+
+
+def make_image(width: int, height: int, objects: int, seed: int = 0) -> np.ndarray:
+    """Noisy gradient background with `objects` filled rectangles and ellipses."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(40, 90, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 30, height, dtype=np.float32)[:, None]
+    img = np.repeat((x + y)[:, :, None], 3, axis=2)
+    img += rng.normal(0, 4, img.shape).astype(np.float32)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    side = max(8, int(min(width, height) / max(4.0, np.sqrt(objects) * 2.5)))
+    for _ in range(objects):
+        w, h = rng.integers(side // 2, side + 1, size=2)
+        x1 = int(rng.integers(0, max(1, width - w)))
+        y1 = int(rng.integers(0, max(1, height - h)))
+        color = tuple(int(c) for c in rng.integers(140, 256, size=3))
+        if rng.random() < 0.5:
+            cv2.rectangle(img, (x1, y1), (x1 + int(w), y1 + int(h)), color, -1)
+        else:
+            cv2.ellipse(img, (x1 + int(w) // 2, y1 + int(h) // 2), (int(w) // 2, int(h) // 2), 0, 0, 360, color, -1)
+    return img
+
+
+def make_boxes(width: int, height: int, n: int, seed: int = 0) -> List[List[int]]:
+    rng = np.random.default_rng(seed)
+    x1 = rng.integers(0, width - 16, n)
+    y1 = rng.integers(0, height - 16, n)
+    x2 = np.minimum(width, x1 + rng.integers(8, max(9, width // 8), n))
+    y2 = np.minimum(height, y1 + rng.integers(8, max(9, height // 8), n))
+    return np.stack([x1, y1, x2, y2], axis=1).tolist()
+
+
+def encode(img: np.ndarray, ext: str = ".jpg") -> bytes:
+    ok, buf = cv2.imencode(ext, img)
+    if not ok:
+        raise ValueError(f"encode failed: {ext}")
+    return buf.tobytes()
+
+
+def history_entry(i: int, labels: Tuple[str, ...] = ("person", "car", "dog", "blob")) -> Dict:
+    hid = f"{i:032x}"
+    return {
+        "id": hid,
+        "result_id": hid,
+        "filename": f"{hid}_img{i}.jpg",
+        "original_url": f"/static/{hid}_img{i}.jpg",
+        "annotated_url": f"/api/v1/annotated/{hid}",
+        "uploaded_at": f"2024-01-01T00:00:{i % 60:02d}.{i:06d}Z",
+        "objects_count": i % 17,
+        "labels": sorted({labels[i % len(labels)], labels[(i // 3) % len(labels)]}),
+        "detector": "auto",
+    }
@@ -1,27 +1,38 @@
 import io
+import cv2
+import numpy as np
 from fastapi.testclient import TestClient
 from app.main import app
 
 client = TestClient(app)
 
 def test_analyze_flow():
-    img_bytes = io.BytesIO(
-        b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01"
-        b"\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4"
-        b"\x89\x00\x00\x00\nIDATx\xdac``\x00\x00\x00\x02"
-        b"\x00\x01\xe2!\xbc33\x00\x00\x00\x00IEND\xaeB`\x82"
-    )
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    cv2.rectangle(img, (12, 12), (40, 44), (255, 255, 255), -1)
+    img_bytes = io.BytesIO(cv2.imencode(".png", img)[1].tobytes())
 
     files = {
         "file": ("test.png", img_bytes, "image/png")
     }
 
-    response = client.post("/api/v1/analyze", files=files)
+    response = client.post("/api/v1/analyze?detector=contour", files=files)
     assert response.status_code == 200
 
     data = response.json()
     assert "message" in data
-    assert data["message"] == "Analysis complete"
+    assert data["message"] == "analysis_complete"
     assert isinstance(data["objects"], list)
+    assert len(data["objects"]) == 1
+    x1, y1, x2, y2 = data["objects"][0]["bbox"]
+    assert x1 <= 12 and y1 <= 12 and x2 >= 40 and y2 >= 44
 
-    assert data["objects"] == []
+    item = client.get(f"/api/v1/history/{data['history_id']}")
+    assert item.status_code == 200
+    assert item.json()["objects_count"] == 1
+
+    annotated = client.get(data["annotated_url"])
+    assert annotated.status_code == 200
+    assert cv2.imdecode(np.frombuffer(annotated.content, np.uint8), cv2.IMREAD_COLOR).shape == (64, 64, 3)
+
+    assert client.delete(f"/api/v1/history/{data['history_id']}").status_code == 200
+    assert client.get(f"/api/v1/history/{data['history_id']}").status_code == 404
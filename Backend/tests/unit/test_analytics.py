@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+from app.services.analytics import compute_statistics_batch, statistics_to_list
+from app.utils.image import ImageContext
+from app.core.config import settings
+
+
+def _reference(img, box):
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = box
+    x1 = max(0, x1); y1 = max(0, y1); x2 = min(w, x2); y2 = min(h, y2)
+    if x2 <= x1 or y2 <= y1:
+        return {"area": 0, "histogram": []}
+    gray = cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+    hist = cv2.calcHist([gray], [0], None, [16], [0, 256]).flatten()
+    hist = hist / (hist.sum() + 1e-6)
+    return {"area": (x2 - x1) * (y2 - y1), "histogram": hist.astype(float).tolist()}
+
+def test_batch_matches_per_box_calchist(monkeypatch):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    xy = rng.integers(-10, 160, (100, 2))
+    boxes = np.c_[xy, xy + rng.integers(1, 60, (100, 2))]
+    boxes[0] = [200, 200, 220, 220]  # fully outside
+    expected = [_reference(img, b.tolist()) for b in boxes]
+    ctx = ImageContext(img)
+    # both the integral-image path (many boxes) and the per-ROI path (few boxes)
+    assert statistics_to_list(compute_statistics_batch(ctx, boxes)) == expected
+    assert statistics_to_list(compute_statistics_batch(ctx, boxes[:3])) == expected[:3]
+    # images of tiled size: each box converted on its own
+    monkeypatch.setattr(settings, "TILE_MIN_PIXELS", 1000)
+    assert statistics_to_list(compute_statistics_batch(ImageContext(img), boxes)) == expected
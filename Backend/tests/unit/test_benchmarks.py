@@ -0,0 +1,43 @@
+import json
+from benchmarks import run
+from benchmarks.compare import compare
+from benchmarks.stats import percentile, measure
+
+
+def test_percentile_and_measure():
+    assert percentile([], 50) == 0.0
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile(list(range(101)), 99) == 99
+    out = measure(lambda: None, repeat=5, warmup=1)
+    assert out["n"] == 5 and out["p50_ms"] >= 0
+
+
+def test_compare_flags_regressions():
+    base = {"results": {"a": {"p50_ms": 10.0}, "b": {"p50_ms": 10.0}, "c": {"p50_ms": 0.01}, "gone": {"p50_ms": 1}}}
+    cur = {"results": {"a": {"p50_ms": 14.0}, "b": {"p50_ms": 5.0}, "c": {"p50_ms": 0.03}, "new": {"p50_ms": 1}}}
+    verdicts = {r[0]: r[4] for r in compare(cur, base, tolerance=0.25)}
+    # "c" tripled but stays under the noise floor
+    assert verdicts == {"a": "REGRESSION", "b": "faster", "c": "ok"}
+
+
+def test_run_writes_results_and_checks_baseline(tmp_path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path / "uploads"))
+    out = tmp_path / "r.json"
+    args = ["--quick", "--suites", "contour,history", "--history-sizes", "300",
+            "--history-backends", "jsonl", "--out", str(out)]
+    assert run.main(args) == 0
+    report = json.loads(out.read_text())
+    assert report["meta"]["preset"] == "quick"
+    assert {"contour/vga/sparse", "history/jsonl/300/get", "history/jsonl/300/list"} <= set(report["results"])
+    assert run.main(args + ["--out", str(tmp_path / "r2.json"), "--baseline", str(out), "--tolerance", "100"]) == 0
+
+
+def test_coldstart_reads_process_memory():
+    import os, sys
+    from benchmarks.coldstart import memory, import_time
+    mem = memory(os.getpid())
+    if not mem:
+        return  # no /proc/<pid>/smaps_rollup here
+    assert mem["rss"] >= mem["pss"] > 0 and mem["rss"] == mem["shared"] + mem["private"]
+    out = import_time(1, {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)})
+    assert out["n"] == 1 and "cv2" not in out["heavy_modules"]
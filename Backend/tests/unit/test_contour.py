@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+from app.models.detection import _detect_contour
+from app.utils.boxes import nms, merge_overlapping, pairwise_iou
+from app.core.config import settings
+
+
+def test_nms_keeps_best_of_overlapping():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 11, 11], [50, 50, 60, 60]], dtype=np.float32)
+    scores = np.array([0.5, 0.9, 0.7], dtype=np.float32)
+    assert nms(boxes, scores, 0.5).tolist() == [1, 2]
+    assert nms(boxes, scores, 0.5, max_out=1).tolist() == [1]
+    # per-class: the overlapping pair survives when the classes differ
+    assert sorted(nms(boxes, scores, 0.5, classes=np.array([0, 1, 0])).tolist()) == [0, 1, 2]
+    assert np.isclose(pairwise_iou(boxes[:1], boxes[:1])[0, 0], 1.0)
+
+def test_merge_overlapping_unions_chains():
+    boxes = np.array([[0, 0, 10, 10], [8, 0, 20, 10], [18, 0, 30, 10], [100, 100, 110, 110]], dtype=np.float32)
+    scores = np.array([0.2, 0.4, 0.3, 0.1], dtype=np.float32)
+    merged, best = merge_overlapping(boxes, scores, 0.0)
+    assert sorted(map(tuple, merged.tolist())) == [(0, 0, 30, 10), (100, 100, 110, 110)]
+    assert np.allclose(sorted(best.tolist()), [0.1, 0.4])
+
+def test_contour_downscaled_boxes_map_back(monkeypatch):
+    img = np.zeros((800, 1200, 3), dtype=np.uint8)
+    cv2.rectangle(img, (100, 100), (400, 500), (255, 255, 255), -1)
+    cv2.rectangle(img, (700, 200), (1000, 300), (120, 120, 120), -1)
+    monkeypatch.setattr(settings, "CONTOUR_MAX_SIDE", 300)
+    dets = _detect_contour(img)
+    assert len(dets) == 2
+    strong, faint = dets
+    assert abs(strong.bbox[0] - 100) <= 8 and abs(strong.bbox[3] - 500) <= 8
+    assert abs(faint.bbox[2] - 1000) <= 8
+    assert strong.confidence > faint.confidence > 0
+
+def test_contour_caps_noisy_output():
+    rng = np.random.default_rng(0)
+    noise = cv2.GaussianBlur(rng.integers(0, 256, (600, 800, 3), dtype=np.uint8), (5, 5), 0)
+    assert len(_detect_contour(noise, max_dets=25)) <= 25
+
+def test_contour_drops_nested_components():
+    img = np.zeros((400, 400, 3), dtype=np.uint8)
+    cv2.rectangle(img, (50, 50), (350, 350), (255, 255, 255), 3)  # outline
+    cv2.rectangle(img, (150, 150), (200, 200), (255, 255, 255), -1)  # inside it
+    dets = _detect_contour(img)
+    assert len(dets) == 1
+    assert abs(dets[0].bbox[0] - 50) <= 8 and abs(dets[0].bbox[2] - 350) <= 8
@@ -1,3 +1,7 @@
+import io, json, zipfile
+import cv2
+import numpy as np
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -14,3 +18,138 @@ def test_analyze_invalid_type():
         files={"file": ("test.txt", b"hello", "text/plain")}
     )
     assert response.status_code == 400
+
+def _png() -> bytes:
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    cv2.rectangle(img, (10, 10), (40, 40), (255, 255, 255), -1)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+def test_analyze_batch_streams_ndjson():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("a/one.png", _png())
+        zf.writestr("a/two.png", _png())
+        zf.writestr("a/notes.txt", "skip me")
+    response = client.post(
+        "/api/v1/analyze/batch?detector=contour",
+        files=[
+            ("files", ("single.png", _png(), "image/png")),
+            ("files", ("set.zip", archive.getvalue(), "application/zip")),
+            ("files", ("test.txt", b"hello", "text/plain")),
+        ],
+    )
+    assert response.status_code == 200
+    lines = [json.loads(l) for l in response.text.splitlines()]
+    assert sorted(l["index"] for l in lines) == [0, 1, 2, 3]
+    by_name = {l["filename"]: l for l in lines}
+    assert by_name["one.png"]["message"] == "analysis_complete"
+    assert by_name["one.png"]["history_id"]
+    assert by_name["one.png"]["engine"] == "contour"
+    assert by_name["one.png"]["engine_reason"] == "requested"
+    assert by_name["test.txt"]["error"] == "Invalid file type"
+
+def test_annotated_rendered_on_demand():
+    img = np.zeros((80, 120, 3), dtype=np.uint8)
+    cv2.rectangle(img, (20, 20), (60, 60), (255, 255, 255), -1)
+    data = cv2.imencode(".png", img)[1].tobytes()
+    res = client.post("/api/v1/analyze?detector=contour", files={"file": ("lazy.png", data, "image/png")})
+    assert res.status_code == 200
+    url = res.json()["annotated_url"]
+    assert url.startswith("/api/v1/annotated/")
+
+    full = client.get(url)
+    assert full.status_code == 200
+    assert full.headers["content-type"] == "image/png"
+    assert cv2.imdecode(np.frombuffer(full.content, np.uint8), cv2.IMREAD_COLOR).shape == (80, 120, 3)
+
+    small = client.get(url, params={"max_width": 60, "format": "jpg"})
+    assert small.headers["content-type"] == "image/jpeg"
+    assert cv2.imdecode(np.frombuffer(small.content, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (40, 60)
+    assert small.headers["etag"] != full.headers["etag"]
+
+    again = client.get(url, headers={"If-None-Match": full.headers["etag"]})
+    assert again.status_code == 304
+
+    client.delete(f"/api/v1/history/{res.json()['history_id']}")
+    assert client.get(url).status_code == 404
+
+def test_history_thumbnails():
+    img = np.full((300, 600, 3), 128, dtype=np.uint8)
+    data = cv2.imencode(".jpg", img)[1].tobytes()
+    res = client.post("/api/v1/analyze?detector=contour", files={"file": ("thumb.jpg", data, "image/jpeg")})
+    item = client.get(f"/api/v1/history/{res.json()['history_id']}").json()
+    assert item["thumb_small_url"].startswith("/api/v1/thumbs/small/")
+    assert item["annotated_thumb_url"] == f"{item['annotated_url']}?max_width=160&format=webp"
+
+    assert client.get(item["annotated_thumb_url"]).status_code == 200
+    small = client.get(item["thumb_small_url"])
+    assert small.status_code == 200
+    assert "immutable" in small.headers["cache-control"]
+    thumb = cv2.imdecode(np.frombuffer(small.content, np.uint8), cv2.IMREAD_COLOR)
+    assert max(thumb.shape[:2]) == 160
+    medium = cv2.imdecode(np.frombuffer(client.get(item["thumb_medium_url"]).content, np.uint8), cv2.IMREAD_COLOR)
+    assert medium.shape[:2] == (240, 480)
+    assert client.get(item["thumb_small_url"], headers={"If-None-Match": small.headers["etag"]}).status_code == 304
+
+    client.delete(f"/api/v1/history/{item['id']}")
+    assert client.get(item["thumb_small_url"]).status_code == 404
+
+def test_analyze_columnar_matches_json():
+    img = np.zeros((90, 140, 3), dtype=np.uint8)
+    cv2.rectangle(img, (10, 10), (50, 60), (255, 255, 255), -1)
+    cv2.circle(img, (100, 45), 20, (180, 180, 180), -1)
+    data = cv2.imencode(".png", img)[1].tobytes()
+    plain = client.post("/api/v1/analyze?detector=contour", files={"file": ("c.png", data, "image/png")}).json()
+    res = client.post("/api/v1/analyze?detector=contour&format=columnar", files={"file": ("c.png", data, "image/png")})
+    assert res.status_code == 200
+    col = res.json()
+    assert col["count"] == len(plain["objects"]) == 2
+    for i, obj in enumerate(plain["objects"]):
+        assert col["names"][col["class_id"][i]] == obj["label"]
+        assert col["bbox"][i] == obj["bbox"]
+        assert col["area"][i] == obj["area"]
+        assert np.allclose(col["histogram"][i], obj["histogram"])
+        assert np.isclose(col["confidence"][i], obj["confidence"])
+
+
+def test_analyze_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    img = np.zeros((60, 60, 3), dtype=np.uint8)
+    cv2.rectangle(img, (10, 10), (40, 40), (255, 255, 255), -1)
+    data = cv2.imencode(".png", img)[1].tobytes()
+    res = client.post("/api/v1/analyze?detector=contour&format=msgpack", files={"file": ("m.png", data, "image/png")})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-msgpack")
+    body = msgpack.unpackb(res.content)
+    assert body["count"] == 1 and len(body["bbox"]) == 1
+
+def test_abandoned_batch_records_finished_results():
+    import asyncio
+    from starlette.datastructures import Headers, UploadFile
+    from app.services.batch import analyze_batch
+    from app.utils.history import get_history_by_id
+
+    async def first_then_leave():
+        files = [UploadFile(io.BytesIO(_png()), filename=f"{i}.png", headers=Headers({"content-type": "image/png"}))
+                 for i in range(3)]
+        gen = analyze_batch(files, detector="contour")
+        first = await gen.__anext__()
+        await gen.aclose()  # the client went away
+        return first
+    first = asyncio.run(first_then_leave())
+    assert get_history_by_id(first["history_id"]) is not None
+
+def test_annotated_top_down_bmp():
+    # a contiguous read-only map: width*3 % 4 == 0 and rows stored top-down
+    img = np.zeros((40, 64, 3), dtype=np.uint8)
+    cv2.rectangle(img, (10, 10), (40, 30), (255, 255, 255), -1)
+    data = bytearray(cv2.imencode(".bmp", img)[1].tobytes())
+    offset = int.from_bytes(data[10:14], "little")
+    data[22:26] = (-40).to_bytes(4, "little", signed=True)
+    data[offset:] = img.tobytes()
+    res = client.post("/api/v1/analyze?detector=contour", files={"file": ("td.bmp", bytes(data), "image/bmp")})
+    assert res.status_code == 200
+    ann = client.get(res.json()["annotated_url"] + "?format=png")
+    assert ann.status_code == 200
+    assert cv2.imdecode(np.frombuffer(ann.content, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (40, 64)
+    client.delete(f"/api/v1/history/{res.json()['history_id']}")
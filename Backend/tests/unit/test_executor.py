@@ -0,0 +1,46 @@
+import threading, time
+import pytest
+from app.services.executor import AnalysisExecutor, QueueFullError
+
+
+def test_rejects_when_queue_full():
+    ex = AnalysisExecutor(kind="thread", workers=1, queue_size=1)
+    gate = threading.Event()
+    try:
+        futs = [ex.submit(gate.wait, 5) for _ in range(2)]
+        with pytest.raises(QueueFullError):
+            ex.submit(gate.wait, 5)
+        stats = ex.stats()
+        assert stats["running"] == 1 and stats["queued"] == 1 and stats["rejected"] == 1
+        gate.set()
+        for f in futs:
+            f.result(timeout=5)
+        ex.shutdown()
+        assert ex.stats()["completed"] == 2
+    finally:
+        gate.set()
+        ex.shutdown()
+
+
+def test_run_cancellable_stops_worker_on_disconnect():
+    import asyncio
+    from app.services.executor import CancelToken, AnalysisCancelled
+    ex = AnalysisExecutor(kind="thread", workers=1, queue_size=1)
+    token = CancelToken()
+    stopped = threading.Event()
+
+    def work(token):
+        while not token.cancelled:
+            time.sleep(0.005)
+        stopped.set()
+        token.check()
+
+    async def gone():
+        return True
+
+    try:
+        with pytest.raises(AnalysisCancelled):
+            asyncio.run(ex.run_cancellable(token, gone, work, token))
+        assert stopped.wait(2) and token.reason == "disconnected"
+    finally:
+        ex.shutdown()
@@ -0,0 +1,100 @@
+import json
+import pytest
+from app.utils.history import JsonlHistory, StaleCursor
+from app.utils.history_sqlite import SqliteHistory, import_jsonl
+
+
+def _entry(i, labels):
+    return {
+        "id": f"h{i}",
+        "filename": f"f{i}.png",
+        "uploaded_at": f"2024-01-01T00:00:{i:02d}Z",
+        "objects_count": len(labels),
+        "labels": labels,
+    }
+
+ENTRIES = [_entry(i, ["cat"] if i % 2 else ["dog", "cat"]) for i in range(7)]
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "jsonl":
+        s = JsonlHistory(str(tmp_path / "history.jsonl"))
+    else:
+        s = SqliteHistory(str(tmp_path / "history.db"))
+    s.append_many(ENTRIES[:3])
+    for e in ENTRIES[3:]:
+        s.append(e)
+    return s
+
+def _walk(store, **kw):
+    ids, cursor = [], None
+    while True:
+        items, cursor = store.list(limit=3, cursor=cursor, **kw)
+        ids += [it["id"] for it in items]
+        if cursor is None:
+            return ids
+
+def test_paginates_newest_first(store):
+    assert _walk(store) == [f"h{i}" for i in reversed(range(7))]
+    assert _walk(store, label="dog") == ["h6", "h4", "h2", "h0"]
+
+def test_get_and_delete(store):
+    assert store.get("h3")["filename"] == "f3.png"
+    assert store.delete("h3")["id"] == "h3"
+    assert store.get("h3") is None
+    assert store.delete("h3") is None
+    assert "h3" not in _walk(store)
+    assert store.clear() == 6
+    assert store.list()[0] == []
+
+def test_filename_refs(store):
+    store.append({**_entry(8, ["cat"]), "filename": "f2.png"})
+    assert store.filename_refs("f2.png") == 2
+    store.delete("h2")
+    assert store.filename_refs("f2.png") == 1
+    store.delete("h8")
+    assert store.filename_refs("f2.png") == 0
+
+def test_jsonl_tombstones_compaction_and_other_writers(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    a = JsonlHistory(path, compact_ratio=0.5, compact_min_dead=100)
+    b = JsonlHistory(path)  # another worker process on the same file
+    a.append_many(ENTRIES)
+    assert b.get("h6")["id"] == "h6"
+    b.delete("h1")
+    assert a.get("h1") is None
+    assert a.stats() == {"live": 6, "dead": 1, "bytes": a.stats()["bytes"]}
+
+    a.compact()
+    assert a.stats()["dead"] == 0
+    with open(path) as f:
+        assert len(f.readlines()) == 6
+    assert [it["id"] for it in b.list(limit=10)[0]] == ["h6", "h5", "h4", "h3", "h2", "h0"]
+    b.append(_entry(9, ["cat"]))
+    assert a.list(limit=1)[0][0]["id"] == "h9"
+
+def test_import_jsonl(tmp_path):
+    src = tmp_path / "history.jsonl"
+    src.write_text("".join(json.dumps(e) + "\n" for e in ENTRIES) + "not json\n")
+    db = str(tmp_path / "history.db")
+    assert import_jsonl(str(src), db) == 7
+    assert import_jsonl(str(src), db) == 0
+    assert SqliteHistory(db).get("h5")["labels"] == ["cat"]
+
+def test_jsonl_cursor_survives_compaction(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    a = JsonlHistory(path)
+    a.append_many(ENTRIES)
+    a.delete("h0")
+    page, cursor = a.list(limit=2)
+    assert [it["id"] for it in page] == ["h6", "h5"]
+    a.compact()  # every offset moves
+    assert [it["id"] for it in a.list(limit=2, cursor=cursor)[0]] == ["h4", "h3"]
+
+    _, cursor = a.list(limit=2, cursor=cursor)
+    a.delete("h3")  # the cursor's own entry: still placed until the file is compacted
+    assert [it["id"] for it in a.list(limit=2, cursor=cursor)[0]] == ["h2", "h1"]
+    a.compact()
+    with pytest.raises(StaleCursor):
+        a.list(limit=2, cursor=cursor)
+    assert a.list(limit=2, cursor="garbage")[0][0]["id"] == "h6"
@@ -0,0 +1,79 @@
+import threading
+import numpy as np
+from app.services import inference
+from app.services.inference import InferenceScheduler
+
+
+class _Boxes:
+    # the array attributes of ultralytics' Boxes
+    def __init__(self, confs):
+        self.xyxy = np.tile(np.array([0, 0, 10, 10], dtype=np.float32), (len(confs), 1))
+        self.conf = np.array(confs)
+        self.cls = np.zeros(len(confs), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.conf)
+
+class _Result:
+    names = {0: "thing"}
+
+    def __init__(self, confs):
+        self.boxes = _Boxes(confs)
+
+class _Model:
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, images, conf, max_det, **_):
+        self.calls.append((len(images), conf, max_det))
+        return [_Result([0.9, 0.6, 0.3]) for _ in images]
+
+class _Registry:
+    def __init__(self, model):
+        self.model = model
+
+    def get(self):
+        return self.model
+
+def test_batches_concurrent_requests_and_applies_per_request_filters(monkeypatch):
+    model = _Model()
+    monkeypatch.setattr(inference, "model_registry", _Registry(model))
+    sched = InferenceScheduler(max_batch=4, max_wait_ms=200)
+    img = np.zeros((8, 8, 3), dtype=np.uint8)
+    params = [(0.5, 10), (0.2, 10), (0.2, 1), (0.7, 10)]
+    out = [None] * 4
+
+    def call(i):
+        out[i] = sched.infer(img, *params[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    assert model.calls == [(4, 0.2, 10)]
+    assert [[d.confidence for d in dets] for dets in out] == [[0.9, 0.6], [0.9, 0.6, 0.3], [0.9], [0.9]]
+    assert sched.stats()["batch_size"]["count"] == 1
+
+def test_unbatched_predicts_never_overlap(monkeypatch):
+    class _Slow(_Model):
+        active = peak = 0
+
+        def predict(self, images, conf, max_det, **_):
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            threading.Event().wait(0.01)
+            self.active -= 1
+            return [_Result([0.9]) for _ in (images if isinstance(images, list) else [images])]
+
+    model = _Slow()
+    monkeypatch.setattr(inference, "model_registry", _Registry(model))
+    monkeypatch.setattr(inference, "inference_scheduler", InferenceScheduler(max_batch=1))
+    img = np.zeros((8, 8, 3), dtype=np.uint8)
+    threads = [threading.Thread(target=inference._detect_yolo, args=(img, 0.25, 10)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert model.peak == 1
@@ -0,0 +1,40 @@
+import time
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.executor import analysis_executor
+
+client = TestClient(app)
+
+
+def _png(seed: int) -> bytes:
+    img = np.full((48, 48, 3), seed, dtype=np.uint8)
+    cv2.rectangle(img, (8, 8), (30, 30), (255, 255, 255), -1)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+def test_job_lifecycle_on_local_queue():
+    files = [("files", (f"img{i}.png", _png(i), "image/png")) for i in range(3)]
+    files.append(("files", ("notes.txt", b"hello", "text/plain")))
+    before = analysis_executor.stats()["completed"]
+    response = client.post("/api/v1/jobs?detector=contour&chunk_size=2&priority=7", files=files)
+    assert response.status_code == 202
+    job = response.json()
+    assert job["total"] == 4 and job["priority"] == 7
+
+    for _ in range(100):
+        status = client.get(f"/api/v1/jobs/{job['job_id']}").json()
+        if status["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+    assert status == {**status, "status": "completed", "completed": 3, "failed": 1}
+    assert analysis_executor.stats()["completed"] - before == 3  # admitted like any other analysis
+
+    result = client.get(f"/api/v1/jobs/{job['job_id']}/result").json()
+    assert [it["index"] for it in result["items"]] == [0, 1, 2, 3]
+    assert result["items"][3]["error"] == "Invalid file type"
+    hid = result["items"][0]["history_id"]
+    assert client.get(f"/api/v1/history/{hid}").status_code == 200
+
+def test_unknown_job():
+    assert client.get("/api/v1/jobs/nope").status_code == 404
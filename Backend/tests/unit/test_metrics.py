@@ -0,0 +1,72 @@
+import os
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.config import settings
+from app.core.metrics import MetricsRegistry
+from app.core.timing import collect_stages, stage, add_stages
+
+client = TestClient(app)
+
+
+def test_prometheus_text_format():
+    reg = MetricsRegistry(prefix="t_")
+    reg.counter("hits_total", "hits", ("route",)).labels('a"b').inc(2)
+    reg.gauge("depth", "depth", fn=lambda: 3)
+    h = reg.histogram("lat_ms", "latency", buckets=(1, 10))
+    for v in (0.5, 5, 50):
+        h.observe(v)
+    text = reg.render()
+    assert '# TYPE t_hits_total counter' in text
+    assert 't_hits_total{route="a\\"b"} 2' in text
+    assert "t_depth 3" in text
+    assert 't_lat_ms_bucket{le="1"} 1' in text
+    assert 't_lat_ms_bucket{le="10"} 2' in text
+    assert 't_lat_ms_bucket{le="+Inf"} 3' in text
+    assert "t_lat_ms_sum 55.5" in text and "t_lat_ms_count 3" in text
+
+
+def test_stages_collect_and_merge():
+    with collect_stages() as outer:
+        with stage("decode"):
+            pass
+        with collect_stages() as inner:  # e.g. an executor worker
+            with stage("inference"):
+                pass
+        assert "inference" not in outer
+        add_stages(inner)
+        add_stages({"decode": 1.0})
+    assert set(outer) == {"decode", "inference"}
+    assert outer["decode"] >= 1.0
+
+
+def test_analyze_server_timing_and_metrics():
+    img = np.zeros((80, 80, 3), dtype=np.uint8)
+    cv2.rectangle(img, (10, 10), (50, 50), (255, 255, 255), -1)
+    data = cv2.imencode(".png", img)[1].tobytes()
+    res = client.post("/api/v1/analyze?detector=contour", files={"file": ("t.png", data, "image/png")})
+    assert res.status_code == 200
+    timing = dict(p.split(";dur=") for p in res.headers["server-timing"].split(", "))
+    assert {"upload", "inference", "statistics", "total"} <= set(timing)
+    assert float(timing["total"]) >= float(timing["inference"])
+
+    text = client.get("/metrics").text
+    assert 'imageanalyzer_http_requests_total{method="POST",route="analyze_image",status="200"}' in text
+    assert 'imageanalyzer_stage_duration_ms_count{stage="inference"}' in text
+    assert 'imageanalyzer_detections_total{detector="contour"}' in text
+    assert "imageanalyzer_analysis_queue_depth 0" in text
+
+
+def test_profile_header(monkeypatch):
+    monkeypatch.setattr(settings, "PROFILE_REQUESTS", True)
+    res = client.get("/api/v1/history", headers={"X-Profile": "1"})
+    path = res.headers["x-profile"]
+    assert path.startswith("/static/profiles/")
+    assert os.path.exists(os.path.join(settings.UPLOAD_DIR, path[len("/static/"):]))
+    assert "x-profile" not in client.get("/health").headers
+
+    monkeypatch.setattr(settings, "PROFILE_KEEP", 2)
+    for _ in range(3):
+        client.get("/api/v1/history", headers={"X-Profile": "1"})
+    assert len(os.listdir(os.path.join(settings.UPLOAD_DIR, "profiles"))) == 2
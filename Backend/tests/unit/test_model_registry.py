@@ -0,0 +1,36 @@
+import threading
+from app.services.model_registry import ModelRegistry
+
+
+def _registry(capacity=2):
+    calls = {"load": 0, "warm": 0}
+
+    def loader(weights, device):
+        calls["load"] += 1
+        return object()
+
+    def warmer(model, device, imgsz):
+        calls["warm"] += 1
+
+    return ModelRegistry(capacity=capacity, loader=loader, warmer=warmer), calls
+
+def test_loads_once_per_key():
+    reg, calls = _registry()
+    threads = [threading.Thread(target=reg.get, args=("a.pt", "cpu")) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert reg.get("a.pt", "cpu") is reg.get("a.pt", "cpu")
+    assert calls["load"] == 1
+
+def test_lru_cap_and_warm_state():
+    reg, calls = _registry(capacity=2)
+    reg.warmup("a.pt", "cpu")
+    reg.warmup("a.pt", "cpu")
+    assert calls["warm"] == 1
+    assert reg.is_warm("a.pt", "cpu")
+    reg.get("b.pt", "cpu")
+    reg.get("c.pt", "cpu")
+    assert [m["weights"] for m in reg.status()] == ["c.pt", "b.pt"]
+    assert not reg.is_warm("a.pt", "cpu")
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services.onnx_engine import letterbox, decode_output
+
+
+def _to_letterbox(box, ratio, pad):
+    x1, y1, x2, y2 = box
+    return [(x1 + x2) / 2 * ratio + pad[0], (y1 + y2) / 2 * ratio + pad[1], (x2 - x1) * ratio, (y2 - y1) * ratio]
+
+def test_letterbox_and_decode_round_trip():
+    img = np.zeros((300, 500, 3), dtype=np.uint8)
+    blob, ratio, pad = letterbox(img, 640)
+    assert blob.shape == (1, 3, 640, 640) and blob.dtype == np.float32
+    assert pad[0] == 0 and pad[1] > 0
+
+    # anchors: the object, a weaker duplicate, the same place as another class, and noise
+    rows = [
+        (_to_letterbox([100, 50, 200, 150], ratio, pad), 0, 0.9),
+        (_to_letterbox([102, 52, 201, 151], ratio, pad), 0, 0.6),
+        (_to_letterbox([100, 50, 200, 150], ratio, pad), 1, 0.5),
+        (_to_letterbox([10, 10, 20, 20], ratio, pad), 1, 0.1),
+    ]
+    pred = np.zeros((1, 4 + 2, len(rows)), dtype=np.float32)
+    for i, (xywh, cls, score) in enumerate(rows):
+        pred[0, :4, i] = xywh
+        pred[0, 4 + cls, i] = score
+    dets = decode_output(pred, ratio, pad, img.shape[:2], {0: "cat", 1: "dog"},
+                         conf=0.25, max_dets=10, iou=0.45).to_detections()
+    assert [d.label for d in dets] == ["cat", "dog"]
+    assert all(abs(a - b) <= 1 for a, b in zip(dets[0].bbox, [100, 50, 200, 150]))
+
+
+def _iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+def test_parity_with_torch(tmp_path, monkeypatch):
+    pytest.importorskip("ultralytics")
+    pytest.importorskip("onnxruntime")
+    if not os.path.exists(settings.MODEL_WEIGHTS):
+        pytest.skip("local weights file required for export")
+    import cv2
+    from ultralytics.utils import ASSETS
+    from app.services.inference import run_inference
+
+    monkeypatch.setattr(settings, "ONNX_CACHE_DIR", str(tmp_path))
+    img = cv2.imread(str(ASSETS / "bus.jpg"))
+    torch_dets = run_inference(img, conf=0.4, detector_override="yolo")
+    onnx_dets = run_inference(img, conf=0.4, detector_override="onnx")
+    assert torch_dets
+    assert abs(len(torch_dets) - len(onnx_dets)) <= 1
+    for t in torch_dets:
+        best = max(onnx_dets, key=lambda o: _iou(t.bbox, o.bbox))
+        assert best.label == t.label
+        assert _iou(t.bbox, best.bbox) > 0.9
+        assert abs(best.confidence - t.confidence) < 0.05
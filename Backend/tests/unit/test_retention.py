@@ -0,0 +1,173 @@
+import os, time
+from datetime import datetime, timedelta
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.config import settings
+from app.services.retention import sweeper
+from app.utils.history import append_history_many, get_history_by_id, list_history
+from app.utils.storage import content_name, reserve_name, PENDING_DIR
+from app.services.result_cache import result_cache, ResultCache
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "STORAGE_ORPHAN_GRACE", 60.0)
+    return tmp_path
+
+
+def _stored(root, name, size=1000, age=0.0):
+    filename = content_name(name)
+    path = root / filename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    t = time.time() - age
+    os.utime(path, (t, t))
+    return filename
+
+
+def _entry(filename, age_hours=0.0):
+    hid = os.path.basename(filename)[:32]
+    at = datetime.utcnow() - timedelta(hours=age_hours)
+    return {"id": hid, "result_id": hid, "filename": filename, "original_url": f"/static/{filename}",
+            "annotated_url": f"/api/v1/annotated/{hid}", "uploaded_at": at.isoformat() + "Z",
+            "objects_count": 0, "labels": []}
+
+
+def test_content_name_is_sharded(monkeypatch):
+    name = content_name("../dir/cat.jpg")
+    parts = name.split("/")
+    assert parts[0] == "files" and len(parts) == 4
+    assert parts[3].startswith(parts[1] + parts[2]) and parts[3].endswith("_cat.jpg")
+    monkeypatch.setattr(settings, "STORAGE_SHARD_DEPTH", 0)
+    assert "/" not in content_name("cat.jpg", prefix="smoke_")
+
+
+def test_sweep_expires_and_removes_orphans(upload_dir, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_TTL_HOURS", 24.0)
+    old, new = _stored(upload_dir, "old.jpg"), _stored(upload_dir, "new.jpg")
+    append_history_many([_entry(old, age_hours=48), _entry(new)])
+    orphan = _stored(upload_dir, "orphan.jpg", age=3600)
+    fresh = _stored(upload_dir, "inflight.jpg")  # committed, history not written yet
+    legacy = upload_dir / f"smoke_{'a' * 32}_x.jpg"
+    legacy.write_bytes(b"x")
+    os.utime(legacy, (0, 0))
+    (upload_dir / "history.jsonl.lock").touch()
+
+    out = sweeper.sweep()
+    assert (out["expired"], out["orphans"]) == (1, 2)
+    assert get_history_by_id(os.path.basename(old)[:32]) is None
+    assert not (upload_dir / old).exists() and not (upload_dir / orphan).exists() and not legacy.exists()
+    assert (upload_dir / new).exists() and (upload_dir / fresh).exists()
+    assert (upload_dir / "history.jsonl").exists() and (upload_dir / "history.jsonl.lock").exists()
+    assert not (upload_dir / os.path.dirname(orphan)).exists()  # emptied shard directory
+
+
+def test_sweep_quota_evicts_least_recently_used(upload_dir, monkeypatch):
+    names = [_stored(upload_dir, f"{i}.jpg", size=10_000) for i in range(4)]
+    append_history_many([_entry(n) for n in names])
+    for i, n in enumerate(names):  # names[1] was used longest ago
+        t = time.time() - (1000 if i == 1 else 100 - i)
+        os.utime(upload_dir / n, (t, t))
+    monkeypatch.setattr(settings, "STORAGE_QUOTA_BYTES", 38_000)
+    out = sweeper.sweep()
+    assert out["evicted"] == 1 and out["usage_bytes"] <= 38_000 * settings.STORAGE_QUOTA_LOW
+    assert [e["filename"] for e in list_history(limit=10)] == [n for i, n in enumerate(names) if i != 1][::-1]
+    assert not (upload_dir / names[1]).exists()
+
+
+def test_clear_history_returns_before_files_are_removed():
+    img = np.zeros((60, 80, 3), dtype=np.uint8)
+    cv2.rectangle(img, (10, 10), (40, 40), (255, 255, 255), -1)
+    res = client.post("/api/v1/analyze?detector=contour",
+                      files={"file": ("keep.png", cv2.imencode(".png", img)[1].tobytes(), "image/png")})
+    entry = client.get(f"/api/v1/history/{res.json()['history_id']}").json()
+    assert entry["filename"].startswith("files/")
+    assert client.get(entry["original_url"]).status_code == 200
+    assert client.get(entry["thumb_small_url"]).status_code == 200
+    path = os.path.join(settings.UPLOAD_DIR, entry["filename"])
+
+    res = client.delete("/api/v1/history")
+    assert res.status_code == 202 and res.json()["files_pending"] is True
+    assert list_history(limit=1) == []
+    deadline = time.time() + 5
+    while os.path.exists(path) and time.time() < deadline:
+        time.sleep(0.02)
+    assert not os.path.exists(path)
+
+
+def test_pending_uploads_survive_sweep_and_purge(upload_dir, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_TTL_HOURS", 24.0)
+    queued = reserve_name("queued.jpg")  # e.g. a /jobs item: history written after processing
+    path = upload_dir / queued
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x")
+    os.utime(path, (0, 0))
+    undated = _stored(upload_dir, "undated.jpg")
+    append_history_many([{**_entry(undated), "uploaded_at": "garbage"}])
+
+    out = sweeper.sweep(blocking=True)  # an earlier test's purge may still hold the lock
+    assert out["orphans"] == 0 and out["expired"] == 0
+    sweeper.purge_async(before=time.time()).join(5)
+    assert path.exists() and get_history_by_id(os.path.basename(undated)[:32]) is not None
+
+    append_history_many([_entry(queued)])  # releases the marker
+    assert os.listdir(upload_dir / PENDING_DIR) == []
+    monkeypatch.setattr(settings, "STORAGE_PENDING_MAX_AGE", 0.0)
+    stale = reserve_name("crashed.jpg")  # its worker died: the marker expires
+    (upload_dir / stale).parent.mkdir(parents=True, exist_ok=True)
+    (upload_dir / stale).write_bytes(b"x")
+    os.utime(upload_dir / stale, (0, 0))
+    assert sweeper.sweep(blocking=True)["orphans"] == 1 and not (upload_dir / stale).exists()
+
+
+def test_removed_files_leave_the_result_cache(upload_dir):
+    kept, gone = _stored(upload_dir, "kept.jpg"), _stored(upload_dir, "gone.jpg")
+    append_history_many([_entry(kept), _entry(gone)])
+    result_cache.put("k1", {"files": [kept]})
+    result_cache.put("k2", {"files": [gone]})
+    try:
+        from app.utils.history import delete_history_items
+        delete_history_items([os.path.basename(gone)[:32]])
+        assert result_cache.get("k1") is not None and result_cache.get("k2") is None
+        client.delete("/api/v1/history")
+        assert result_cache.get("k1") is None
+    finally:
+        result_cache.clear()
+
+
+def test_result_cache_checks_files_outside_its_lock(upload_dir, monkeypatch):
+    cache = ResultCache(max_entries=4)
+    kept = _stored(upload_dir, "cached.jpg")
+    cache.put("k", {"files": [kept]})
+    cache.put("gone", {"files": ["missing.jpg"]})
+    checked = []
+
+    def exists(p):
+        checked.append(cache._lock.locked())
+        return os.path.isfile(p)
+    monkeypatch.setattr(os.path, "exists", exists)
+    assert cache.get("k") == {"files": [kept]} and cache.get("gone") is None
+    assert checked == [False, False]
+    assert cache.stats()["entries"] == 1 and cache.stats()["hits"] == 1
+
+
+def test_failed_analyses_release_their_markers(upload_dir):
+    from app.services.executor import CancelToken, AnalysisCancelled
+    from app.services.pipeline import analyze_upload
+    broken = cv2.imencode(".png", np.zeros((40, 40, 3), np.uint8))[1].tobytes()[:40]  # header, no pixels
+    res = client.post("/api/v1/analyze?detector=contour", files={"file": ("broken.png", broken, "image/png")})
+    assert res.status_code == 400
+    assert os.listdir(upload_dir / PENDING_DIR) == []
+
+    token = CancelToken()
+    token.cancel("disconnected")
+    data = cv2.imencode(".png", np.zeros((40, 40, 3), np.uint8))[1].tobytes()
+    with pytest.raises(AnalysisCancelled):
+        analyze_upload(data, "gone.png", detector="contour", token=token)
+    assert os.listdir(upload_dir / PENDING_DIR) == []
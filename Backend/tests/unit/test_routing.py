@@ -0,0 +1,135 @@
+import pickle, time
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services import routing
+from app.services.executor import CancelToken, AnalysisCancelled
+from app.services.inference import InferenceScheduler, _Pending
+from app.services.pipeline import analyze_upload
+from app.services.routing import LatencyEstimator, EngineRouter, FALLBACK_REASONS
+from app.utils.history import get_history_by_id
+
+client = TestClient(app)
+
+
+class _Scheduler:
+    max_batch = 4
+    max_wait = 0.004
+    pending = 0
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(routing.model_registry, "is_loaded", lambda *a: True)
+    return EngineRouter(_Scheduler(), LatencyEstimator(0.5, {"yolo": 100.0, "contour": 10.0}))
+
+
+def test_latency_estimator_ewma():
+    est = LatencyEstimator(0.5, {"yolo": 100.0})
+    assert est.estimate("yolo") == 100.0 and est.estimate("onnx") == 0.0
+    est.observe("yolo", 40.0)
+    est.observe("yolo", 80.0)
+    assert est.estimate("yolo") == 60.0
+    assert est.stats()["yolo"] == {"estimate_ms": 60.0, "samples": 2}
+
+
+def test_router_weighs_queue_against_budget(router):
+    assert router.choose("contour", budget_ms=1)["reason"] == "requested"
+    assert router.choose("auto") == {"engine": "yolo", "reason": "default"}
+    assert router.choose("auto", budget_ms=200)["engine"] == "yolo"  # one batch: 100ms + 4ms wait
+    router.scheduler.pending = 8  # two full batches ahead
+    route = router.choose("auto", budget_ms=200)
+    assert route == {"engine": "contour", "reason": "over_budget", "estimate_ms": 304.0, "budget_ms": 200}
+    # time already spent counts against the budget
+    router.scheduler.pending = 0
+    token = CancelToken(started=time.time() - 0.15)
+    assert router.choose("auto", budget_ms=200, token=token)["reason"] == "over_budget"
+    router.yolo_failed()
+    assert router.choose("auto")["reason"] == "yolo_cooldown"
+    assert {(d["engine"], d["reason"]) for d in router.stats()["decisions"]} >= {
+        ("yolo", "within_budget"), ("contour", "over_budget"), ("contour", "yolo_cooldown")}
+    assert all(d["reason"] in FALLBACK_REASONS for d in router.stats()["decisions"] if d["engine"] == "contour"
+               and d["reason"] != "requested")
+
+
+def test_router_skips_cold_model(router, monkeypatch):
+    warmed = []
+    monkeypatch.setattr(routing.model_registry, "is_loaded", lambda *a: False)
+    monkeypatch.setattr(router, "_warm_in_background", lambda: warmed.append(1))
+    assert router.choose("auto", budget_ms=5000)["reason"] == "yolo_cold"
+    assert warmed == [1]
+
+
+def test_cancel_token_commit_and_deadline():
+    token = CancelToken()
+    token.commit()
+    assert token.cancel("disconnected") is False and not token.cancelled
+    token = CancelToken()
+    assert token.cancel("disconnected") is True
+    with pytest.raises(AnalysisCancelled):
+        token.commit()
+    token = CancelToken(started=time.time() - 1, timeout_ms=500)
+    assert token.cancelled and token.reason == "timeout"
+    copy = pickle.loads(pickle.dumps(CancelToken(timeout_ms=500)))
+    assert copy.deadline is not None and not copy.cancelled
+
+
+def test_scheduler_drops_cancelled_requests():
+    sched = InferenceScheduler(max_batch=4)
+    token = CancelToken()
+    token.cancel("disconnected")
+    item = _Pending(np.zeros((8, 8, 3), np.uint8), 0.25, 10, token)
+    sched._run_batch([item])  # would need a model if anything were left to predict
+    with pytest.raises(AnalysisCancelled):
+        item.future.result(timeout=1)
+
+
+def test_cancelled_analysis_writes_nothing():
+    token = CancelToken()
+    token.cancel("disconnected")
+    data = cv2.imencode(".png", np.zeros((40, 40, 3), np.uint8))[1].tobytes()
+    with pytest.raises(AnalysisCancelled):
+        analyze_upload(data, "gone.png", detector="contour", token=token)
+
+
+def test_analyze_reports_engine_and_reason():
+    img = np.zeros((80, 120, 3), dtype=np.uint8)
+    cv2.rectangle(img, (20, 20), (60, 60), (255, 255, 255), -1)
+    data = cv2.imencode(".png", img)[1].tobytes()
+    res = client.post("/api/v1/analyze?detector=contour", files={"file": ("r.png", data, "image/png")})
+    body = res.json()
+    assert (body["engine"], body["engine_reason"]) == ("contour", "requested")
+    entry = get_history_by_id(body["history_id"])
+    assert (entry["engine"], entry["engine_reason"]) == ("contour", "requested")
+    # no model is loaded here, so a budgeted auto request is answered by contour right away
+    other = cv2.imencode(".png", img[:, ::-1])[1].tobytes()  # not a result-cache hit
+    res = client.post("/api/v1/analyze?detector=auto&budget_ms=5000", files={"file": ("b.png", other, "image/png")})
+    assert res.json()["engine"] == "contour"
+    assert res.json()["engine_reason"] in FALLBACK_REASONS
+    # a fallback answer isn't cached: the next request may get YOLO
+    res = client.post("/api/v1/analyze?detector=auto&budget_ms=5000", files={"file": ("b.png", other, "image/png")})
+    assert res.json()["engine_reason"] != "cached"
+
+
+def _unique_png(seed):
+    img = np.full((60, 80, 3), seed, dtype=np.uint8)
+    cv2.rectangle(img, (10, 10), (40, 40), (255, 255, 255), -1)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def test_batch_and_job_fallbacks_are_not_cached():
+    # no YOLO here: auto falls back to contour, which must not be replayed to later requests
+    batch = _unique_png(101)
+    res = client.post("/api/v1/analyze/batch?detector=auto", files=[("files", ("b.png", batch, "image/png"))])
+    assert res.status_code == 200
+    job_data = _unique_png(102)
+    job = client.post("/api/v1/jobs?detector=auto", files=[("files", ("j.png", job_data, "image/png"))]).json()
+    for _ in range(100):
+        if client.get(f"/api/v1/jobs/{job['job_id']}").json()["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+    for name, data in (("b.png", batch), ("j.png", job_data)):
+        res = client.post("/api/v1/analyze?detector=auto", files={"file": (name, data, "image/png")})
+        assert res.json()["engine_reason"] in FALLBACK_REASONS
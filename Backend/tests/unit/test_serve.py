@@ -0,0 +1,93 @@
+import os, signal, subprocess, sys, threading, time
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.config import settings
+from app.services import model_registry as registry
+from app.serve import Arbiter
+
+client = TestClient(app)
+
+
+def test_api_import_defers_heavy_modules():
+    code = "import sys, app.main; print(','.join(m for m in ('cv2', 'torch', 'ultralytics') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=60,
+                         cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip() == ""
+
+
+def test_ready_once_model_is_warm(monkeypatch):
+    monkeypatch.setattr(registry, "warmup_status", {"state": "pending", "seconds": None, "error": None})
+    monkeypatch.setattr(settings, "DETECTOR", "yolo")
+    monkeypatch.setattr(settings, "MODEL_WARMUP", True)
+    gate = threading.Event()
+    monkeypatch.setattr(registry.model_registry, "warmup", lambda *a, **k: gate.wait(5))
+    assert client.get("/health").status_code == 200
+    assert client.get("/ready").status_code == 503
+
+    t = registry.warmup_in_background()
+    assert client.get("/ready").json()["state"] in ("pending", "warming")
+    gate.set()
+    t.join(5)
+    res = client.get("/ready")
+    assert res.status_code == 200 and res.json()["state"] == "warm"
+    assert registry.warmup_in_background() is None  # forked workers inherit the warm model
+
+
+def test_ready_when_warmup_fails_only_for_auto(monkeypatch):
+    monkeypatch.setattr(registry, "warmup_status", {"state": "pending", "seconds": None, "error": None})
+    monkeypatch.setattr(settings, "MODEL_WARMUP", True)
+
+    def broken(*a, **k):
+        raise RuntimeError("no weights")
+    monkeypatch.setattr(registry.model_registry, "warmup", broken)
+    monkeypatch.setattr(settings, "DETECTOR", "yolo")
+    assert registry.warmup_default_model() is False
+    assert client.get("/ready").status_code == 503
+    monkeypatch.setattr(settings, "DETECTOR", "auto")  # answers with contour meanwhile
+    assert client.get("/ready").json() == {"ready": True, "detector": "auto", "state": "failed",
+                                           "seconds": None, "error": "no weights"}
+
+    monkeypatch.setattr(settings, "DETECTOR", "yolo")
+    monkeypatch.setattr(registry.model_registry, "is_loaded", lambda *a: True)  # a later request loaded it
+    res = client.get("/ready")
+    assert res.status_code == 200 and res.json()["state"] == "loaded"
+    assert registry.warmup_in_background() is None
+
+
+def test_debug_version_is_cached():
+    first = client.get("/api/v1/debug/version").json()
+    assert first["numpy"] and first["opencv"]
+    assert client.get("/api/v1/debug/version").json() == first
+    assert "torch" not in sys.modules or first["torch"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_arbiter_replaces_dead_workers(tmp_path):
+    def worker():
+        (tmp_path / str(os.getpid())).touch()
+        time.sleep(30)
+
+    arbiter = Arbiter(worker, workers=2, graceful_timeout=5)
+    runner = threading.Thread(target=arbiter.run)
+    runner.start()
+
+    def pids(n):
+        deadline = time.time() + 10
+        while len(os.listdir(tmp_path)) < n and time.time() < deadline:
+            time.sleep(0.02)
+        return sorted(int(p) for p in os.listdir(tmp_path))
+
+    try:
+        first = pids(2)
+        assert len(first) == 2
+        os.kill(first[0], signal.SIGKILL)
+        assert len(pids(3)) == 3
+    finally:
+        arbiter.request_stop()
+        runner.join(15)
+    assert not runner.is_alive() and arbiter.children == {}
+    for pid in pids(3):
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
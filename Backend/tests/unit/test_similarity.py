@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+from app.main import app
+from app.models.detection import DetectionBatch, HIST_BINS
+from app.services.similarity import HistogramIndex
+
+client = TestClient(app)
+
+
+def _batch(hists, labels):
+    names = sorted(set(labels))
+    n = len(hists)
+    return DetectionBatch(np.tile([0, 0, 10, 10], (n, 1)), np.ones(n), [names.index(lb) for lb in labels], names,
+                          histograms=np.asarray(hists, dtype=np.float32), valid=np.ones(n, dtype=bool))
+
+
+def _onehot(i):
+    v = np.zeros(HIST_BINS, dtype=np.float32)
+    v[i] = 1.0
+    return v
+
+
+def test_index_search_filter_remove(tmp_path):
+    index = HistogramIndex(str(tmp_path / "index"))
+    assert index.search(_onehot(0)) == []
+    assert index.add("a" * 32, _batch([_onehot(0), _onehot(1)], ["dog", "car"])) == 2
+    assert index.add("b" * 32, _batch([_onehot(0) * 0.9 + _onehot(2) * 0.1], ["dog"])) == 1
+    assert index.stats() == {"rows": 3, "live": 3, "labels": 2}
+
+    for metric in ("l2", "cosine", "intersection"):
+        hits = index.search(_onehot(0), k=2, metric=metric)
+        assert [(h["result_id"][0], h["object"]) for h in hits] == [("a", 0), ("b", 0)]
+    assert [h["label"] for h in index.search(_onehot(0), k=5, labels=["car"])] == ["car"]
+    assert index.search(_onehot(0), labels=["cat"]) == []
+
+    q = index.get("a" * 32, 0)
+    assert q["label"] == "dog" and q["bbox"] == [0, 0, 10, 10]
+    hits = index.search(q["vector"], k=1, exclude_row=q["row"])
+    assert hits[0]["result_id"] == "b" * 32
+
+    # a second handle on the same directory sees appends and deletes
+    other = HistogramIndex(index.directory)
+    assert index.remove("b" * 32) == 1
+    assert [h["result_id"][0] for h in other.search(_onehot(0), k=5)] == ["a", "a"]
+    assert index.remove_many(["a" * 32, "b" * 32, "c" * 32]) == 2  # already removed rows don't count
+    assert other.stats()["live"] == 0
+    index.clear()
+    assert other.stats()["rows"] == 0
+
+
+def test_search_similar_endpoints():
+    ids = []
+    for i, x in enumerate((20, 60)):
+        # same object in a different place: different bytes, same histogram
+        img = np.zeros((120, 160, 3), dtype=np.uint8)
+        cv2.rectangle(img, (x, 20), (x + 50, 70), (255, 255, 255), -1)
+        data = cv2.imencode(".png", img)[1].tobytes()
+        res = client.post("/api/v1/analyze?detector=contour", files={"file": (f"s{i}.png", data, "image/png")})
+        assert res.status_code == 200
+        ids.append(res.json()["history_id"])
+
+    res = client.get("/api/v1/search/similar", params={"history_id": ids[0], "k": 5})
+    assert res.status_code == 200
+    body = res.json()
+    matches = body["queries"][0]["matches"]
+    assert matches and matches[0]["distance"] < 1e-3
+    assert all(m["annotated_url"].startswith("/api/v1/annotated/") for m in matches)
+
+    res = client.post("/api/v1/search/similar?detector=contour&k=3",
+                      files={"file": ("q.png", data, "image/png")})
+    assert res.status_code == 200
+    assert res.json()["queries"][0]["matches"][0]["distance"] < 1e-3
+
+    assert client.get("/api/v1/search/similar", params={"history_id": "missing"}).status_code == 404
+    for hid in ids:
+        client.delete(f"/api/v1/history/{hid}")
+    res = client.get("/api/v1/search/similar", params={"history_id": ids[0]})
+    assert res.status_code == 404
+
+
+def test_similar_matches_link_eager_annotations(monkeypatch):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "EAGER_ANNOTATE", True)
+    img = np.zeros((100, 140, 3), dtype=np.uint8)
+    cv2.rectangle(img, (30, 30), (90, 80), (255, 255, 255), -1)
+    data = cv2.imencode(".png", img)[1].tobytes()
+    body = client.post("/api/v1/analyze?detector=contour", files={"file": ("e.png", data, "image/png")}).json()
+    assert body["annotated_url"].startswith("/static/annotated/")
+    res = client.post("/api/v1/search/similar?detector=contour&k=50", files={"file": ("q.png", data, "image/png")})
+    urls = {m["result_id"]: m["annotated_url"] for q in res.json()["queries"] for m in q["matches"]}
+    assert urls[body["history_id"]] == body["annotated_url"]
+    client.delete(f"/api/v1/history/{body['history_id']}")
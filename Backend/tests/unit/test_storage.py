@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.config import settings
+from app.utils.storage import sniff_image
+
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("ext,fmt", [(".png", "png"), (".jpg", "jpeg"), (".bmp", "bmp"), (".webp", "webp"), (".tiff", "tiff")])
+def test_sniff_reads_format_and_size(ext, fmt):
+    img = np.zeros((37, 53, 3), dtype=np.uint8)
+    data = cv2.imencode(ext, img)[1].tobytes()
+    assert sniff_image(data) == (fmt, 53, 37)
+
+def test_rejects_unsupported_and_oversized(monkeypatch):
+    response = client.post(
+        "/api/v1/analyze", files={"file": ("fake.png", b"GIF8 not really", "image/png")}
+    )
+    assert response.status_code == 415
+
+    png = cv2.imencode(".png", np.zeros((40, 40, 3), dtype=np.uint8))[1].tobytes()
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 1000)
+    response = client.post("/api/v1/analyze", files={"file": ("big.png", png, "image/png")})
+    assert response.status_code == 413
+
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", 10)
+    response = client.post("/api/v1/analyze", files={"file": ("big.png", png, "image/png")})
+    assert response.status_code == 413
+
+def test_rejects_images_without_readable_dimensions(monkeypatch):
+    from app.utils.storage import check_image_header, UploadRejected
+    sof_less = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + b"\x00" * 64  # JPEG with no frame header
+    with pytest.raises(UploadRejected) as e:
+        check_image_header(sof_less)
+    assert e.value.status_code == 415
+    response = client.post("/api/v1/analyze", files={"file": ("x.jpg", sof_less, "image/jpeg")})
+    assert response.status_code == 415
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 0)
+    assert check_image_header(sof_less) == ("jpeg", None, None)
+
+def test_tiff_with_trailing_ifd(monkeypatch):
+    # libtiff writes the first IFD after the pixel data, well past the sniffed header
+    from app.utils.storage import HEADER_BYTES
+    img = np.random.default_rng(0).integers(0, 256, (1500, 1500, 3), dtype=np.uint8)
+    data = cv2.imencode(".tiff", img)[1].tobytes()
+    assert int.from_bytes(data[4:8], "little") > HEADER_BYTES
+    response = client.post("/api/v1/analyze?detector=contour", files={"file": ("scan.tiff", data, "image/tiff")})
+    assert response.status_code == 200
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 1000)
+    response = client.post("/api/v1/analyze?detector=contour", files={"file": ("scan.tiff", data, "image/tiff")})
+    assert response.status_code == 413
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+from app.core.config import settings
+from app.models.detection import contour_batch
+from app.services.inference import run_inference
+from app.services.tiling import detect_tiled, tile_windows
+from app.utils.image import bmp_view, open_mapped
+
+
+def test_tile_windows_cover_image_with_overlap():
+    wins = tile_windows(1000, 2500, 1024, 128)
+    assert {(w[1], w[3]) for w in wins} == {(0, 1000)}
+    xs = sorted(w[0] for w in wins)
+    assert xs == [0, 896, 1476]
+    assert max(w[2] for w in wins) == 2500
+    assert tile_windows(100, 100, 1024, 128) == [(0, 0, 100, 100)]
+
+def test_bmp_view_matches_decode(tmp_path):
+    img = np.random.default_rng(0).integers(0, 256, (37, 53, 3), dtype=np.uint8)
+    data = cv2.imencode(".bmp", img)[1].tobytes()
+    assert np.array_equal(bmp_view(data), img)
+    path = tmp_path / "x.bmp"
+    path.write_bytes(data)
+    mapped = open_mapped(str(path))
+    assert not mapped.flags.writeable
+    assert np.array_equal(mapped, img)
+    assert bmp_view(cv2.imencode(".png", img)[1].tobytes()) is None
+
+def test_detect_tiled_merges_duplicates_in_overlap():
+    img = np.zeros((300, 700, 3), dtype=np.uint8)
+    cv2.rectangle(img, (330, 100), (360, 140), (255, 255, 255), -1)  # inside both tiles' overlap
+    cv2.rectangle(img, (20, 20), (60, 60), (255, 255, 255), -1)
+    dets = detect_tiled(img, lambda t: contour_batch(t, fallback=False), tile=400, overlap=100).to_detections()
+    assert len(dets) == 2
+    assert any(abs(d.bbox[0] - 330) <= 3 and abs(d.bbox[2] - 360) <= 3 for d in dets)
+
+def test_run_inference_tiles_large_images(monkeypatch):
+    monkeypatch.setattr(settings, "TILE_MODE", "on")
+    monkeypatch.setattr(settings, "TILE_SIZE", 256)
+    img = np.zeros((600, 600, 3), dtype=np.uint8)
+    cv2.rectangle(img, (500, 500), (540, 540), (255, 255, 255), -1)
+    dets = run_inference(img, detector_override="contour")
+    assert len(dets) == 1 and abs(dets[0].bbox[0] - 500) <= 3
+    empty = run_inference(np.zeros((600, 600, 3), dtype=np.uint8), detector_override="contour")
+    assert empty[0].bbox == [0, 0, 600, 600]
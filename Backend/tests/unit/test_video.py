@@ -0,0 +1,98 @@
+import json
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.video import open_video, sample_frames, frame_stride, LabelTimeline
+
+client = TestClient(app)
+
+
+def _write_video(path, n=30, fps=10.0, size=(96, 64)):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    if not writer.isOpened():
+        pytest.skip("no MJPG writer in this OpenCV build")
+    for i in range(n):
+        img = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        if i >= n // 2:  # second half: a white box appears
+            cv2.rectangle(img, (20, 15), (60, 50), (255, 255, 255), -1)
+        writer.write(img)
+    writer.release()
+    return path
+
+
+def test_sample_frames_stride_and_scene(tmp_path):
+    path = str(_write_video(tmp_path / "v.avi"))
+    cap, info = open_video(path)
+    assert info.fps == pytest.approx(10.0)
+    assert frame_stride(info, fps=2.0) == 5
+    assert [f[0] for f in sample_frames(cap, info, stride=5)] == [0, 5, 10, 15, 20, 25]
+    cap.release()
+
+    cap, info = open_video(path)
+    # static scene, one cut halfway through
+    kept = [(i, t) for i, t, _ in sample_frames(cap, info, scene_threshold=0.05)]
+    cap.release()
+    assert kept == [(0, 0.0), (15, 1500.0)]
+
+
+def test_label_timeline_segments():
+    tl = LabelTimeline()
+    for t, labels in [(0, ["a"]), (500, ["a", "a", "b"]), (1000, []), (1500, ["a"])]:
+        tl.add(t, labels)
+    s = tl.summary()
+    assert list(s) == ["a", "b"]
+    assert s["a"]["segments"] == [[0, 500], [1500, 1500]]
+    assert s["a"]["frames"] == 3 and s["a"]["detections"] == 4 and s["a"]["peak"] == 2
+    assert tl.peak == 3 and tl.samples == 4
+
+
+def test_analyze_video_streams_frames_and_records_history(tmp_path):
+    data = _write_video(tmp_path / "clip.avi").read_bytes()
+    res = client.post("/api/v1/analyze/video?detector=contour&every=5",
+                      files={"file": ("clip.avi", data, "video/x-msvideo")})
+    assert res.status_code == 200
+    lines = [json.loads(l) for l in res.text.splitlines()]
+    frames, summary = lines[:-1], lines[-1]
+    assert [f["frame"] for f in frames] == [0, 5, 10, 15, 20, 25]
+    assert summary["message"] == "analysis_complete"
+    assert summary["frames_sampled"] == 6
+    hist = client.get(f"/api/v1/history/{summary['history_id']}")
+    assert hist.status_code == 200
+    assert hist.json()["objects_count"] == summary["objects_count"]
+
+
+def test_analyze_video_rejects_non_video():
+    res = client.post("/api/v1/analyze/video", files={"file": ("x.txt", b"hello", "text/plain")})
+    assert res.status_code == 400
+    res = client.post("/api/v1/analyze/video", files={"file": ("x.mp4", b"not a video", "video/mp4")})
+    assert res.status_code == 400
+
+
+def test_abandoned_video_response_releases_slot_and_file(tmp_path):
+    # the client goes away before the body is iterated: the background task cleans up
+    import asyncio, io, os
+    from starlette.datastructures import Headers, UploadFile
+    from app.api.v1.endpoints import analyze_video_file
+    from app.services.video import try_acquire_slot, release_slot
+    from app.core.config import settings
+    data = _write_video(tmp_path / "gone.avi").read_bytes()
+
+    async def abandon():
+        upload = UploadFile(io.BytesIO(data), filename="gone.avi", headers=Headers({"content-type": "video/x-msvideo"}))
+        res = await analyze_video_file(file=upload, conf=0.25, max_dets=100, detector="contour",
+                                       every=5, fps=None, scene=None)
+        await res.background()
+        await res.background()  # idempotent: the slot is released once
+    def videos():
+        return {f for _, _, files in os.walk(settings.UPLOAD_DIR) for f in files if f.endswith("_gone.avi")}
+    before = videos()
+    asyncio.run(abandon())
+    assert videos() == before
+    slots = []
+    while try_acquire_slot():
+        slots.append(1)
+    for _ in slots:
+        release_slot()
+    assert len(slots) == max(1, settings.VIDEO_MAX_ACTIVE)
@@ -312,7 +312,11 @@ export default function App() {
                   <div key={it.id} className="history__item">
                     <a className="history__thumb" href={fullHref} target="_blank" rel="noreferrer">
                       {hrefPath ? (
-                        <img src={backendBase + hrefPath} alt={it.filename} />
+                        <img
+                          src={backendBase + (it.annotated_thumb_url || hrefPath)}
+                          alt={it.filename}
+                          loading="lazy"
+                        />
                       ) : (
                         <div className="history__placeholder">no image</div>
                       )}